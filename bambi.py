@@ -3,18 +3,23 @@ import math # needed for flight time calculation
 from datetime import datetime, timedelta # also needed for flight time calculation
 import os # needed to interact with os files
 import logging # essential for proper logging
-import sys
 import db_get # all database operations for getting data
 import db_set # all database operations for any data modifications
 import utils
+import db_cache
 import db_initialisation
+import db_migrations
+import route_graph
+import great_circle
+import route_feasibility
 
 # BAMBI
 # Bath Airline Management & Booking Interface
 # Technically it's not "booking" anything yet but I wanted a good acronym!
 
 # Original plan was to present user with an option to chose CLI mode or
-# If they had flask installed, a flask-based web app mode as another option but I ran out of time for the flask option so everything redirects to CLI
+# If they had flask installed, a flask-based web app mode as another option - that's now web_app.py, a JSON API for
+# running several dispatchers against one database at once
 
 # I wanted to provide a pre-populated database but also
 # demonstrate the code used to create it in the first instance and so it can be setup from scratch if the user requires
@@ -26,6 +31,9 @@ import db_initialisation
 # it may be overkill here but I want to do it properly and want to keep up with good practice!
 LOGFILE_NAME = 'bambi.log'
 DB_FILE = "bambi.db"
+# concurrent (WAL) suits several operators sharing one file, see db_connection.PRAGMA_PROFILES for the alternatives
+DB_PROFILE = "concurrent"
+ITINERARY_COUNT = 3 # how many alternative itineraries the (I) search on the city/airport screen shows
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename=LOGFILE_NAME, filemode='w')
 logger = logging.getLogger(__name__)
@@ -42,32 +50,38 @@ else:
 
 logger.info(f"Starting BAMBI - Log level: {LOG_LEVEL}")
 logger.info(f"Database file used - {DB_FILE}")
+logger.info(f"Database profile used - {DB_PROFILE}")
 
 # start_journey is the basic entrypoint to the application once we have setup/checked the DB
 # this script covers the core CLI interface approach requested - I will tackle the web based approach in a separate script
 def start_journey():
     if(utils.check_flask()):
-        print("Flask installation detected, but web mode disabled")
+        print("Flask installation detected")
 
         print("Choose an option:")
         print("1. Run in CLI mode - please maximise your window for best results")
-        #print("2. Run in Web mode")
+        print("2. Run in Web mode")
 
         user_choice = input("Select mode (1 or 2)\n")
         if user_choice == "1":
             logger.info("User selected CLI mode")
             cli_mode_init()
-        #elif user_choice == "2":
-        #    logger.info("User selected web mode")
-        #    web_mode()
+        elif user_choice == "2":
+            logger.info("User selected web mode")
+            web_mode()
         else:
             print("Invalid choice, please start again")
     else:
         print("Flask not installed, running at command line only.")
-        #print("Install Flask to enable web app option")
+        print("Install Flask to enable web app option")
         print("Starting CLI mode instead\n\n")
         cli_mode_init()
 
+def web_mode():
+    # the web app lives in web_app.py, only imported here because it needs Flask
+    import web_app
+    web_app.run(DB_FILE)
+
 def cli_mode_init():
     os.system('cls')
     logger.info("Started CLI mode")
@@ -89,10 +103,61 @@ def cli_mode_init():
     input("\n    Press Enter To Continue")
     # ASCII Art generated here - https://patorjk.com/software/taag/ - and 1 second timer
     # is used to provide a visually clear delineation between initialisation tasks and activation of CLI mode
-    cli_mainmenu()
+    run_screens(cli_mainmenu)
+
+# Screen navigation
+# Every cli_* screen used to open the next one by calling it - main menu > flights > aircraft > flights > main menu
+# and so on - so none of them ever returned and each screen visited added another frame to the stack. An operator who
+# left BAMBI open all shift eventually hit RecursionError and lost the session.
+# Screens now return the next screen (the function itself, not called) and run_screens calls them one after another,
+# so the stack is the same depth after ten thousand screens as after one. Returning None quits.
+#
+# Screen hooks are called after every transition with (screen name, next screen name or None, seconds on the screen)
+# for timing and tests - add_screen_hook adds one, record_screen_time is there from the start and log_screen_stats
+# writes what it gathered to the log on quit.
+_screen_hooks = []
+_screen_stats = {}
+
+
+def add_screen_hook(hook):
+    _screen_hooks.append(hook)
+
+
+def remove_screen_hook(hook):
+    _screen_hooks.remove(hook)
+
+
+def screen_name(screen):
+    return screen.__name__ if screen is not None else None
+
+
+def run_screens(screen):
+    while screen is not None:
+        started = time.perf_counter()
+        next_screen = screen()
+        elapsed = time.perf_counter() - started
+        for hook in _screen_hooks:
+            hook(screen_name(screen), screen_name(next_screen), elapsed)
+        screen = next_screen
+
+
+def record_screen_time(name, next_name, elapsed):
+    # {screen name: [times shown, total seconds]} - the time includes the operator reading and typing
+    screen_stats = _screen_stats.setdefault(name, [0, 0.0])
+    screen_stats[0] += 1
+    screen_stats[1] += elapsed
+    logger.debug(f"Screen {name} -> {next_name} after {elapsed:.3f}s")
 
+
+def log_screen_stats():
+    for name, (shown_count, total_seconds) in sorted(_screen_stats.items(), key=lambda item: -item[1][1]):
+        logger.info(f"Screen {name}: shown {shown_count} times, {total_seconds:.1f}s total")
+
+
+add_screen_hook(record_screen_time)
+
+@utils.trace
 def cli_mainmenu():
-    utils.log_active_function()
     while True: # added this to handle invalid user inputs
         os.system('cls')
         print("Enter a letter to view or manage data\n\n")
@@ -107,19 +172,22 @@ def cli_mainmenu():
         user_input = input().lower()
         logger.info(f"User selected input {user_input}")
         if user_input == "c":
-            cli_view_cityairport()
+            return cli_view_cityairport
         elif user_input == "s":
-            cli_view_schedules()
+            return cli_view_schedules
         elif user_input == "p":
-            cli_view_pilots()
+            return cli_view_pilots
         elif user_input == "a":
-            cli_view_aircraft()
+            return cli_view_aircraft
         elif user_input == "f":
-            cli_view_flights()
+            return cli_view_flights
         elif user_input == "q":
             logging.info("User quit application")
+            utils.log_trace_stats()
+            db_cache.log_cache_stats()
+            log_screen_stats()
             print("Thank you for using BAMBI!")
-            sys.exit()
+            return None
         else:
             print("Invalid option, please select a valid menu option or (Q) to quit")
 
@@ -150,9 +218,9 @@ def cli_mainmenu():
 # However when it came to adding flights it was difficult for users to remember the IDs they needed
 # So I split the function into cli_* for the operations
 # and render* for drawing the table, allowing me to "refresh user memories" whenever needed
+@utils.trace
 def cli_view_cityairport():
     # This function is responsible for rendering the cities & airports served and allowing users to add/edit/remove cities/airports
-    utils.log_active_function()
     os.system('cls')
     print("All served cities, their airport(s) and routing codes are shown below\n")
     render_cityairport()
@@ -166,7 +234,7 @@ def cli_view_cityairport():
     print("City Management")
     print("(C) to add a new city                            (M) to modify an existing city        (X) to delete an city\n")
     print("Route Management")
-    print("(T) to add a new route                            (L) to delete a route\n")
+    print("(T) to add a new route                            (L) to delete a route                 (I) to find itineraries between cities\n")
 
     print("\nWARNING - Cannot delete a city/airport assigned to an active route or flight")
 
@@ -188,9 +256,9 @@ def cli_view_cityairport():
                 os.system('cls')
                 print("Airport added successfully successfully")
                 time.sleep(1)
-                cli_view_cityairport()
+                return cli_view_cityairport
             elif new_airport_code == "CANCEL":
-                cli_mainmenu()
+                return cli_mainmenu
             else:
                 print(f"Airport code {new_airport_code} invalid, please enter a valid, unique airport code")
         else:
@@ -198,7 +266,7 @@ def cli_view_cityairport():
             print("\nWARNING\n")
             print("Invalid city chosen - please choose an existing city")
             time.sleep(1)
-            cli_view_cityairport()
+            return cli_view_cityairport
 
     elif user_input == "e":
         logging.info("User modifying an existing airport")
@@ -217,7 +285,7 @@ def cli_view_cityairport():
                     os.system('cls')
                     print("Airport name & code updated successfully")
                     time.sleep(1)
-                    cli_view_cityairport()
+                    return cli_view_cityairport
                 else:
                     print("Operation failed, please check the log")
             else:
@@ -225,7 +293,7 @@ def cli_view_cityairport():
                 os.system('cls')
                 print("Invalid entry, please choose an existing airport ID")
                 time.sleep(1)
-                cli_view_cityairport()
+                return cli_view_cityairport
 
         except ValueError:
             logging.info("User did not enter integer airport_id")
@@ -250,19 +318,19 @@ def cli_view_cityairport():
                     os.system('cls')
                     print("Airport deleted successfully")
                     time.sleep(1)
-                    cli_view_cityairport()
+                    return cli_view_cityairport
                 else:
                     logging.info("Airport exists in a route, NOT deleted")
                     os.system('cls')
                     print("Airport exists as part of a route, cannot delete")
                     time.sleep(1.5)
-                    cli_view_cityairport()
+                    return cli_view_cityairport
             else:
                 logging.info("User did not enter valid integer airport_id")
                 os.system('cls')
                 print("Invalid entry, please choose an existing airport ID")
                 time.sleep(1)
-                cli_view_cityairport()
+                return cli_view_cityairport
 
         except ValueError:
             logging.info("User did not enter integer airport_id")
@@ -278,14 +346,14 @@ def cli_view_cityairport():
             print("\n WARNING\n")
             print(f"City - {new_city} - already exists, please review available cities and try again")
             logging.info(f"City creation failed - {new_city} - user tried to create pre-existing city")
-            cli_view_cityairport()
+            return cli_view_cityairport
         else:
             logging.info(f"Creating new city with name - {new_city}")
             db_set.add_city(DB_FILE, new_city)
             os.system('cls')
             print(f"\nNew city {new_city} created successfully")
             time.sleep(1)
-            cli_view_cityairport()
+            return cli_view_cityairport
 
     elif user_input == "m":
         existing_city_id = input("Select ID for the city you wish to rename\n")
@@ -302,7 +370,7 @@ def cli_view_cityairport():
                     os.system('cls')
                     print("City renamed successfully")
                     time.sleep(1)
-                    cli_view_cityairport()
+                    return cli_view_cityairport
                 else:
                     print("Operation failed, please check the log")
             else:
@@ -310,7 +378,7 @@ def cli_view_cityairport():
                 os.system('cls')
                 print("Invalid entry, please choose an existing city ID")
                 time.sleep(1)
-                cli_view_cityairport()
+                return cli_view_cityairport
 
         except ValueError:
             logging.info("User did not enter integer city_id")
@@ -339,20 +407,20 @@ def cli_view_cityairport():
                     os.system('cls')
                     print("City deleted successfully")
                     time.sleep(2)
-                    cli_view_cityairport()
+                    return cli_view_cityairport
 
                 else:
                     logging.info("User tried to delete city mapped to an airport")
                     os.system('cls')
                     print("Please delete ALL airports mapped to a city before deleting a city.")
                     time.sleep(1)
-                    cli_view_cityairport()
+                    return cli_view_cityairport
             else:
                 logging.info("User did not enter valid integer city_id")
                 os.system('cls')
                 print("Invalid entry, please choose an existing city ID")
                 time.sleep(1)
-                cli_view_cityairport()
+                return cli_view_cityairport
 
         except ValueError:
             logging.info("User did not enter integer city_id")
@@ -378,24 +446,24 @@ def cli_view_cityairport():
                         os.system('cls')
                         print("Airport-City mapping updated successfully")
                         time.sleep(1)
-                        cli_view_cityairport()
+                        return cli_view_cityairport
                     else:
                         os.system('cls')
                         print("Operation failed, please check the log")
                         time.sleep(1)
-                        cli_view_cityairport()
+                        return cli_view_cityairport
                 else:
                     logging.info("User did not enter valid city_id")
                     os.system('cls')
                     print("Invalid entry, please choose an existing city ID")
                     time.sleep(1)
-                    cli_view_cityairport()
+                    return cli_view_cityairport
             else:
                 logging.info("User did not enter integer airport_id")
                 os.system('cls')
                 print("Invalid entry, please choose an existing airport ID")
                 time.sleep(1)
-                cli_view_cityairport()
+                return cli_view_cityairport
 
 
         except ValueError:
@@ -411,8 +479,7 @@ def cli_view_cityairport():
             os.system('cls')
             print("Airport does not exist, please try again")
             time.sleep(1)
-            cli_view_cityairport()
-            return
+            return cli_view_cityairport
 
         logging.info(f"New origin airport ID = {origin_airport}")
 
@@ -423,8 +490,7 @@ def cli_view_cityairport():
             os.system('cls')
             print("Airport does not exist, please try again")
             time.sleep(1)
-            cli_view_cityairport()
-            return
+            return cli_view_cityairport
         logging.info(f"New destination airport ID = {destination_airport}")
 
         # check if this route already exists
@@ -432,16 +498,21 @@ def cli_view_cityairport():
             os.system('cls')
             print("The proposed route already exists - not creating duplicate")
             time.sleep(1)
-            cli_view_cityairport()
-            return
-
-        # Get the distance and add the route
-        route_distance = input("Please enter the route distance in km\n")
-        route_distance = int(route_distance)
+            return cli_view_cityairport
+
+        # Get the distance and add the route - suggested from the airports' coordinates when they have them
+        suggested_distance = great_circle.suggest_route_distance(DB_FILE, origin_airport, destination_airport)
+        if suggested_distance:
+            route_distance = input(f"Please enter the route distance in km, or press Enter for the great-circle distance of {suggested_distance}km\n")
+            route_distance = int(route_distance) if route_distance.strip() else suggested_distance
+            if abs(route_distance - suggested_distance) > great_circle.ROUTE_DISTANCE_TOLERANCE * suggested_distance:
+                print(f"Note - {route_distance}km is a long way from the great-circle distance of {suggested_distance}km")
+        else:
+            route_distance = input("Please enter the route distance in km\n")
+            route_distance = int(route_distance)
         if not route_distance > 0:
             print("Please only enter positive values")
-            cli_view_cityairport()
-            return
+            return cli_view_cityairport
 
         # now we try to add the route
         origin_cityairport_id = db_get.get_cityairport_for_airport(DB_FILE, origin_airport)[0]
@@ -450,11 +521,29 @@ def cli_view_cityairport():
             os.system('cls')
             print("New route added successfully")
             time.sleep(2)
-            cli_view_cityairport()
+            return cli_view_cityairport
         else:
             print("Error adding route, please check log file")
     elif user_input == "f":
-        cli_view_flights()
+        return cli_view_flights
+
+    elif user_input == "i":
+        # connections come from the in-memory route graph rather than a query per leg, see route_graph.py
+        origin_city_id = parse_id(input("Enter ID of the city to travel from\n"))
+        destination_city_id = parse_id(input("Enter ID of the city to travel to\n"))
+        os.system('cls')
+        shortest_itineraries = route_graph.find_city_itineraries(DB_FILE, origin_city_id, destination_city_id, k=ITINERARY_COUNT)
+        fewest_legs_itineraries = route_graph.find_city_itineraries(DB_FILE, origin_city_id, destination_city_id, by="legs")
+        if not shortest_itineraries:
+            print("No connection found between those cities")
+        else:
+            print(f"Shortest itineraries from {shortest_itineraries[0]['cities'][0]} to {shortest_itineraries[0]['cities'][-1]}\n")
+            for itinerary in shortest_itineraries:
+                print(f"{itinerary['distance']:>7}km   {itinerary['legs']} leg(s)   {' > '.join(itinerary['airports'])}   (route IDs {', '.join(str(route_id) for route_id in itinerary['route_ids'])})")
+            fewest_legs = fewest_legs_itineraries[0]
+            print(f"\nFewest legs - {fewest_legs['legs']} leg(s), {fewest_legs['distance']}km   {' > '.join(fewest_legs['airports'])}")
+        input("\nPress Enter To Continue")
+        return cli_view_cityairport
 
     elif user_input == "l":
 
@@ -473,19 +562,19 @@ def cli_view_cityairport():
                     db_set.delete_route(DB_FILE, route_to_delete)
                     print("Route deleted!")
                     time.sleep(1)
-                    cli_view_cityairport()
+                    return cli_view_cityairport
 
                 else:
                     os.system('cls')
                     print("Selected route is mapped to a flight - cannot delete")
                     time.sleep(1)
-                    cli_view_cityairport()
+                    return cli_view_cityairport
 
             else:
                 os.system('cls')
                 print("Selected route does not exist")
                 time.sleep(1)
-                cli_view_cityairport()
+                return cli_view_cityairport
 
 
 
@@ -494,13 +583,14 @@ def cli_view_cityairport():
             print("Invalid entry, please choose an existing route_to_delete ID")
 
     elif user_input == "b":
-        cli_mainmenu()
+        return cli_mainmenu
     else:
         print("Invalid choice")
-        cli_view_cityairport()
+    # anything that didn't pick another screen (invalid entries, cancelled changes) shows this one again
+    return cli_view_cityairport
 def render_cityairport():
     cityairport_rows = db_get.get_cities_airports(DB_FILE)  # calls the select query to view city/airport/cityairport mapping
-    logging.debug(f"cityairport_rows = {cityairport_rows}")
+    logging.debug("cityairport_rows = %s", utils.sample_rows(cityairport_rows))
 
     cityairport_headers = ["City ID", "City Name", "Airport ID", "Airport Name", "Airport Code"]
     logging.debug("Rendering headers")
@@ -512,9 +602,9 @@ def render_cityairport():
         # city = cityairport_row[1]
         # logging.debug(f"city is: {city}")
         airport_id = cityairport_row[2] if cityairport_row[2] is not None else "N/A"
-        logging.debug(f"cityairport_row[2] is: {airport_id}")
+        logging.debug("cityairport_row[2] is: %s", airport_id)
         airport = cityairport_row[3] if cityairport_row[3] is not None else "--UNASSIGNED--"
-        logging.debug(f"airport is {airport}")
+        logging.debug("airport is %s", airport)
         code = cityairport_row[4] if cityairport_row[4] is not None else "XXX"
         # assignments above are visual only, unaffecting the DB
         # this was tricky to sort out all the rendering logic with unassigned
@@ -534,8 +624,8 @@ def render_routes():
         print(
             f"{route_row[0]:<8}   {route_row[1]:<11}   {route_row[2]:<14}   {route_row[3]:<11}   {route_row[4]:<10}   {route_row[5]:<15}   {route_row[6]:<10}   {route_row[7]:<5}")
 
+@utils.trace
 def cli_view_schedules():
-    utils.log_active_function()
     os.system('cls')
     print("All active schedules can be seen below")
     print("These departure times are mandated by Air Traffic Control and cannot be changed\n")
@@ -546,12 +636,12 @@ def cli_view_schedules():
         user_input = input("\nPress (B) to return to the main menu\n")
 
         if user_input == "b":
-            cli_mainmenu()
+            return cli_mainmenu
     # I confess I ran out of time to add full add/edit/delete features to schedules so
     # instead assumed that air traffic control only lets us take off on the hour
     # and hence it's a schedule "Viewer"!
+@utils.trace
 def render_schedules():
-    utils.log_active_function()
     schedule_rows = db_get.get_schedules(DB_FILE)
 
 
@@ -561,8 +651,8 @@ def render_schedules():
 
     for schedule_row in schedule_rows:
         print(f"{schedule_row[0]:<11}   {schedule_row[1]:<14}")
+@utils.trace
 def cli_view_pilots():
-    utils.log_active_function()
     # This function allows users to view pilot data and leads to add/update/removal
 
     os.system('cls')
@@ -603,7 +693,7 @@ def cli_view_pilots():
             else:
                 print("Invalid pilot ID specified")
                 logging.info("Invalid pilot ID specified")
-                cli_view_pilots()
+                return cli_view_pilots
 
         # delete existing pilot NOT assigned to a flight
         elif user_input == "d":
@@ -624,7 +714,7 @@ def cli_view_pilots():
                 print("\n WARNING ")
                 print(f"Pilot {user_delete_pilot_id} is assigned to a flight - cannot delete an assigned pilot")
                 time.sleep(3)
-                cli_view_pilots()
+                return cli_view_pilots
 
             else:
                 logging.info(f"pilot id to be deleted is {user_delete_pilot_id}")
@@ -634,12 +724,12 @@ def cli_view_pilots():
                     db_set.delete_pilot(DB_FILE, int(user_delete_pilot_id))
                     print(f"Pilot deleted with ID {user_delete_pilot_id}")
                     os.system('cls')
-                    cli_view_pilots()
+                    return cli_view_pilots
                 else:
                     logging.info("User cancelled pilot deletion")
                     print("Pilot not deleted")
         elif user_input == "b":
-            cli_mainmenu()
+            return cli_mainmenu
         else:
             print("Please choose a valid option")
 
@@ -654,8 +744,8 @@ def render_pilots():
         print(
             f"{pilot_row[0]:<8}   {pilot_row[1]:<25}   {assigned_pilot_flight_id:<12}")
 
+@utils.trace
 def cli_view_aircraft():
-    utils.log_active_function()
     os.system('cls')
     while True:
         print("All active aircraft are shown below\n")
@@ -681,7 +771,7 @@ def cli_view_aircraft():
                 os.system('cls')
                 print(f"New aircraft {new_aircraft_name} added successfully successfully")
                 time.sleep(1)
-                cli_view_aircraft()
+                return cli_view_aircraft
 
 
         elif user_input == "r":
@@ -702,19 +792,18 @@ def cli_view_aircraft():
                         os.system('cls')
                         print("Aircraft renamed successfully")
                         time.sleep(1)
-                        cli_view_aircraft()
-                        break
+                        return cli_view_aircraft
                     else:
                         os.system('cls')
                         print("Invalid aircraft ID selected")
                         time.sleep(1)
-                        cli_view_aircraft()
+                        return cli_view_aircraft
 
                 except ValueError:
                     os.system('cls')
                     print("Invalid aircraft ID entered")
                     time.sleep(1)
-                    cli_view_aircraft()
+                    return cli_view_aircraft
 
 
         elif user_input == "d":
@@ -736,33 +825,32 @@ def cli_view_aircraft():
                             os.system('cls')
                             print("Aircraft deleted successfully")
                             time.sleep(1)
-                            cli_view_aircraft()
-                            break
+                            return cli_view_aircraft
                         else:
                             os.system('cls')
                             print("Invalid aircraft ID selected")
                             time.sleep(1)
-                            cli_view_aircraft()
+                            return cli_view_aircraft
                     else:
                         os.system('cls')
                         print("Aircraft is assigned to a flight - unable to delete")
                         time.sleep(1)
-                        cli_view_aircraft()
+                        return cli_view_aircraft
 
                 except ValueError:
                     os.system('cls')
                     print("Invalid aircraft ID entered")
                     time.sleep(1)
-                    cli_view_aircraft()
+                    return cli_view_aircraft
 
 
 
         elif user_input == "m":
-            cli_view_aircraftmodels()
+            return cli_view_aircraftmodels
         elif user_input == "f":
-            cli_view_flights()
+            return cli_view_flights
         elif user_input == "b":
-            cli_mainmenu()
+            return cli_mainmenu
         else:
             print("Please choose a valid option")
 def render_aircraft():
@@ -776,8 +864,8 @@ def render_aircraft():
         assigned_aircraft_flight_id = aircraft_row[4] if aircraft_row[4] is not None else 'Not Assigned'
         print(
             f"{aircraft_row[0]:<11}   {aircraft_row[1]:<25}   {aircraft_row[2]:<8}   {aircraft_row[3]:<12}   {aircraft_row[5]:<6}   {assigned_aircraft_flight_id:<12}")
+@utils.trace
 def cli_view_aircraftmodels():
-    utils.log_active_function()
     os.system('cls')
     while True:
         print("All active aircraft models are shown below\n")
@@ -800,11 +888,11 @@ def cli_view_aircraftmodels():
                 os.system('cls')
                 print(f"New aircraftmodel {new_aircraftmodel_name} added successfully successfully")
                 time.sleep(1)
-                cli_view_aircraftmodels()
+                return cli_view_aircraftmodels
             else:
                 os.system('cls')
                 print("An error has occurred please check the logs")
-                cli_mainmenu()
+                return cli_mainmenu
 
         elif user_input == "d":
 
@@ -826,30 +914,29 @@ def cli_view_aircraftmodels():
                             os.system('cls')
                             print("Aircraft Model deleted successfully")
                             time.sleep(1)
-                            cli_view_aircraftmodels()
-                            break
+                            return cli_view_aircraftmodels
                         else:
                             os.system('cls')
                             print("AircraftModel in use for active aircraft - cannot delete")
                             time.sleep(1)
-                            cli_view_aircraftmodels()
+                            return cli_view_aircraftmodels
                     else:
                         os.system('cls')
                         print("Invalid aircraft ID selected")
                         time.sleep(1)
-                        cli_view_aircraft()
+                        return cli_view_aircraft
 
                 except ValueError:
                     os.system('cls')
                     print("Invalid aircraft ID entered")
                     time.sleep(1)
-                    cli_view_aircraft()
+                    return cli_view_aircraft
 
         elif user_input == "k":
-            cli_view_aircraft()
+            return cli_view_aircraft
 
         elif user_input == "b":
-            cli_mainmenu()
+            return cli_mainmenu
         else:
             print("Please choose a valid option")
 def render_aircraftmodels():
@@ -864,15 +951,25 @@ def render_aircraftmodels():
     for aircraftmodel_row in aircraftmodel_rows:
         print(
             f"{aircraftmodel_row[0]:<8}   {aircraftmodel_row[1]:<12}   {aircraftmodel_row[2]:<15}   {aircraftmodel_row[3]:<17}")
-def render_flights():
-    flight_rows = db_get.get_flights(DB_FILE)  # calls the select query for pilots
+def render_flights(after_flight_id=None, before_flight_id=None):
+    # shows one page of flights (db_get.FLIGHT_PAGE_SIZE) rather than the whole list, see get_flights_page
+    # returns (first flight ID, last flight ID, has previous page, has next page) for the page navigation
+    # first flight ID is None when there are no flights at all
+    flight_rows = db_get.get_flights_page(DB_FILE, after_flight_id=after_flight_id, before_flight_id=before_flight_id)
+
+    if not flight_rows and before_flight_id is not None:
+        # everything before this page has been deleted since, start again from the top
+        return render_flights()
+    if not flight_rows and after_flight_id is not None:
+        # everything after the last page has been deleted since, show the page that now ends the list
+        return render_flights(before_flight_id=after_flight_id + 1)
 
     # added this after I deleted all flights and it broke the system!
     if not flight_rows:
         os.system('cls')
         print("No flight data found, returning to main menu")
         time.sleep(1)
-        cli_mainmenu()
+        return None, None, False, False
 
     flight_headers = ["Flight ID", "Flight No.", "Aircraft Name", "Aircraft Model", "Captain", "Orig. Airport",
                       "Dest. Airport", "Dep. Time", "Arr. Time"]
@@ -883,115 +980,142 @@ def render_flights():
     for flight_row in flight_rows:
         print(
             f"{flight_row[0]:<9}   {flight_row[1] or 'Not Set':<10}   {flight_row[2]:<25}   {flight_row[3]:<14}   {flight_row[4]:<25}   {flight_row[5]:<13}   {flight_row[6]:<13}   {flight_row[7]:<9}   {flight_row[8] or 'Unknown':<9}")
+
+    # one row either side is enough to know whether there's another page that way
+    first_flight_id, last_flight_id = flight_rows[0][0], flight_rows[-1][0]
+    has_previous_page = bool(db_get.get_flights_page(DB_FILE, page_size=1, before_flight_id=first_flight_id))
+    has_next_page = bool(db_get.get_flights_page(DB_FILE, page_size=1, after_flight_id=last_flight_id))
+    return first_flight_id, last_flight_id, has_previous_page, has_next_page
+@utils.trace
 def cli_view_flights():
-    utils.log_active_function()
     os.system('cls')
+    # the page currently shown, (N)ext and (P)revious move on from the flight IDs at either end of it
+    after_flight_id = None
+    before_flight_id = None
     while True:
 
         print("All active flights are shown below\n")
-        render_flights()
+        first_flight_id, last_flight_id, has_previous_page, has_next_page = render_flights(after_flight_id, before_flight_id)
+        if first_flight_id is None:
+            return cli_mainmenu
 
         print("\nChoose from the options below or press (B) to return to the main menu\n")
         print("All arrival/departure times are shown in UTC")
         print("This screen allows you to build a flight from all available aircraft, pilots, routes and schedules\n")
-        print("(F) to add a new flight\n(D) to delete a flight\n")
+        print("(F) to add a new flight\n(D) to delete a flight")
+        if has_previous_page:
+            print("(P) for the previous page of flights")
+        if has_next_page:
+            print("(N) for the next page of flights")
+        print()
 
 
 
         user_input = input().lower()
 
+        if user_input in ("n", "p"):
+            # already on the last/first page just shows the same page again
+            if user_input == "n" and has_next_page:
+                after_flight_id, before_flight_id = last_flight_id, None
+            elif user_input == "p" and has_previous_page:
+                after_flight_id, before_flight_id = None, first_flight_id
+            os.system('cls')
+            continue
+
         # because it's a command line tool I can't practically show all flights, aircraft, pilots etc. on the same screen so the user needs to know what they are entering
         # the compromise is if they make a mistake I redirect them to the relevant view so they can refresh their memory
 
         if user_input == "f":
             new_flight_number = input("Enter Flight Number - limit 6 chars\n")[:6]
+            # all four choices are collected first and then checked with a single get_flight_build_context query
+            # rather than a round trip to the database for every lookup and check
             # aircraft
             render_aircraft()
-            new_flight_aircraft = input("\nEnter Aircraft ID - limit 3 chars\n")[:3]
-            # getting this now for later use
-            new_flight_aircraftmodel_id = db_get.get_aircraftmodelid_for_aircraft(DB_FILE, new_flight_aircraft)
-            new_flight_aircraft_data = db_get.get_aircraftmodeldata_for_aircraftmodel(DB_FILE,
-                                                                                      new_flight_aircraftmodel_id)
-            print(f"\nAircraft chosen -")
-            print(f"Name - {db_get.get_aircraft_name(DB_FILE, new_flight_aircraft)[0]}")
-            print(f"Model - {new_flight_aircraft_data[0][2]}, Range - {new_flight_aircraft_data[0][0]}km, Speed - {new_flight_aircraft_data[0][1]}km/h\n")
-            # check if the chosen aircraft is already allocated to a flight
-            if db_get.check_attribute_in_flight(DB_FILE, "aircraft_id", new_flight_aircraft):
-                logging.info("Aircraft already allocated to flight")
-                print("Selected aircraft is already allocated to a flight - resetting flight entry")
-                time.sleep(3)
-                cli_view_flights()
-                return
+            new_flight_aircraft = parse_id(input("\nEnter Aircraft ID - limit 3 chars\n")[:3])
+            # route
+            render_routes()
+            new_flight_route = parse_id(input("\nEnter Route ID - limit 3 chars\n")[:3])
+            #pilot
+            render_pilots()
+            new_flight_pilot = parse_id(input("\nEnter Pilot ID - limit 3 chars\n")[:3])
+            #schedule
+            new_flight_schedule = parse_id(input("\nEnter Scheduled departure hour from 1 to 24 (01:00 to 00:00)\n")[:3])
+
+            flight_context = db_get.get_flight_build_context(DB_FILE, new_flight_aircraft, new_flight_route, new_flight_pilot, new_flight_schedule)
+            if not flight_context:
+                os.system('cls')
+                print("An error has occurred please check the logs")
+                return cli_mainmenu
 
-            if not db_get.check_valid_aircraft(DB_FILE, new_flight_aircraft):
+            if not flight_context["aircraft_exists"]:
                 logging.info("Aircraft invalid")
                 print("Invalid aircraft chosen, resetting flight entry - showing user available aircraft")
                 time.sleep(3)
-                cli_view_aircraft()
-                return
+                return cli_view_aircraft
 
-            # route
-            render_routes()
-            new_flight_route = input("\nEnter Route ID - limit 3 chars\n")[:3]
-            new_flight_route = int(new_flight_route)
-            route_distance = db_get.get_distance_for_route(DB_FILE, new_flight_route)
-            route_data = db_get.get_airportcodes_on_route(DB_FILE, new_flight_route)
-            print(f"Origin Airport - {route_data[0]}, Destination Airport - {route_data[1]}")
-            if not db_get.check_valid_route(DB_FILE, new_flight_route):
-                    print("Invalid route chosen, resetting flight entry - showing user available routes")
-                    time.sleep(3)
-                    cli_view_cityairport()
-                    return
-
-                # check the range is OK
-
-            aircraft_range = int(new_flight_aircraft_data[0][0])
-            logging.debug(f"aircraft range = {aircraft_range}")
-
-            logging.debug(f"route distance = {route_distance}")
-
-            if (aircraft_range >= 1.1*(db_get.get_distance_for_route(DB_FILE, new_flight_route))):
-                print(f"Selected aircraft range is {aircraft_range}km")
-                print(f"Route distance is {route_distance}km\n")
+            print(f"\nAircraft chosen -")
+            print(f"Name - {flight_context['aircraft_name']}")
+            print(f"Model - {flight_context['aircraftmodel_name']}, Range - {flight_context['aircraftmodel_range']}km, Speed - {flight_context['aircraftmodel_speed']}km/h\n")
+
+            if not flight_context["route_exists"]:
+                print("Invalid route chosen, resetting flight entry - showing user available routes")
+                time.sleep(3)
+                return cli_view_cityairport
+            print(f"Origin Airport - {flight_context['origin_airport_code']}, Destination Airport - {flight_context['destination_airport_code']}")
+
+            # check the range is OK
+            aircraft_range = int(flight_context["aircraftmodel_range"])
+            route_distance = int(flight_context["route_distance"])
+            logging.debug("aircraft range = %s", aircraft_range)
+            logging.debug("route distance = %s", route_distance)
+
+            print(f"Selected aircraft range is {aircraft_range}km")
+            print(f"Route distance is {route_distance}km\n")
+            if flight_context["range_ok"]:
                 print("Aircraft range check OK - please continue adding details\n")
             else:
-                print(f"Selected aircraft range is {aircraft_range}km")
-                print(f"Route distance is {route_distance}km\n")
                 print("Selected aircraft does not have range for this route - range needs to be at least 110% of route distance, please try again")
+                capable_aircraft_ids = route_feasibility.aircraft_for_route(DB_FILE, new_flight_route)
+                if capable_aircraft_ids:
+                    print(f"Aircraft with the range for this route - ID {', '.join(str(aircraft_id) for aircraft_id in capable_aircraft_ids[:20])}"
+                          + (f" and {len(capable_aircraft_ids) - 20} more" if len(capable_aircraft_ids) > 20 else ""))
+                else:
+                    print("None of the aircraft have the range for this route")
                 time.sleep(2)
-                cli_view_flights()
-                return
+                return cli_view_flights
 
-            #pilot
-            render_pilots()
-            new_flight_pilot = input("\nEnter Pilot ID - limit 3 chars\n")[:3]
-            if not db_get.check_valid_pilot_id(DB_FILE, new_flight_pilot):
+            if not flight_context["pilot_exists"]:
                 print("Invalid pilot chosen, resetting flight entry - showing user available routes")
                 time.sleep(2)
-                cli_view_pilots()
-                return
-            print(f"Pilot {db_get.get_pilot_name(DB_FILE, new_flight_pilot)[0]} chosen as captain!\n")
+                return cli_view_pilots
+            print(f"Pilot {flight_context['pilot_name']} chosen as captain!\n")
 
-            #schedule
-            new_flight_schedule = input("\nEnter Scheduled departure hour from 1 to 24 (01:00 to 00:00)\n")[:3]
-            new_flight_schedule = int(new_flight_schedule)
-            if not db_get.check_valid_schedule(DB_FILE, new_flight_schedule):
+            if not flight_context["schedule_exists"]:
                 print("Invalid schedule chosen, resetting flight entry - showing user available schedules")
                 time.sleep(2)
-                cli_view_schedules()
-                return
+                return cli_view_schedules
 
-            flight_departure = db_get.get_departuretime_for_schedule(DB_FILE, new_flight_schedule)[0]
+            flight_departure = flight_context["departure_time"]
             print(f"Flight departure time set to - {flight_departure}")
+
+            # aircraft and pilots can fly as many flights as they like as long as the times don't overlap
+            if flight_context["aircraft_conflicts"] or flight_context["pilot_conflicts"]:
+                logging.info(f"Flight clashes - aircraft {flight_context['aircraft_conflicts']}, pilot {flight_context['pilot_conflicts']}")
+                if flight_context["aircraft_conflicts"]:
+                    print(f"Selected aircraft is already flying flight ID {', '.join(str(flight_id) for flight_id in flight_context['aircraft_conflicts'])} at that time")
+                if flight_context["pilot_conflicts"]:
+                    print(f"Selected pilot is already flying flight ID {', '.join(str(flight_id) for flight_id in flight_context['pilot_conflicts'])} at that time")
+                print("Resetting flight entry - please pick a different aircraft, pilot or departure time")
+                time.sleep(3)
+                return cli_view_flights
+
             print("Please wait, calculating expected flight arrival time")
             time.sleep(2)  # little artificial sleep to make it look like it's doing hardcore maths
             # calculating arrival time from aircraft details and schedule
 
-            new_flight_aircraft_data = db_get.get_aircraftmodeldata_for_aircraftmodel(DB_FILE,new_flight_aircraftmodel_id)
-            flight_route_distance = db_get.get_distance_for_route(DB_FILE, new_flight_route)
-            flight_aircraft_speed = int(new_flight_aircraft_data[0][1])
+            flight_aircraft_speed = int(flight_context["aircraftmodel_speed"])
 
-            new_flight_arrival_time = calculate_flight_time(flight_route_distance, flight_aircraft_speed,flight_departure)
+            new_flight_arrival_time = calculate_flight_time(route_distance, flight_aircraft_speed,flight_departure)
             print(f"Flight arrival times calculated to be: {new_flight_arrival_time}")
             time.sleep(3)
 
@@ -1002,11 +1126,11 @@ def cli_view_flights():
                 os.system('cls')
                 print(f"New flight added to database & registered with ATC!")
                 time.sleep(1)
-                cli_view_flights()
+                return cli_view_flights
             else:
                 os.system('cls')
                 print("An error has occurred please check the logs")
-                cli_mainmenu()
+                return cli_mainmenu
 
         elif user_input == "d":
 
@@ -1024,27 +1148,34 @@ def cli_view_flights():
                         os.system('cls')
                         print("Flight deleted successfully")
                         time.sleep(1)
-                        cli_view_flights()
-                        break
+                        return cli_view_flights
                     else:
                         os.system('cls')
                         print("Invalid Flight ID selected")
                         time.sleep(1)
-                        cli_view_flights()
+                        return cli_view_flights
 
 
                 except ValueError:
                     os.system('cls')
                     print("Invalid flight ID entered")
                     time.sleep(1)
-                    cli_view_flights()
+                    return cli_view_flights
 
         elif user_input == "b":
-            cli_mainmenu()
+            return cli_mainmenu
         elif user_input == "c":
-            cli_view_cityairport()
+            return cli_view_cityairport
         else:
-            cli_view_flights()
+            return cli_view_flights
+def parse_id(user_input):
+    # the flight builder used int() straight on the input which crashed BAMBI on anything that wasn't a number
+    # None simply fails the existence check in get_flight_build_context
+    try:
+        return int(user_input)
+    except ValueError:
+        logging.info(f"User entered non-integer ID {user_input}")
+        return None
 def calculate_flight_time(flight_route_distance, flight_aircraft_speed, flight_departure):
 # initially was going to do this as a trigger but it made more sense to break out logic like this into the python code
 # my departure times are stored as text in the DB because sqllite doesn't have a pure "time" datatype and I wanted something
@@ -1073,5 +1204,9 @@ def calculate_flight_time(flight_route_distance, flight_aircraft_speed, flight_d
     return new_flight_arrival_time
 
 if __name__ == "__main__":
-    db_initialisation.init(DB_FILE)
+    db_initialisation.init(DB_FILE, DB_PROFILE)
+    if os.path.exists(DB_FILE):
+        # brings databases created by older versions of BAMBI up to the current schema
+        for version, description, elapsed in db_migrations.migrate(DB_FILE):
+            print(f"Applied database migration {version} - {description} ({elapsed:.2f}s)")
     start_journey()
@@ -0,0 +1,406 @@
+import sys
+import csv
+import json
+import logging
+import argparse
+import contextlib
+import db_initialisation
+import db_migrations
+import db_get
+import db_set
+import flight_board
+import flight_import
+import flight_assignment
+import great_circle
+import route_graph
+import route_feasibility
+import change_feed
+
+# BAMBI command line
+# bambi.py is made for a person at a keyboard - menus, input() prompts, screen clears and pauses so messages can be
+# read. Scripts had to drive those menus with expect and sit through the pauses. This runs one operation per
+# command, straight against db_get/db_set, and prints the result as JSON (or CSV) with no prompts, clears or sleeps -
+#   python bambi_cli.py flights list --limit 50 --filter origin_airport=LHR
+#   python bambi_cli.py flights add --number BA123 --aircraft 3 --pilot 7 --route 2 --schedule 9
+#   python bambi_cli.py pilots add "Amelia Earhart"
+#   python bambi_cli.py routes add --origin 1 --destination 6            (distance from the airports' coordinates)
+#   python bambi_cli.py --format csv routes list
+#   python bambi_cli.py --help / python bambi_cli.py flights --help       for everything else
+#
+# Exit codes - 0 success, 1 the request was refused (doesn't exist, in use, failed a flight check), 2 bad arguments,
+# 3 database error. Errors are printed to stderr as {"error": "..."} so stdout only ever has results on it.
+# Like bambi.py it creates and seeds the database if it's missing and applies any pending migrations first; anything
+# those print goes to stderr.
+
+LOGFILE_NAME = "bambi.log"
+DB_FILE = "bambi.db"
+
+# same limits as the menus
+NAME_LENGTH_LIMIT = 25
+FLIGHT_NUMBER_LENGTH_LIMIT = 6
+
+EXIT_REFUSED = 1
+EXIT_DATABASE_ERROR = 3
+
+# column names for the rows db_get returns
+ROUTE_COLUMNS = ("route_id", "origin_city", "origin_airport", "origin_airport_code", "destination_city",
+                 "destination_airport", "destination_airport_code", "route_distance")
+CITYAIRPORT_COLUMNS = ("city_id", "city_name", "airport_id", "airport_name", "airport_code")
+PILOT_COLUMNS = ("pilot_id", "pilot_name", "assigned_flight_id")
+AIRCRAFT_COLUMNS = ("aircraft_id", "aircraft_name", "aircraftmodel_id", "aircraftmodel_name", "assigned_flight_id",
+                    "aircraftmodel_range")
+AIRCRAFTMODEL_COLUMNS = ("aircraftmodel_id", "aircraftmodel_name", "aircraftmodel_range", "aircraftmodel_speed")
+SCHEDULE_COLUMNS = ("schedule_id", "departure_time")
+
+logger = logging.getLogger(__name__)
+
+
+class CommandError(Exception):
+    def __init__(self, message, exit_code=EXIT_REFUSED):
+        super().__init__(message)
+        self.message = message
+        self.exit_code = exit_code
+
+
+def checked(result):
+    # db_get returns False on a database error, db_set returns False or None when a write failed
+    if result is False or result is None:
+        raise CommandError("Database error, please check the log", EXIT_DATABASE_ERROR)
+    return result
+
+
+def output(arguments, result):
+    # result is a list of dicts (a table) or a dict
+    if arguments.format == "csv" and isinstance(result, list):
+        columns = list(dict.fromkeys(column for row in result for column in row))
+        writer = csv.DictWriter(sys.stdout, fieldnames=columns, extrasaction="ignore", lineterminator="\n")
+        writer.writeheader()
+        for row in result:
+            writer.writerow({column: json.dumps(value) if isinstance(value, (dict, list)) else value
+                             for column, value in row.items()})
+    else:
+        json.dump(result, sys.stdout, indent=2 if arguments.pretty else None)
+        sys.stdout.write("\n")
+    sys.stdout.flush()
+
+
+def rows(result, columns):
+    return [dict(zip(columns, row)) for row in checked(result)]
+
+
+def refuse_unless(condition, message):
+    if not condition:
+        raise CommandError(message)
+
+
+# flights
+
+def flights_list(arguments):
+    filters = dict(arguments.filter or [])
+    try:
+        if arguments.all:
+            flights = list(db_get.iter_flights(DB_FILE, filters=filters))
+        else:
+            flights = checked(db_get.get_flights_page(DB_FILE, arguments.limit, after_flight_id=arguments.after, filters=filters))
+    except ValueError as exc:
+        raise CommandError(str(exc))
+    return [dict(zip(flight_board.FLIGHT_BOARD_COLUMNS, flight)) for flight in flights]
+
+
+def flights_add(arguments):
+    candidate_flight = {"flight_number": arguments.number[:FLIGHT_NUMBER_LENGTH_LIMIT], "aircraft_id": arguments.aircraft,
+                        "pilot_id": arguments.pilot, "route_id": arguments.route, "schedule_id": arguments.schedule}
+    # add_flights makes every check the (F) add flight screen does
+    inserted_flight_count, rejections = checked(db_set.add_flights(DB_FILE, [candidate_flight]))
+    if rejections:
+        raise CommandError(rejections[0][2])
+    return {"added": inserted_flight_count, "flight": candidate_flight}
+
+
+def flights_delete(arguments):
+    refuse_unless(db_get.check_valid_flight(DB_FILE, arguments.flight_id), f"Flight {arguments.flight_id} does not exist")
+    checked(db_set.delete_flight(DB_FILE, arguments.flight_id))
+    return {"deleted": arguments.flight_id}
+
+
+def rejection_rows(rejections):
+    return [{"row": row_number, "flight": flight, "reason": reason} for row_number, flight, reason in rejections]
+
+
+def flights_import(arguments):
+    inserted_flight_count, rejections = checked(flight_import.import_flights(DB_FILE, arguments.file))
+    return {"added": inserted_flight_count, "rejected": rejection_rows(rejections)}
+
+
+def flights_assign(arguments):
+    unassigned_flights = flight_import.read_candidate_flights(arguments.file, flight_assignment.UNASSIGNED_FLIGHT_FIELDS)
+    inserted_flight_count, unassignable, timings = checked(flight_assignment.assign_flights(DB_FILE, unassigned_flights))
+    return {"added": inserted_flight_count, "unassigned": rejection_rows(unassignable),
+            "seconds": {step: round(seconds, 3) for step, seconds in timings.items()}}
+
+
+def flights_changes(arguments):
+    after_sequence = arguments.after if arguments.after is not None else change_feed.get_latest_sequence(DB_FILE)
+    changes, reset = change_feed.wait_for_changes(DB_FILE, after_sequence, arguments.wait)
+    return {"changes": changes, "last_sequence": changes[-1]["sequence"] if changes else after_sequence, "reset": reset}
+
+
+def flights_check_board(arguments):
+    differences = flight_board.check_flight_board(DB_FILE)
+    if arguments.rebuild and any(differences.values()):
+        flight_board.rebuild_flight_board(DB_FILE)
+    return {**differences, "rebuilt": bool(arguments.rebuild and any(differences.values()))}
+
+
+# pilots
+
+def pilots_list(arguments):
+    return rows(db_get.get_pilots(DB_FILE), PILOT_COLUMNS)
+
+
+def pilots_add(arguments):
+    checked(db_set.add_pilot(DB_FILE, arguments.name[:NAME_LENGTH_LIMIT]))
+    return {"added": arguments.name[:NAME_LENGTH_LIMIT]}
+
+
+def pilots_rename(arguments):
+    refuse_unless(db_get.check_valid_pilot_id(DB_FILE, arguments.pilot_id), f"Pilot {arguments.pilot_id} does not exist")
+    checked(db_set.update_pilot(DB_FILE, arguments.name[:NAME_LENGTH_LIMIT], arguments.pilot_id))
+    return {"renamed": arguments.pilot_id, "pilot_name": arguments.name[:NAME_LENGTH_LIMIT]}
+
+
+def pilots_delete(arguments):
+    refuse_unless(db_get.check_valid_pilot_id(DB_FILE, arguments.pilot_id), f"Pilot {arguments.pilot_id} does not exist")
+    refuse_unless(not db_get.check_attribute_in_flight(DB_FILE, "pilot_id", arguments.pilot_id),
+                  f"Pilot {arguments.pilot_id} is assigned to a flight - cannot delete an assigned pilot")
+    checked(db_set.delete_pilot(DB_FILE, arguments.pilot_id))
+    return {"deleted": arguments.pilot_id}
+
+
+# aircraft
+
+def aircraft_list(arguments):
+    return rows(db_get.get_aircraft(DB_FILE), AIRCRAFT_COLUMNS)
+
+
+def aircraft_add(arguments):
+    refuse_unless(db_get.check_valid_aircraftmodel(DB_FILE, arguments.model), f"Aircraft model {arguments.model} does not exist")
+    checked(db_set.add_aircraft(DB_FILE, arguments.name[:NAME_LENGTH_LIMIT], arguments.model))
+    return {"added": arguments.name[:NAME_LENGTH_LIMIT], "aircraftmodel_id": arguments.model}
+
+
+def aircraft_delete(arguments):
+    refuse_unless(db_get.check_valid_aircraft(DB_FILE, arguments.aircraft_id), f"Aircraft {arguments.aircraft_id} does not exist")
+    refuse_unless(not db_get.check_attribute_in_flight(DB_FILE, "aircraft_id", arguments.aircraft_id),
+                  f"Aircraft {arguments.aircraft_id} is assigned to a flight - cannot delete")
+    checked(db_set.delete_aircraft(DB_FILE, arguments.aircraft_id))
+    return {"deleted": arguments.aircraft_id}
+
+
+def aircraft_models(arguments):
+    return rows(db_get.get_aircraftmodels(DB_FILE), AIRCRAFTMODEL_COLUMNS)
+
+
+# routes
+
+def routes_list(arguments):
+    return rows(db_get.get_routes(DB_FILE), ROUTE_COLUMNS)
+
+
+def routes_add(arguments):
+    for airport_id in (arguments.origin, arguments.destination):
+        refuse_unless(db_get.check_valid_airport(DB_FILE, airport_id), f"Airport {airport_id} does not exist")
+    refuse_unless(not db_get.check_existing_route(DB_FILE, arguments.origin, arguments.destination), "The route already exists")
+    route_distance = arguments.distance
+    if route_distance is None:
+        route_distance = great_circle.suggest_route_distance(DB_FILE, arguments.origin, arguments.destination)
+        refuse_unless(route_distance is not None, "--distance is required, the airports don't have coordinates to work it out")
+    refuse_unless(route_distance > 0, "Route distance must be positive")
+    origin_cityairport_id = db_get.get_cityairport_for_airport(DB_FILE, arguments.origin)[0]
+    destination_cityairport_id = db_get.get_cityairport_for_airport(DB_FILE, arguments.destination)[0]
+    checked(db_set.add_route(DB_FILE, origin_cityairport_id, destination_cityairport_id, route_distance))
+    return {"added": True, "origin_airport_id": arguments.origin, "destination_airport_id": arguments.destination,
+            "route_distance": route_distance}
+
+
+def routes_delete(arguments):
+    refuse_unless(db_get.check_valid_route(DB_FILE, arguments.route_id), f"Route {arguments.route_id} does not exist")
+    refuse_unless(not db_get.check_attribute_in_flight(DB_FILE, "route_id", arguments.route_id),
+                  f"Route {arguments.route_id} is used by a flight - cannot delete")
+    checked(db_set.delete_route(DB_FILE, arguments.route_id))
+    return {"deleted": arguments.route_id}
+
+
+def routes_set_distance(arguments):
+    refuse_unless(db_get.check_valid_route(DB_FILE, arguments.route_id), f"Route {arguments.route_id} does not exist")
+    refuse_unless(arguments.distance > 0, "Route distance must be positive")
+    checked(db_set.update_route_distance(DB_FILE, arguments.route_id, arguments.distance))
+    return {"route_id": arguments.route_id, "route_distance": arguments.distance}
+
+
+def routes_audit(arguments):
+    return [{"route_id": route_id, "origin_airport_code": origin, "destination_airport_code": destination,
+             "route_distance": stored_distance, "great_circle_distance": great_circle_distance}
+            for route_id, origin, destination, stored_distance, great_circle_distance
+            in great_circle.audit_route_distances(DB_FILE, arguments.tolerance)]
+
+
+def routes_aircraft(arguments):
+    refuse_unless(db_get.check_valid_route(DB_FILE, arguments.route_id), f"Route {arguments.route_id} does not exist")
+    return {"route_id": arguments.route_id,
+            "aircraftmodel_ids": route_feasibility.models_for_route(DB_FILE, arguments.route_id),
+            "aircraft_ids": route_feasibility.aircraft_for_route(DB_FILE, arguments.route_id)}
+
+
+def routes_itineraries(arguments):
+    try:
+        return route_graph.find_city_itineraries(DB_FILE, arguments.origin_city, arguments.destination_city,
+                                                 arguments.k, arguments.by)
+    except ValueError as exc:
+        raise CommandError(str(exc))
+
+
+# reference data and the database itself
+
+def airports_list(arguments):
+    return rows(db_get.get_cities_airports(DB_FILE), CITYAIRPORT_COLUMNS)
+
+
+def schedules_list(arguments):
+    return rows(db_get.get_schedules(DB_FILE), SCHEDULE_COLUMNS)
+
+
+def db_migrate(arguments):
+    # pending migrations have already been applied by main, unless this is a dry run
+    return {"schema_version": db_migrations.get_schema_version(DB_FILE), "latest_version": db_migrations.LATEST_VERSION}
+
+
+def filter_argument(value):
+    column, separator, filter_value = value.partition("=")
+    if not separator or column not in db_get.FLIGHT_FILTERS:
+        raise argparse.ArgumentTypeError(f"filters are column=value with column one of {', '.join(db_get.FLIGHT_FILTERS)}")
+    return column, filter_value
+
+
+def build_parser():
+    # the output options work before or after the command - SUPPRESS stops a command's copy overwriting one given earlier
+    output_options = argparse.ArgumentParser(add_help=False)
+    output_options.add_argument("--db", default=argparse.SUPPRESS, help=f"database file (default {DB_FILE})")
+    output_options.add_argument("--format", choices=("json", "csv"), default=argparse.SUPPRESS,
+                                help="output format for lists (default json)")
+    output_options.add_argument("--pretty", action="store_true", default=argparse.SUPPRESS, help="indent JSON output")
+
+    parser = argparse.ArgumentParser(prog="bambi_cli.py", parents=[output_options],
+                                     description="Bath Airline Management & Booking Interface - command line")
+    groups = parser.add_subparsers(dest="group", required=True, metavar="{flights,pilots,aircraft,routes,airports,schedules,db}")
+
+    def add_group(name, help_text):
+        group = groups.add_parser(name, help=help_text)
+        return group.add_subparsers(dest="command", required=True)
+
+    def add_command(commands, name, handler, help_text):
+        command = commands.add_parser(name, help=help_text, parents=[output_options])
+        command.set_defaults(handler=handler)
+        return command
+
+    flights = add_group("flights", "list, add and remove flights")
+    command = add_command(flights, "list", flights_list, "the flight board, a page at a time")
+    command.add_argument("--limit", type=int, default=db_get.FLIGHT_PAGE_SIZE)
+    command.add_argument("--after", type=int, help="start after this flight_id")
+    command.add_argument("--all", action="store_true", help="every flight, ignores --limit and --after")
+    command.add_argument("--filter", type=filter_argument, action="append", metavar="COLUMN=VALUE")
+    command = add_command(flights, "add", flights_add, "add one flight, with the same checks as the menus")
+    command.add_argument("--number", required=True)
+    command.add_argument("--aircraft", type=int, required=True)
+    command.add_argument("--pilot", type=int, required=True)
+    command.add_argument("--route", type=int, required=True)
+    command.add_argument("--schedule", type=int, required=True)
+    add_command(flights, "delete", flights_delete, "remove a flight").add_argument("flight_id", type=int)
+    add_command(flights, "import", flights_import, "add a timetable of flights from a .csv or .json file").add_argument("file")
+    add_command(flights, "assign", flights_assign,
+                "add flights that only have a route and schedule, picking aircraft and pilots").add_argument("file")
+    command = add_command(flights, "changes", flights_changes, "flight changes after a sequence number")
+    command.add_argument("--after", type=int, help="sequence number to carry on from (default - only new changes)")
+    command.add_argument("--wait", type=float, default=0, help="seconds to wait for a change if there are none yet")
+    add_command(flights, "check-board", flights_check_board,
+                "compare the flight board against the live tables").add_argument("--rebuild", action="store_true")
+
+    pilots = add_group("pilots", "list, add, rename and remove pilots")
+    add_command(pilots, "list", pilots_list, "every pilot, a row per assigned flight")
+    add_command(pilots, "add", pilots_add, "add a pilot").add_argument("name")
+    command = add_command(pilots, "rename", pilots_rename, "rename a pilot")
+    command.add_argument("pilot_id", type=int)
+    command.add_argument("name")
+    add_command(pilots, "delete", pilots_delete, "remove a pilot with no flights").add_argument("pilot_id", type=int)
+
+    aircraft = add_group("aircraft", "list, add and remove aircraft")
+    add_command(aircraft, "list", aircraft_list, "every aircraft, a row per assigned flight")
+    command = add_command(aircraft, "add", aircraft_add, "add an aircraft")
+    command.add_argument("name")
+    command.add_argument("--model", type=int, required=True, help="aircraftmodel_id")
+    add_command(aircraft, "delete", aircraft_delete, "remove an aircraft with no flights").add_argument("aircraft_id", type=int)
+    add_command(aircraft, "models", aircraft_models, "every aircraft model")
+
+    routes = add_group("routes", "list, add and check routes")
+    add_command(routes, "list", routes_list, "every route")
+    command = add_command(routes, "add", routes_add, "add a route between two airports")
+    command.add_argument("--origin", type=int, required=True, help="airport_id")
+    command.add_argument("--destination", type=int, required=True, help="airport_id")
+    command.add_argument("--distance", type=int, help="km (default - the great-circle distance)")
+    add_command(routes, "delete", routes_delete, "remove a route no flight uses").add_argument("route_id", type=int)
+    command = add_command(routes, "set-distance", routes_set_distance, "change a route's distance, retiming its flights")
+    command.add_argument("route_id", type=int)
+    command.add_argument("distance", type=int)
+    add_command(routes, "audit", routes_audit, "routes whose distance is far from the great-circle distance").add_argument(
+        "--tolerance", type=float, default=great_circle.ROUTE_DISTANCE_TOLERANCE)
+    add_command(routes, "aircraft", routes_aircraft, "the aircraft with the range for a route").add_argument("route_id", type=int)
+    command = add_command(routes, "itineraries", routes_itineraries, "ways to travel between two cities")
+    command.add_argument("origin_city", type=int)
+    command.add_argument("destination_city", type=int)
+    command.add_argument("-k", type=int, default=1, help="how many itineraries")
+    command.add_argument("--by", choices=route_graph.SEARCH_ORDERS, default="distance")
+
+    airports = add_group("airports", "cities and their airports")
+    add_command(airports, "list", airports_list, "every city and its airports")
+    schedules = add_group("schedules", "departure schedules")
+    add_command(schedules, "list", schedules_list, "every schedule")
+    database = add_group("db", "the database file")
+    add_command(database, "migrate", db_migrate, "bring the schema up to date").add_argument("--dry-run", action="store_true")
+    return parser
+
+
+def main(argv=None):
+    global DB_FILE
+    arguments = build_parser().parse_args(argv)
+    for option, default in (("db", DB_FILE), ("format", "json"), ("pretty", False)):
+        if not hasattr(arguments, option):
+            setattr(arguments, option, default)
+    DB_FILE = arguments.db
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', filename=LOGFILE_NAME)
+    logger.info(f"bambi_cli {arguments.group} {arguments.command} on {DB_FILE}")
+
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            db_initialisation.init(DB_FILE)
+            dry_run = arguments.group == "db" and arguments.dry_run
+            applied_migrations = db_migrations.migrate(DB_FILE, dry_run=dry_run)
+        result = arguments.handler(arguments)
+        if arguments.group == "db":
+            result["applied"] = [{"version": version, "description": description, "seconds": round(seconds, 3)}
+                                 for version, description, seconds in applied_migrations]
+            result["dry_run"] = dry_run
+    except CommandError as exc:
+        json.dump({"error": exc.message}, sys.stderr)
+        sys.stderr.write("\n")
+        return exc.exit_code
+    except (OSError, ValueError) as exc:
+        # unreadable or badly formed import files
+        json.dump({"error": str(exc)}, sys.stderr)
+        sys.stderr.write("\n")
+        return EXIT_REFUSED
+    output(arguments, result)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,431 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import tempfile
+import contextlib
+import db_initialisation
+import db_migrations
+import db_connection
+import db_get
+import db_set
+import flight_times
+import flight_board
+import flight_conflicts
+import route_graph
+import great_circle
+import route_feasibility
+import utils
+
+# Benchmarks for the performance work on BAMBI
+# These build a throwaway database from generated seed data (so they never touch bambi.db) and time the
+# data-access functions against it.
+#   python benchmark.py                 - runs every benchmark with the default sizes
+#   python benchmark.py logging 200000  - runs one benchmark against a database with 200000 flights
+#   python benchmark.py check           - runs the correctness checks instead, see CHECKS at the bottom
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FLIGHT_COUNT = 100000
+
+
+def airport_code(airport_id):
+    # unique three letter code for up to 17576 airports - AAA, AAB, AAC...
+    letters = ""
+    for _ in range(3):
+        airport_id, remainder = divmod(airport_id, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def generate_seed_data(flight_count, airport_count=2000, aircraft_count=None, pilot_count=None, seed=1):
+    # builds a seed_data.json shaped dictionary - one airport per city, and by default an aircraft and a pilot of its
+    # own for every flight. Aircraft and pilots can fly any number of flights that don't overlap, but seeded flights go
+    # straight into the table with no arrival time and no double-booking check, so this keeps them valid without
+    # having to work out a timetable here
+    randomiser = random.Random(seed)
+    aircraft_count = aircraft_count or flight_count
+    pilot_count = pilot_count or flight_count
+
+    aircraftmodels = [
+        {"aircraftmodel_id": 1, "aircraftmodel_name": "A320", "aircraftmodel_range": 6100, "aircraftmodel_speed": 830},
+        {"aircraftmodel_id": 2, "aircraftmodel_name": "B737", "aircraftmodel_range": 5600, "aircraftmodel_speed": 840},
+        {"aircraftmodel_id": 3, "aircraftmodel_name": "A350", "aircraftmodel_range": 15000, "aircraftmodel_speed": 900},
+        {"aircraftmodel_id": 4, "aircraftmodel_name": "B787", "aircraftmodel_range": 14000, "aircraftmodel_speed": 910},
+    ]
+    route_count = airport_count * 2
+    routes = []
+    for route_id in range(1, route_count + 1):
+        origin = randomiser.randint(1, airport_count)
+        destination = randomiser.randint(1, airport_count - 1)
+        destination += destination >= origin
+        routes.append({"route_id": route_id, "origin_cityairport_id": origin, "destination_cityairport_id": destination,
+                       "route_distance": randomiser.randint(200, 12000)})
+
+    return {
+        "cities": [{"city_id": i, "city_name": f"City {i}"} for i in range(1, airport_count + 1)],
+        "airports": [{"airport_id": i, "airport_name": f"Airport {i}", "airport_code": airport_code(i)}
+                     for i in range(1, airport_count + 1)],
+        "cityairports": [{"cityairport_id": i, "city_id": i, "airport_id": i} for i in range(1, airport_count + 1)],
+        "aircraft": [{"aircraft_id": i, "aircraft_name": f"Aircraft {i}", "aircraftmodel_id": randomiser.randint(1, 4)}
+                     for i in range(1, aircraft_count + 1)],
+        "aircraftmodels": aircraftmodels,
+        "pilots": [{"pilot_id": i, "pilot_name": f"Pilot {i}"} for i in range(1, pilot_count + 1)],
+        "schedules": [{"schedule_id": i, "departure_time": f"{i % 24:02d}:00"} for i in range(1, 25)],
+        "routes": routes,
+        "flights": [{"flight_id": i, "flight_number": f"BA{i}", "pilot_id": i, "route_id": randomiser.randint(1, route_count),
+                     "aircraft_id": i, "schedule_id": randomiser.randint(1, 24), "arrival_time": None}
+                    for i in range(1, flight_count + 1)],
+    }
+
+
+@contextlib.contextmanager
+def benchmark_database(flight_count):
+    # yields the path of a freshly seeded and migrated database in a temporary directory
+    with tempfile.TemporaryDirectory() as directory:
+        seed_file = os.path.join(directory, "seed_data.json")
+        DB_FILE = os.path.join(directory, "benchmark.db")
+        with open(seed_file, "w") as file:
+            json.dump(generate_seed_data(flight_count), file)
+
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            db_initialisation.init(DB_FILE, SEED_DATA_FILE=seed_file)
+            db_migrations.migrate(DB_FILE)
+        try:
+            yield DB_FILE
+        finally:
+            db_connection.close_all(DB_FILE)
+
+
+def time_call(function, repeat=5):
+    # best of repeat runs, in seconds
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def bench_logging(DB_FILE):
+    # compares what the old eager debug logging cost against the lazy, sampled logging now used by db_get
+    # with logging at INFO (the normal setting), so none of these debug records are actually written
+    flights = db_get.get_flights(DB_FILE)
+
+    query_seconds = time_call(lambda: db_get.get_flights(DB_FILE))
+    eager_seconds = time_call(lambda: logging.debug(f"{flights}"))
+    lazy_seconds = time_call(lambda: logging.debug("Returned %s", utils.sample_rows(flights)))
+    sample_seconds = time_call(lambda: str(utils.sample_rows(flights)))
+
+    print(f"get_flights query ({len(flights)} rows):             {query_seconds * 1000:10.3f}ms")
+    print(f"eager f-string debug of result (old, INFO level): {eager_seconds * 1000:10.3f}ms")
+    print(f"lazy sampled debug of result (new, INFO level):   {lazy_seconds * 1000:10.3f}ms")
+    print(f"lazy sampled debug of result (new, DEBUG level):  {sample_seconds * 1000:10.3f}ms")
+
+
+def bench_arrival_times(DB_FILE):
+    # per-flight calculate_flight_time against the batch maths in flight_times, then the stored recalculation job
+    # bambi is imported here rather than at the top because importing it sets up bambi.log logging, which the
+    # basicConfig in the main block below has already stopped from happening
+    import bambi
+
+    cursor = db_connection.get_connection(DB_FILE).cursor()
+    cursor.execute('''
+            SELECT r.route_distance, am.aircraftmodel_speed, s.departure_time
+            FROM Flight f
+            INNER JOIN Route r on r.route_id = f.route_id
+            INNER JOIN Aircraft a on a.aircraft_id = f.aircraft_id
+            INNER JOIN AircraftModel am on am.aircraftmodel_id = a.aircraftmodel_id
+            INNER JOIN Schedule s on s.schedule_id = f.schedule_id
+        ''')
+    route_distances, aircraft_speeds, departure_times = zip(*cursor.fetchall())
+
+    single_seconds = time_call(lambda: [bambi.calculate_flight_time(*flight) for flight in zip(route_distances, aircraft_speeds, departure_times)], repeat=1)
+    batch_seconds = time_call(lambda: flight_times.calculate_arrival_times(route_distances, aircraft_speeds, departure_times))
+    # the generated flights have no arrival time, so the first run writes every row and later runs write none
+    first_recalculation_seconds = time_call(lambda: db_set.recalculate_arrival_times(DB_FILE), repeat=1)
+    recalculation_seconds = time_call(lambda: db_set.recalculate_arrival_times(DB_FILE))
+
+    numpy_status = "numpy" if flight_times.NUMPY_AVAILABLE else "plain python"
+    print(f"calculate_flight_time per flight ({len(route_distances)} flights): {single_seconds * 1000:10.3f}ms")
+    print(f"calculate_arrival_times batch ({numpy_status}):        {batch_seconds * 1000:10.3f}ms")
+    print(f"recalculate_arrival_times, every flight rewritten:     {first_recalculation_seconds * 1000:10.3f}ms")
+    print(f"recalculate_arrival_times, nothing changed:            {recalculation_seconds * 1000:10.3f}ms")
+
+
+def bench_flight_board(DB_FILE):
+    # the nine-way join get_flights used to run against the materialised FlightBoard it reads now,
+    # plus what the triggers add to a write that touches a lot of flights
+    cursor = db_connection.get_connection(DB_FILE).cursor()
+    join_seconds = time_call(lambda: cursor.execute(f"{flight_board.LIVE_FLIGHT_BOARD_QUERY} ORDER BY f.flight_id").fetchall())
+    board_seconds = time_call(lambda: db_get.get_flights(DB_FILE))
+    check_seconds = time_call(lambda: flight_board.check_flight_board(DB_FILE), repeat=1)
+    # AircraftModel 1 is on roughly a quarter of the generated aircraft
+    rename_seconds = time_call(lambda: cursor.execute("UPDATE AircraftModel SET aircraftmodel_name = aircraftmodel_name || '' WHERE aircraftmodel_id = 1"), repeat=1)
+    cursor.connection.rollback()
+
+    print(f"live join, every flight:                    {join_seconds * 1000:10.3f}ms")
+    print(f"get_flights from FlightBoard:               {board_seconds * 1000:10.3f}ms")
+    print(f"check_flight_board:                         {check_seconds * 1000:10.3f}ms")
+    print(f"rename an aircraft model (board refreshed): {rename_seconds * 1000:10.3f}ms")
+
+
+def bench_flight_pages(DB_FILE):
+    # what render_flights used to fetch to draw the first screen against one keyset page, near the start and the end
+    last_flight_id = db_get.get_flights_page(DB_FILE, page_size=1, before_flight_id=2 ** 62)[0][0]
+    all_seconds = time_call(lambda: db_get.get_flights(DB_FILE))
+    first_page_seconds = time_call(lambda: db_get.get_flights_page(DB_FILE))
+    last_page_seconds = time_call(lambda: db_get.get_flights_page(DB_FILE, before_flight_id=last_flight_id + 1))
+    filtered_page_seconds = time_call(lambda: db_get.get_flights_page(DB_FILE, filters={"aircraftmodel_name": "A350"}))
+
+    print(f"get_flights, every flight:                  {all_seconds * 1000:10.3f}ms")
+    print(f"get_flights_page, first page:               {first_page_seconds * 1000:10.3f}ms")
+    print(f"get_flights_page, last page:                {last_page_seconds * 1000:10.3f}ms")
+    print(f"get_flights_page, first page with a filter: {filtered_page_seconds * 1000:10.3f}ms")
+
+
+def bench_conflicts(DB_FILE):
+    # loading every stored flight into the per-aircraft/per-pilot interval indexes, then checks against them
+    cursor = db_connection.get_connection(DB_FILE).cursor()
+    load_seconds = time_call(lambda: flight_conflicts.load_conflict_index(cursor), repeat=1)
+    conflict_index = flight_conflicts.load_conflict_index(cursor)
+
+    # a full day's rotation on one aircraft and pilot, so the check has something to search through
+    rotation_index = flight_conflicts.FlightConflictIndex()
+    for hour in range(0, 24, 2):
+        rotation_index.add_flight(hour, 1, 1, f"{hour:02d}:00", f"{hour:02d}:50")
+    check_count = 10000
+    check_seconds = time_call(lambda: [conflict_index.find_conflicts(aircraft_id, aircraft_id, "09:00", "11:00 +1")
+                                       for aircraft_id in range(1, check_count + 1)])
+    rotation_seconds = time_call(lambda: [rotation_index.find_conflicts(1, 1, "09:55", "10:00") for _ in range(check_count)])
+
+    print(f"load_conflict_index, every flight:          {load_seconds * 1000:10.3f}ms")
+    print(f"{check_count} checks across different aircraft:     {check_seconds * 1000:10.3f}ms")
+    print(f"{check_count} checks against a full rotation:       {rotation_seconds * 1000:10.3f}ms")
+
+
+def bench_route_graph(DB_FILE):
+    # building the in-memory route graph, then itinerary searches between random cities against it
+    randomiser = random.Random(1)
+    build_seconds = time_call(lambda: route_graph.build_route_graph(DB_FILE))
+    city_pairs = [(randomiser.randint(1, 2000), randomiser.randint(1, 2000)) for _ in range(100)]
+    route_graph.get_route_graph(DB_FILE)
+    shortest_seconds = time_call(lambda: [route_graph.find_city_itineraries(DB_FILE, *city_pair) for city_pair in city_pairs], repeat=1)
+    k_shortest_seconds = time_call(lambda: [route_graph.find_city_itineraries(DB_FILE, *city_pair, k=5) for city_pair in city_pairs], repeat=1)
+
+    print(f"build_route_graph:                          {build_seconds * 1000:10.3f}ms")
+    print(f"100 shortest itinerary searches:            {shortest_seconds * 1000:10.3f}ms")
+    print(f"100 five-shortest itinerary searches:       {k_shortest_seconds * 1000:10.3f}ms")
+
+
+def bench_great_circle(DB_FILE):
+    # the generated airports have no coordinates, so they're given random ones first
+    randomiser = random.Random(1)
+    connection = db_connection.get_connection(DB_FILE)
+    airport_codes = [row[0] for row in connection.execute("SELECT airport_code FROM Airport")]
+    db_connection.release_connection(connection)
+    db_set.set_airport_coordinates(DB_FILE, [(code, randomiser.uniform(-60, 70), randomiser.uniform(-180, 180)) for code in airport_codes])
+    airport_coordinates = list(great_circle.get_airport_coordinates(DB_FILE).values())
+    latitudes = [latitude for _, latitude, _ in airport_coordinates]
+    longitudes = [longitude for _, _, longitude in airport_coordinates]
+    pairs = [(latitudes[i], longitudes[i], latitudes[j], longitudes[j]) for i in range(100) for j in range(len(latitudes))]
+
+    matrix_seconds = time_call(lambda: great_circle.distance_matrix(latitudes, longitudes), repeat=1)
+    bulk_pair_seconds = time_call(lambda: great_circle.pair_distances(*zip(*pairs)))
+    single_pair_seconds = time_call(lambda: [great_circle.pair_distances([a], [b], [c], [d]) for a, b, c, d in pairs], repeat=1)
+    audit_seconds = time_call(lambda: great_circle.audit_route_distances(DB_FILE))
+
+    print(f"numpy available:                            {great_circle.NUMPY_AVAILABLE}")
+    print(f"{len(latitudes)} x {len(latitudes)} distance matrix:".ljust(44) + f"{matrix_seconds * 1000:10.3f}ms")
+    print(f"{len(pairs)} pair distances in one call:".ljust(44) + f"{bulk_pair_seconds * 1000:10.3f}ms")
+    print(f"{len(pairs)} pair distances one at a time:".ljust(44) + f"{single_pair_seconds * 1000:10.3f}ms")
+    print(f"audit_route_distances:                      {audit_seconds * 1000:10.3f}ms")
+
+
+def bench_feasibility(DB_FILE):
+    # which aircraft can fly a route - a join per question against lookups in the feasibility index
+    randomiser = random.Random(1)
+    route_ids = [randomiser.randint(1, 4000) for _ in range(1000)]
+    query = '''
+            SELECT a.aircraft_id FROM Aircraft a
+            INNER JOIN AircraftModel am on am.aircraftmodel_id = a.aircraftmodel_id
+            INNER JOIN Route r on am.aircraftmodel_range >= ? * r.route_distance
+            WHERE r.route_id = ?
+        '''
+
+    def join_lookups():
+        connection = db_connection.get_connection(DB_FILE)
+        try:
+            return [connection.execute(query, (db_get.RANGE_MARGIN, route_id)).fetchall() for route_id in route_ids]
+        finally:
+            db_connection.release_connection(connection)
+
+    build_seconds = time_call(lambda: route_feasibility.build_feasibility_index(DB_FILE))
+    join_seconds = time_call(join_lookups, repeat=1)
+    route_feasibility.get_feasibility_index(DB_FILE)
+    index_seconds = time_call(lambda: [route_feasibility.aircraft_for_route(DB_FILE, route_id) for route_id in route_ids], repeat=1)
+    fleet_seconds = time_call(lambda: route_feasibility.routes_for_fleet(DB_FILE))
+
+    print(f"build_feasibility_index:                    {build_seconds * 1000:10.3f}ms")
+    print(f"1000 capable-aircraft joins:                {join_seconds * 1000:10.3f}ms")
+    print(f"1000 capable-aircraft index lookups:        {index_seconds * 1000:10.3f}ms")
+    print(f"routes_for_fleet:                           {fleet_seconds * 1000:10.3f}ms")
+
+
+BENCHMARKS = {
+    "logging": bench_logging,
+    "arrival_times": bench_arrival_times,
+    "flight_board": bench_flight_board,
+    "flight_pages": bench_flight_pages,
+    "conflicts": bench_conflicts,
+    "route_graph": bench_route_graph,
+    "great_circle": bench_great_circle,
+    "feasibility": bench_feasibility,
+}
+
+
+# Correctness checks
+# The faster code above is compared against the slow, obviously right way of getting the same answer on generated
+# inputs. Each check returns a list of what didn't match - empty means it passed.
+#   python benchmark.py check               - runs every check
+#   python benchmark.py check route_graph   - runs one
+
+def enumerate_itinerary_costs(graph, origins, destinations, by):
+    # every itinerary that never visits an airport twice, found by walking all of them - fine for a handful of airports
+    costs = []
+
+    def walk(node, visited, cost):
+        if node in destinations:
+            costs.append(cost)
+        for route_id, (destination, _) in graph.adjacency.get(node, {}).items():
+            if destination not in visited:
+                edge_cost = graph.edge_cost(route_id, by)
+                walk(destination, visited | {destination}, (cost[0] + edge_cost[0], cost[1] + edge_cost[1]))
+
+    for origin in origins:
+        walk(origin, {origin}, route_graph.NO_COST)
+    return sorted(costs)
+
+
+def check_route_graph(graph_count=300, k=8):
+    # Yen's k shortest itineraries against enumerating every itinerary, on small random networks that include
+    # several routes between the same pair of airports
+    failures = []
+
+    def compare(label, graph, origins, destinations, k, by):
+        expected_costs = enumerate_itinerary_costs(graph, origins, destinations, by)[:k]
+        found_costs = [cost for cost, _, _ in graph.k_shortest_paths(origins, destinations, k, by)]
+        if found_costs != expected_costs:
+            failures.append(f"{label} by {by} - found {found_costs}, expected {expected_costs}")
+
+    # two routes on each leg of 1 > 2 > 3 - only one of the four itineraries used to be found after the first,
+    # because the spur step matched earlier paths on airports rather than routes
+    parallel_routes = [(1, 1, 2, 3), (2, 1, 2, 1), (3, 2, 3, 2), (4, 2, 3, 2)]
+    graph = route_graph.RouteGraph([(airport, airport, f"City {airport}", airport_code(airport)) for airport in (1, 2, 3)], parallel_routes)
+    for by in route_graph.SEARCH_ORDERS:
+        compare("parallel routes", graph, {1}, {3}, 4, by)
+
+    for seed in range(graph_count):
+        randomiser = random.Random(seed)
+        airport_count = randomiser.randint(3, 6)
+        routes = []
+        for route_id in range(1, randomiser.randint(airport_count, 3 * airport_count) + 1):
+            origin = randomiser.randint(1, airport_count)
+            destination = randomiser.randint(1, airport_count - 1)
+            destination += destination >= origin
+            routes.append((route_id, origin, destination, randomiser.randint(1, 5)))
+        cityairports = [(airport, airport, f"City {airport}", airport_code(airport)) for airport in range(1, airport_count + 1)]
+        graph = route_graph.RouteGraph(cityairports, routes)
+        for by in route_graph.SEARCH_ORDERS:
+            compare(f"random network {seed}", graph, {1}, {airport_count}, k, by)
+    return failures
+
+
+def check_arrival_times(flight_count=20000):
+    # the batch maths in flight_times, with numpy when it's installed and in plain python, against the per-flight
+    # calculate_flight_time the (F) add flight screen uses - imported here for the same reason as in bench_arrival_times
+    import bambi
+
+    randomiser = random.Random(1)
+    route_distances = [randomiser.randint(1, 20000) for _ in range(flight_count)]
+    aircraft_speeds = [randomiser.randint(100, 2500) for _ in range(flight_count)]
+    departure_times = [f"{randomiser.randint(0, 23):02d}:{randomiser.choice((0, randomiser.randint(0, 59))):02d}" for _ in range(flight_count)]
+    expected = [bambi.calculate_flight_time(*flight) for flight in zip(route_distances, aircraft_speeds, departure_times)]
+
+    failures = []
+    numpy_available = flight_times.NUMPY_AVAILABLE
+    try:
+        for use_numpy in ((True, False) if numpy_available else (False,)):
+            flight_times.NUMPY_AVAILABLE = use_numpy
+            calculated = flight_times.calculate_arrival_times(route_distances, aircraft_speeds, departure_times)
+            for flight, calculated_time, expected_time in zip(zip(route_distances, aircraft_speeds, departure_times), calculated, expected):
+                if calculated_time != expected_time:
+                    failures.append(f"{'numpy' if use_numpy else 'plain python'} {flight} - got {calculated_time}, expected {expected_time}")
+    finally:
+        flight_times.NUMPY_AVAILABLE = numpy_available
+    return failures
+
+
+def check_feasibility(flight_count=200):
+    # the feasibility index kept up to date in place by db_set against one rebuilt from the database afterwards,
+    # with the model id given as a string the way the (A) aircraft menu passes it
+    failures = []
+    with benchmark_database(flight_count) as DB_FILE:
+        feasibility_index = route_feasibility.get_feasibility_index(DB_FILE)
+        route_ids = sorted(feasibility_index.route_requirements)
+        aircraftmodel_id = max(feasibility_index.model_ranges, key=feasibility_index.model_ranges.get)
+        with contextlib.redirect_stdout(open(os.devnull, "w")):
+            db_set.add_aircraft(DB_FILE, "Check aircraft", str(aircraftmodel_id))
+        connection = db_connection.get_connection(DB_FILE)
+        try:
+            aircraft_id = connection.execute("SELECT MAX(aircraft_id) FROM Aircraft").fetchone()[0]
+        finally:
+            db_connection.release_connection(connection)
+
+        updated = {route_id: route_feasibility.aircraft_for_route(DB_FILE, route_id) for route_id in route_ids}
+        rebuilt_index = route_feasibility.build_feasibility_index(DB_FILE)
+        for route_id in route_ids:
+            rebuilt = rebuilt_index.aircraft_for_route(route_id)
+            if updated[route_id] != rebuilt:
+                failures.append(f"route {route_id} - missing aircraft {sorted(set(rebuilt) - set(updated[route_id]))}, "
+                                f"extra aircraft {sorted(set(updated[route_id]) - set(rebuilt))}")
+        if route_ids and aircraft_id not in updated[route_ids[0]]:
+            failures.append(f"aircraft {aircraft_id} of model {aircraftmodel_id} not found for route {route_ids[0]}")
+        route_feasibility.invalidate(DB_FILE)
+    return failures
+
+
+CHECKS = {
+    "route_graph": check_route_graph,
+    "arrival_times": check_arrival_times,
+    "feasibility": check_feasibility,
+}
+
+
+def run_checks(chosen):
+    failed = False
+    for check_name in chosen:
+        failures = CHECKS[check_name]()
+        print(f"{check_name}: {'ok' if not failures else f'{len(failures)} failed'}")
+        for failure in failures:
+            print(f"    {failure}")
+        failed = failed or bool(failures)
+    return failed
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["check"]:
+        logging.basicConfig(level=logging.INFO, handlers=[logging.NullHandler()])
+        sys.exit(1 if run_checks(sys.argv[2:3] or list(CHECKS)) else 0)
+
+    chosen = sys.argv[1:2] or list(BENCHMARKS)
+    flight_count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_FLIGHT_COUNT
+
+    # same level bambi.py runs at, but the records are thrown away rather than written to the console
+    logging.basicConfig(level=logging.INFO, handlers=[logging.NullHandler()])
+    with benchmark_database(flight_count) as DB_FILE:
+        for benchmark_name in chosen:
+            print(f"\n== {benchmark_name} ({flight_count} flights) ==")
+            BENCHMARKS[benchmark_name](DB_FILE)
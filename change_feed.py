@@ -0,0 +1,182 @@
+import sys
+import time
+import logging
+import threading
+import contextlib
+import db_connection
+import flight_board
+
+# Flight change feed
+# The only way to notice a new or deleted flight used to be drawing the whole flight list again. Every change to a
+# flight is now also written to FlightChange with a sequence number, so a screen can ask "what's happened since
+# change 1234" and get just that -
+#   added            - a new flight
+#   deleted          - a flight was removed
+#   arrival_changed  - its arrival time moved (route distance or aircraft speed changed, see db_set)
+#
+# Like FlightBoard and ChangeVersion the rows are written by triggers on Flight, so every writer is covered.
+# sequence is an AUTOINCREMENT key and SQLite only lets one transaction write at a time, so numbers are handed out in
+# commit order and never reused - a reader that has seen change n has seen everything before it, and can carry on
+# from n after a restart. Only the last FEED_RETENTION changes are kept; a reader further behind than that is told to
+# reset (reload the whole board) instead.
+#
+# The web app serves it as a long poll (GET /api/flights/changes?after=n&wait=20) and as server-sent events
+# (GET /api/flights/changes/stream, resuming from the Last-Event-ID header). db_set calls flights_changed after it
+# commits a flight change so waiting readers in this process wake straight away; changes from other processes are
+# picked up by checking every FEED_POLL_SECONDS.
+#
+#   python change_feed.py [database file] [after]    - prints changes as they happen, like tail -f
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in change_feed.py")
+
+FLIGHT_CHANGES = ("added", "deleted", "arrival_changed")
+FEED_RETENTION = 100000
+FEED_POLL_SECONDS = 1
+FEED_PAGE_SIZE = 500
+
+CREATE_FLIGHT_CHANGE = '''
+            CREATE TABLE IF NOT EXISTS FlightChange (
+                sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+                flight_id INTEGER NOT NULL,
+                change TEXT NOT NULL,
+                flight_number TEXT,
+                arrival_time TEXT,
+                changed_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))
+            )
+        '''
+
+FLIGHT_CHANGE_TRIGGERS = {
+    "flightchange_flight_insert": '''
+            CREATE TRIGGER IF NOT EXISTS flightchange_flight_insert AFTER INSERT ON Flight
+            BEGIN
+            INSERT INTO FlightChange (flight_id, change, flight_number, arrival_time)
+            VALUES (NEW.flight_id, 'added', NEW.flight_number, NEW.arrival_time);
+            END''',
+    "flightchange_flight_delete": '''
+            CREATE TRIGGER IF NOT EXISTS flightchange_flight_delete AFTER DELETE ON Flight
+            BEGIN
+            INSERT INTO FlightChange (flight_id, change, flight_number, arrival_time)
+            VALUES (OLD.flight_id, 'deleted', OLD.flight_number, OLD.arrival_time);
+            END''',
+    "flightchange_flight_update": '''
+            CREATE TRIGGER IF NOT EXISTS flightchange_flight_update AFTER UPDATE OF arrival_time ON Flight
+            WHEN OLD.arrival_time IS NOT NEW.arrival_time
+            BEGIN
+            INSERT INTO FlightChange (flight_id, change, flight_number, arrival_time)
+            VALUES (NEW.flight_id, 'arrival_changed', NEW.flight_number, NEW.arrival_time);
+            END''',
+    # keeps the feed to its last FEED_RETENTION changes - a primary key range, so normally one row
+    "flightchange_retention": f'''
+            CREATE TRIGGER IF NOT EXISTS flightchange_retention AFTER INSERT ON FlightChange
+            BEGIN
+            DELETE FROM FlightChange WHERE sequence <= NEW.sequence - {FEED_RETENTION};
+            END''',
+}
+
+
+def create_change_feed(cursor):
+    # table and triggers - used by db_migrations, so doesn't commit
+    cursor.execute(CREATE_FLIGHT_CHANGE)
+    for create_trigger in FLIGHT_CHANGE_TRIGGERS.values():
+        logger.debug(create_trigger)
+        cursor.execute(create_trigger)
+    logger.info(f"FlightChange created with {len(FLIGHT_CHANGE_TRIGGERS)} triggers")
+
+
+# woken by flights_changed so readers in this process don't wait for the next poll
+_changed = threading.Condition()
+
+
+def flights_changed(DB_FILE):
+    # called by db_set after it commits a change to Flight
+    with _changed:
+        _changed.notify_all()
+
+
+def get_latest_sequence(DB_FILE):
+    # the newest change so far, 0 if there are none - where a new reader starts from
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        return connection.execute("SELECT COALESCE(MAX(sequence), 0) FROM FlightChange").fetchone()[0]
+    finally:
+        db_connection.release_connection(connection)
+
+
+def get_changes(DB_FILE, after_sequence, limit=FEED_PAGE_SIZE):
+    # returns (changes, reset) - changes after after_sequence, oldest first, each with the flight's current board row
+    # (None once it's been deleted). reset is True if changes after after_sequence have already been pruned, in which
+    # case the caller has missed something and should reload the whole flight list
+    board_columns = ", ".join(f"fb.{column}" for column in flight_board.FLIGHT_BOARD_COLUMNS)
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        # one read transaction so the pruning check and the changes agree
+        connection.execute("BEGIN")
+        oldest_sequence = connection.execute("SELECT MIN(sequence) FROM FlightChange").fetchone()[0]
+        rows = connection.execute(f'''
+                SELECT fc.sequence, fc.change, fc.flight_id, fc.flight_number, fc.arrival_time, fc.changed_at,
+                fb.flight_id IS NOT NULL, {board_columns}
+                FROM FlightChange fc
+                LEFT JOIN FlightBoard fb on fb.flight_id = fc.flight_id
+                WHERE fc.sequence > ?
+                ORDER BY fc.sequence
+                LIMIT ?
+            ''', (after_sequence, limit)).fetchall()
+        connection.rollback()
+    finally:
+        db_connection.release_connection(connection)
+
+    reset = oldest_sequence is not None and after_sequence < oldest_sequence - 1
+    changes = []
+    for sequence, change, flight_id, flight_number, arrival_time, changed_at, on_board, *board_row in rows:
+        changes.append({
+            "sequence": sequence,
+            "change": change,
+            "flight_id": flight_id,
+            "flight_number": flight_number,
+            "arrival_time": arrival_time,
+            "changed_at": changed_at,
+            "flight": dict(zip(flight_board.FLIGHT_BOARD_COLUMNS, board_row)) if on_board else None,
+        })
+    return changes, reset
+
+
+def wait_for_flight_change(timeout):
+    # sleeps until flights_changed is called in this process or timeout seconds pass
+    with _changed:
+        _changed.wait(timeout)
+
+
+def wait_for_changes(DB_FILE, after_sequence, timeout, limit=FEED_PAGE_SIZE, connection_lease=contextlib.nullcontext):
+    # long poll - returns get_changes as soon as there is something after after_sequence, or empty after timeout
+    # connection_lease is entered around each read, so a caller with a pool (the web app) isn't holding a
+    # connection for the whole wait
+    deadline = time.monotonic() + timeout
+    while True:
+        with connection_lease():
+            changes, reset = get_changes(DB_FILE, after_sequence, limit)
+        remaining = deadline - time.monotonic()
+        if changes or reset or remaining <= 0:
+            return changes, reset
+        wait_for_flight_change(min(remaining, FEED_POLL_SECONDS))
+
+
+def format_change(change):
+    return (f"#{change['sequence']} {change['changed_at']} flight {change['flight_id']} ({change['flight_number']}) "
+            f"{change['change']}" + (f" - arrives {change['arrival_time']}" if change["arrival_time"] else ""))
+
+
+if __name__ == "__main__":
+    DB_FILE = sys.argv[1] if len(sys.argv) > 1 else "bambi.db"
+    after_sequence = int(sys.argv[2]) if len(sys.argv) > 2 else get_latest_sequence(DB_FILE)
+    print(f"Watching flight changes after #{after_sequence} - press Ctrl+C to stop")
+    try:
+        while True:
+            changes, reset = wait_for_changes(DB_FILE, after_sequence, timeout=60)
+            if reset:
+                print("Changes have been missed, reload the flight list")
+            for change in changes:
+                print(format_change(change))
+                after_sequence = change["sequence"]
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,79 @@
+import logging
+import db_connection
+
+# Per-table change counters
+# ChangeVersion holds one row per table with a number that goes up every time a row of that table is inserted,
+# updated or deleted. Anything that keeps a copy of query results (the web app's response cache and ETags) reads the
+# counters for the tables behind that copy - if they haven't moved, the copy is still right and the query doesn't need
+# running again. Checking is one primary key lookup however big the tables are.
+#
+# Like FlightBoard the counters are bumped by triggers rather than by db_set, so writes from the bulk import,
+# another BAMBI process or the sqlite3 shell count too. FlightBoard isn't counted itself - the flight board triggers
+# rewrite a row of it for every flight a change touches, and counting those would cost far more than checking the
+# tables it's built from (the FLIGHT_LIST_TABLES below).
+# The table and triggers are created by migration 5 in db_migrations.
+#
+# PRAGMA data_version was the other option, but it only says that some other connection wrote something, to any
+# table - not which table, and not writes made on the same connection, which a pooled web server does all the time.
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in change_tracking.py")
+
+TRACKED_TABLES = ("Flight", "Aircraft", "AircraftModel", "Pilot", "Route", "Schedule", "City", "Airport",
+                  "CityAirport")
+
+CREATE_CHANGE_VERSION = '''
+            CREATE TABLE IF NOT EXISTS ChangeVersion (
+                table_name TEXT PRIMARY KEY,
+                version INTEGER NOT NULL DEFAULT 0
+            ) WITHOUT ROWID
+        '''
+
+
+def build_triggers():
+    # returns {trigger name: CREATE TRIGGER statement}
+    triggers = {}
+    for table in TRACKED_TABLES:
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            trigger_name = f"changeversion_{table.lower()}_{event.lower()}"
+            triggers[trigger_name] = (f"CREATE TRIGGER IF NOT EXISTS {trigger_name} AFTER {event} ON {table}\n"
+                                      f"BEGIN\nUPDATE ChangeVersion SET version = version + 1 WHERE table_name = '{table}';\nEND")
+    return triggers
+
+
+CHANGE_VERSION_TRIGGERS = build_triggers()
+
+
+def create_change_tracking(cursor):
+    # table, a row per tracked table and the triggers - used by db_migrations, so doesn't commit
+    cursor.execute(CREATE_CHANGE_VERSION)
+    cursor.executemany("INSERT OR IGNORE INTO ChangeVersion (table_name, version) VALUES (?, 0)",
+                       [(table,) for table in TRACKED_TABLES])
+    for create_trigger in CHANGE_VERSION_TRIGGERS.values():
+        logger.debug(create_trigger)
+        cursor.execute(create_trigger)
+    logger.info(f"ChangeVersion created with {len(CHANGE_VERSION_TRIGGERS)} triggers")
+
+
+def get_versions(DB_FILE, tables):
+    # the current counter of each table, in the order given
+    for table in tables:
+        if table not in TRACKED_TABLES:
+            raise ValueError(f"{table} is not a tracked table - choose from {', '.join(TRACKED_TABLES)}")
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        versions = dict(connection.execute(
+            f"SELECT table_name, version FROM ChangeVersion WHERE table_name IN ({', '.join('?' * len(tables))})", tables))
+    finally:
+        db_connection.release_connection(connection)
+    return tuple(versions.get(table, 0) for table in tables)
+
+
+def version_tag(DB_FILE, tables):
+    # a short string that changes whenever any of the tables does, e.g. for an ETag
+    return "-".join(str(version) for version in get_versions(DB_FILE, tables))
+
+
+
+# everything the flight board is built from, see flight_board.FLIGHT_BOARD_SOURCES
+FLIGHT_LIST_TABLES = ("Flight", "Aircraft", "AircraftModel", "Pilot", "Route", "Schedule", "CityAirport", "Airport")
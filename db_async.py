@@ -0,0 +1,116 @@
+import asyncio
+import inspect
+import logging
+import functools
+import threading
+import concurrent.futures
+import db_get
+import db_set
+import db_connection
+
+# asyncio version of the db_get/db_set layer, for embedding BAMBI in an async service
+# Every db_get/db_set function is blocking, so calling them straight from a coroutine stalls the event loop.
+# AsyncDatabase runs them on background threads instead and hands back awaitables -
+#   database = db_async.AsyncDatabase("bambi.db")
+#   flights = await database.get_flights()
+#   await database.add_pilot("New Pilot")
+#   cityairports, routes = await database.read_many("get_cities_airports", "get_routes")
+#   database.close()
+# the DB_FILE argument is filled in for you, everything else is passed through unchanged
+#
+# Reads go to a small pool of reader threads so independent reads run side by side (WAL lets them do that
+# while a write is in progress). Writes all go through one writer thread because SQLite only allows one writer
+# at a time anyway - queuing them here is cheaper than having them fight over the lock.
+# Each thread gets its own long-lived connection from db_connection. close() closes those and only those - other
+# threads and any ConnectionPool using the same file keep theirs.
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in db_async.py")
+
+DEFAULT_READ_WORKERS = 4
+
+
+def get_module_functions(module):
+    # public functions defined in the module itself (not ones it imported) that take DB_FILE first
+    functions = {}
+    for function_name, function in inspect.getmembers(module, inspect.isfunction):
+        if function.__module__ != module.__name__ or function_name.startswith("_"):
+            continue
+        # generators like iter_flights would only hand back the generator, the reads would still happen on the loop
+        if inspect.isgeneratorfunction(function):
+            continue
+        parameters = list(inspect.signature(function).parameters)
+        if parameters and parameters[0] == "DB_FILE":
+            functions[function_name] = function
+    return functions
+
+
+READ_FUNCTIONS = get_module_functions(db_get)
+WRITE_FUNCTIONS = get_module_functions(db_set)
+
+
+class AsyncDatabase:
+    def __init__(self, DB_FILE, read_workers=DEFAULT_READ_WORKERS):
+        self.DB_FILE = DB_FILE
+        self._read_executor = concurrent.futures.ThreadPoolExecutor(max_workers=read_workers, thread_name_prefix="bambi-read")
+        self._write_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="bambi-write")
+        # the connections our own threads have used, for close
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def _call(self, function, *args, **kwargs):
+        # runs on one of our threads - notes the thread's connection once the call has opened (or reused) it
+        try:
+            return function(*args, **kwargs)
+        finally:
+            connection = db_connection.get_connection(self.DB_FILE)
+            with self._connections_lock:
+                self._connections.add(connection)
+
+    def __getattr__(self, function_name):
+        # only called for names that aren't normal attributes, i.e. the db_get/db_set function names
+        if function_name in READ_FUNCTIONS:
+            executor, function = self._read_executor, READ_FUNCTIONS[function_name]
+        elif function_name in WRITE_FUNCTIONS:
+            executor, function = self._write_executor, WRITE_FUNCTIONS[function_name]
+        else:
+            raise AttributeError(f"No db_get or db_set function called {function_name}")
+
+        async def run(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, functools.partial(self._call, function, self.DB_FILE, *args, **kwargs))
+
+        run.__name__ = function_name
+        return run
+
+    async def run_in_reader(self, function, *args, **kwargs):
+        # runs any blocking callable on a reader thread, for code that needs several queries on one connection
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._read_executor, functools.partial(self._call, function, *args, **kwargs))
+
+    async def read_many(self, *calls):
+        # runs several independent reads at once and returns their results in the order asked for
+        # each call is a db_get function name, or a tuple of (function name, argument, argument...)
+        awaitables = []
+        for call in calls:
+            function_name, *args = (call,) if isinstance(call, str) else call
+            if function_name not in READ_FUNCTIONS:
+                raise ValueError(f"read_many only runs db_get functions, not {function_name}")
+            awaitables.append(getattr(self, function_name)(*args))
+        return await asyncio.gather(*awaitables)
+
+    def close(self):
+        self._read_executor.shutdown(wait=True)
+        self._write_executor.shutdown(wait=True)
+        with self._connections_lock:
+            for connection in self._connections:
+                if not db_connection.is_closed(connection):
+                    db_connection.close_connection(connection)
+            self._connections.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        # shutdown(wait=True) blocks, so do it off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
@@ -0,0 +1,170 @@
+import time
+import inspect
+import logging
+import functools
+import threading
+import collections
+
+# Read-through cache for the reference tables (Schedule, AircraftModel, City, Airport, CityAirport)
+# These hardly ever change but were re-read from disk on every menu redraw. The getters in db_get are decorated with
+#   @db_cache.cached("Schedule")
+# and the first call for a given set of arguments goes to the database, later calls come from memory.
+# The db_set functions that change those tables are decorated with
+#   @db_cache.invalidates("City")
+# which throws away every cached result that depended on that table once the write has finished.
+#
+# Writes made by a different BAMBI process don't go through our db_set, so entries also expire after
+# MAX_AGE_SECONDS to stop another operator's changes being hidden for too long.
+# Cached results are shared between callers so they must be treated as read-only.
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in db_cache.py")
+
+MAX_ENTRIES = 256
+MAX_AGE_SECONDS = 30
+
+# set to False to bypass the cache entirely, e.g. when checking a query against the database by hand
+CACHE_ENABLED = True
+
+
+class ReferenceCache:
+    # least-recently-used cache - an OrderedDict keeps entries in use order so the oldest is the first one
+    def __init__(self, max_entries=MAX_ENTRIES, max_age_seconds=MAX_AGE_SECONDS):
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        self._entries = collections.OrderedDict()  # key: (stored at, tables, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        # returns (found, value)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.max_age_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[2]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, tables, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), tables, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, DB_FILE, tables):
+        # key[0] is always the DB_FILE, see cached below
+        tables = set(tables)
+        with self._lock:
+            stale_keys = [key for key, entry in self._entries.items() if key[0] == DB_FILE and tables & entry[1]]
+            for key in stale_keys:
+                del self._entries[key]
+            self.invalidations += len(stale_keys)
+        return len(stale_keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+reference_cache = ReferenceCache()
+
+# other in-memory structures built from these tables (e.g. route_graph) register a listener(DB_FILE, tables)
+# here so they hear about the same writes the cache does
+_invalidation_listeners = []
+
+
+def add_invalidation_listener(listener):
+    if listener not in _invalidation_listeners:
+        _invalidation_listeners.append(listener)
+
+
+def notify_listeners(DB_FILE, tables):
+    for listener in _invalidation_listeners:
+        listener(DB_FILE, tables)
+
+
+def cached(*tables):
+    # tables is every table the query reads, so a write to any of them drops the cached result
+    tables = frozenset(tables)
+
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not CACHE_ENABLED:
+                return function(*args, **kwargs)
+
+            # bound to the signature so f(DB_FILE, 1), f(DB_FILE, x=1) and a defaulted x=1 all share one entry
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            DB_FILE, *other_args = arguments.args
+            key = (DB_FILE, function.__name__, tuple(other_args), tuple(sorted(arguments.kwargs.items())))
+            found, value = reference_cache.get(key)
+            if found:
+                return value
+
+            value = function(*args, **kwargs)
+            # db_get returns False when the query failed - don't remember failures
+            if value is not False:
+                reference_cache.put(key, tables, value)
+            return value
+        return wrapper
+    return decorator
+
+
+def invalidates(*tables):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(DB_FILE, *args, **kwargs):
+            try:
+                return function(DB_FILE, *args, **kwargs)
+            finally:
+                # done even if the write failed - a stale entry costs more than one extra query
+                dropped_entries = reference_cache.invalidate(DB_FILE, tables)
+                logger.debug("%s dropped %d cached entries for %s", function.__name__, dropped_entries, ", ".join(tables))
+                notify_listeners(DB_FILE, tables)
+        return wrapper
+    return decorator
+
+
+def invalidate(DB_FILE, *tables):
+    # for writes that don't go through a decorated db_set function
+    notify_listeners(DB_FILE, tables)
+    return reference_cache.invalidate(DB_FILE, tables)
+
+
+def clear():
+    reference_cache.clear()
+
+
+def get_cache_stats():
+    return reference_cache.stats()
+
+
+def log_cache_stats():
+    cache_stats = get_cache_stats()
+    logger.info(f"Reference cache - {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                f"({cache_stats['hit_rate']:.0%} hit rate), {cache_stats['entries']} entries, "
+                f"{cache_stats['evictions']} evictions, {cache_stats['invalidations']} invalidations")
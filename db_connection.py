@@ -0,0 +1,228 @@
+import sqlite3
+import logging
+import threading
+import time
+import queue
+import contextlib
+
+# Originally every function in db_get.py and db_set.py opened its own connection and closed it again at the end
+# which meant building a single flight opened more than a dozen connections and re-parsed the schema every time.
+# This script hands out long-lived connections instead:
+#   - get_connection gives each thread its own connection per database file, opened once and then reused
+#   - ConnectionPool is a bounded pool for web/worker use where lots of short-lived threads need a connection
+# PRAGMAs are applied once when a connection is opened rather than on every query
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in db_connection.py")
+
+# PRAGMA profiles - pick one with set_profile (bambi.py does this via db_initialisation.init)
+# journal_mode is stored in the database file itself so it is applied once by configure_database,
+# everything else is per-connection and applied in open_connection, in the order listed
+#   concurrent - WAL so readers and a writer don't block each other, NORMAL sync is safe under WAL
+#   durable    - still WAL but fsyncs every commit, for when losing the last transaction on power loss is not OK
+#   legacy     - the original rollback journal, for network drives where WAL's shared memory file doesn't work
+PRAGMA_PROFILES = {
+    "concurrent": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,  # ms to wait on a lock before giving up with "database is locked"
+        "cache_size": -16000,  # negative means KiB rather than pages, so this is ~16MB per connection
+        "mmap_size": 268435456,  # 256MB of the file read via memory mapping rather than read() calls
+        "temp_store": "MEMORY",
+    },
+    "durable": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 10000,
+        "cache_size": -8000,
+        "mmap_size": 0,
+        "temp_store": "MEMORY",
+    },
+    "legacy": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+    },
+}
+DEFAULT_PROFILE = "concurrent"
+
+# these are the per-connection settings of the active profile
+CONNECTION_PRAGMAS = {}
+
+_thread_local = threading.local()
+_registry_lock = threading.Lock()
+_open_connections = []
+
+# bumped by close_all so threads know their cached connection has been closed underneath them
+_generation = 0
+
+ACTIVE_PROFILE = DEFAULT_PROFILE
+
+
+def set_profile(profile_name):
+    # switching profile only affects connections opened afterwards, so close_all first if it needs to apply everywhere
+    global ACTIVE_PROFILE
+    if profile_name not in PRAGMA_PROFILES:
+        raise ValueError(f"Unknown database profile {profile_name} - choose from {', '.join(PRAGMA_PROFILES)}")
+    ACTIVE_PROFILE = profile_name
+    CONNECTION_PRAGMAS.clear()
+    CONNECTION_PRAGMAS.update({pragma: value for pragma, value in PRAGMA_PROFILES[profile_name].items()
+                               if pragma != "journal_mode"})
+    logger.info(f"Database profile set to {profile_name}")
+
+
+set_profile(DEFAULT_PROFILE)
+
+
+def configure_database(DB_FILE):
+    # file-level settings, checked on every startup so databases created before WAL was introduced get switched over
+    # returns the journal mode the file ends up in
+    journal_mode = PRAGMA_PROFILES[ACTIVE_PROFILE]["journal_mode"]
+    connection = sqlite3.connect(DB_FILE)
+    try:
+        current_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+        if current_mode.upper() != journal_mode:
+            logger.info(f"Switching {DB_FILE} journal mode from {current_mode} to {journal_mode}")
+            current_mode = connection.execute(f"PRAGMA journal_mode = {journal_mode}").fetchone()[0]
+            if current_mode.upper() != journal_mode:
+                # happens if another process has the file open, we carry on in whatever mode it is in
+                logger.warning(f"Could not switch {DB_FILE} to {journal_mode}, still in {current_mode}")
+        else:
+            logger.info(f"{DB_FILE} already in {journal_mode} journal mode")
+    finally:
+        connection.close()
+    return current_mode
+
+
+def open_connection(DB_FILE):
+    # check_same_thread is off because pooled connections get passed between threads
+    # thread safety comes from only ever handing a connection to one thread at a time
+    connection = sqlite3.connect(DB_FILE, check_same_thread=False)
+    for pragma, value in CONNECTION_PRAGMAS.items():
+        connection.execute(f"PRAGMA {pragma} = {value}")
+    logger.info(f"Opened new connection to {DB_FILE}")
+
+    with _registry_lock:
+        _open_connections.append((DB_FILE, connection))
+    return connection
+
+
+def get_connection(DB_FILE):
+    # if this thread is currently holding a pooled connection for this file we use that one
+    leased = getattr(_thread_local, "leased", None)
+    if leased is not None and leased[0] == DB_FILE:
+        return leased[1]
+
+    connections = getattr(_thread_local, "connections", None)
+    if connections is None or getattr(_thread_local, "generation", None) != _generation:
+        connections = {}
+        _thread_local.connections = connections
+        _thread_local.generation = _generation
+
+    connection = connections.get(DB_FILE)
+    if connection is None:
+        connection = open_connection(DB_FILE)
+        connections[DB_FILE] = connection
+    return connection
+
+
+def release_connection(connection):
+    # called where we used to call connection.close()
+    # the connection stays open for the next caller, but anything left uncommitted after an error is rolled back
+    # so it can't leak into the next function that uses the same connection
+    if connection.in_transaction:
+        logger.warning("Rolling back uncommitted transaction on connection release")
+        connection.rollback()
+
+
+def is_closed(connection):
+    # sqlite3 has no flag for it, but anything done with a closed connection raises ProgrammingError
+    try:
+        connection.total_changes
+    except sqlite3.ProgrammingError:
+        return True
+    return False
+
+
+def close_connection(connection):
+    # closes one connection we opened, for callers that know exactly which connections are theirs (db_async)
+    with _registry_lock:
+        _open_connections[:] = [registered for registered in _open_connections if registered[1] is not connection]
+    connection.close()
+
+
+def close_all(DB_FILE=None):
+    # closes every connection we have opened (or just those for DB_FILE)
+    # needed before the database file is deleted or replaced, e.g. when db_initialisation has to start afresh
+    global _generation
+    with _registry_lock:
+        remaining = []
+        for open_db_file, connection in _open_connections:
+            if DB_FILE is None or open_db_file == DB_FILE:
+                connection.close()
+            else:
+                remaining.append((open_db_file, connection))
+        _open_connections[:] = remaining
+        _generation += 1
+    logger.info(f"Closed connections for {DB_FILE or 'all databases'}")
+
+
+class ConnectionPool:
+    # Bounded pool for the web/worker case - connections are created lazily up to max_connections
+    # and a caller waits up to timeout seconds for one to come free rather than opening more
+    # Idle connections are kept with the close_all generation they were last checked at. One that close_all has
+    # closed since is dropped (freeing its slot) instead of being handed out again
+    def __init__(self, DB_FILE, max_connections=8, timeout=10):
+        self.DB_FILE = DB_FILE
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                checked_generation, connection = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    if self._created < self.max_connections:
+                        self._created += 1
+                        return open_connection(self.DB_FILE)
+                try:
+                    checked_generation, connection = self._idle.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    raise TimeoutError(f"No pooled connection to {self.DB_FILE} became free within {self.timeout}s")
+
+            if checked_generation == _generation or not is_closed(connection):
+                return connection
+            self._discard()
+
+    def release(self, connection):
+        if is_closed(connection):
+            # closed by close_all while it was leased out
+            self._discard()
+            return
+        release_connection(connection)
+        self._idle.put((_generation, connection))
+
+    def _discard(self):
+        with self._lock:
+            self._created -= 1
+        logger.info(f"Dropped a closed pooled connection to {self.DB_FILE}")
+
+    @contextlib.contextmanager
+    def connection(self):
+        # while inside this block every db_get/db_set call made by this thread uses the leased connection
+        connection = self.acquire()
+        previous = getattr(_thread_local, "leased", None)
+        _thread_local.leased = (self.DB_FILE, connection)
+        try:
+            yield connection
+        finally:
+            _thread_local.leased = previous
+            self.release(connection)
@@ -1,4 +1,8 @@
 import utils
+import db_connection
+import db_cache
+import flight_times
+import flight_conflicts
 import logging
 import sqlite3
 
@@ -10,10 +14,10 @@ import sqlite3
 # this script is primarily concerned with SELECT statements necessary to render the different menus
 
 
+@utils.trace
 def get_routes(DB_FILE):
-    utils.log_active_function()
     logging.info("Retrieving existing routes")
-    connection = sqlite3.connect(DB_FILE)
+    connection = db_connection.get_connection(DB_FILE)
     cursor = connection.cursor()
     get_route_query = '''
             SELECT 
@@ -45,14 +49,15 @@ def get_routes(DB_FILE):
 
 
     returned_route_rows = cursor.fetchall()
-    connection.close()
-    logging.info("Connection closed after retrieving routes")
+    db_connection.release_connection(connection)
+    logging.info("Connection released after retrieving routes")
     return returned_route_rows
 
+@utils.trace
+@db_cache.cached("City", "Airport", "CityAirport")
 def get_cities_airports(DB_FILE):
-    utils.log_active_function()
     logging.info("Getting city and airport info")
-    connection = sqlite3.connect(DB_FILE)
+    connection = db_connection.get_connection(DB_FILE)
     cursor = connection.cursor()
 
     get_cityairport = '''
@@ -78,15 +83,15 @@ ORDER BY a.airport_code NULLS LAST, c.city_name, a.airport_name;
     cursor.execute(get_cityairport)
 
     returned_cityairport_rows = cursor.fetchall()
-    connection.close()
-    logging.info("Connection closed after retrieving cityairport")
+    db_connection.release_connection(connection)
+    logging.info("Connection released after retrieving cityairport")
     return returned_cityairport_rows
 
+@utils.trace
 def get_pilots(DB_FILE):
-    utils.log_active_function()
     logging.info("Getting pilots")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
 
         get_pilots = '''
@@ -105,7 +110,7 @@ def get_pilots(DB_FILE):
         cursor.execute(get_pilots)
 
         returned_pilot_rows = cursor.fetchall()
-        logging.debug(returned_pilot_rows)
+        logging.debug("Returned %s", utils.sample_rows(returned_pilot_rows))
 
     except sqlite3.DatabaseError as dbe:
         logging.error(f"Database error {dbe}")
@@ -114,14 +119,15 @@ def get_pilots(DB_FILE):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after getting all pilots")
-        connection.close()
+        logging.info("Connection released after getting all pilots")
+        db_connection.release_connection(connection)
     return returned_pilot_rows
+@utils.trace
+@db_cache.cached("Schedule")
 def get_schedules(DB_FILE):
-    utils.log_active_function()
     logging.info("Getting schedules")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
 
         get_schedules = '''
@@ -140,7 +146,7 @@ def get_schedules(DB_FILE):
         cursor.execute(get_schedules)
 
         returned_schedule_rows = cursor.fetchall()
-        logging.debug(returned_schedule_rows)
+        logging.debug("Returned %s", utils.sample_rows(returned_schedule_rows))
 
     except sqlite3.DatabaseError as dbe:
         logging.error(f"Database error {dbe}")
@@ -149,15 +155,16 @@ def get_schedules(DB_FILE):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after getting all schedules")
-        connection.close()
+        logging.info("Connection released after getting all schedules")
+        db_connection.release_connection(connection)
     return returned_schedule_rows
 
+@utils.trace
+@db_cache.cached("City")
 def get_cities(DB_FILE):
-    utils.log_active_function()
     logging.info("Getting available cities")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
 
         get_cities = '''
@@ -172,7 +179,7 @@ def get_cities(DB_FILE):
         cursor.execute(get_cities)
 
         returned_cities = cursor.fetchall()
-        logging.debug(returned_cities)
+        logging.debug("Returned %s", utils.sample_rows(returned_cities))
 
     except sqlite3.DatabaseError as dbe:
         logging.error(f"Database error {dbe}")
@@ -181,15 +188,15 @@ def get_cities(DB_FILE):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after getting all cities")
-        connection.close()
+        logging.info("Connection released after getting all cities")
+        db_connection.release_connection(connection)
     return returned_cities
 
+@utils.trace
 def get_aircraft(DB_FILE):
-    utils.log_active_function()
     logging.info("Getting available aircraft")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
 
         get_aircraft = '''
@@ -212,7 +219,7 @@ def get_aircraft(DB_FILE):
         cursor.execute(get_aircraft)
 
         returned_aircraft = cursor.fetchall()
-        logging.debug(returned_aircraft)
+        logging.debug("Returned %s", utils.sample_rows(returned_aircraft))
 
     except sqlite3.DatabaseError as dbe:
         logging.error(f"Database error {dbe}")
@@ -221,15 +228,16 @@ def get_aircraft(DB_FILE):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after getting all aircraft")
-        connection.close()
+        logging.info("Connection released after getting all aircraft")
+        db_connection.release_connection(connection)
     return returned_aircraft
 
+@utils.trace
+@db_cache.cached("AircraftModel")
 def get_aircraftmodels(DB_FILE):
-    utils.log_active_function()
     logging.info("Getting available aircraft")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
 
         get_aircraftmodels = '''
@@ -250,7 +258,7 @@ def get_aircraftmodels(DB_FILE):
         cursor.execute(get_aircraftmodels)
 
         returned_aircraftmodels = cursor.fetchall()
-        logging.debug(returned_aircraftmodels)
+        logging.debug("Returned %s", utils.sample_rows(returned_aircraftmodels))
 
     except sqlite3.DatabaseError as dbe:
         logging.error(f"Database error {dbe}")
@@ -259,64 +267,42 @@ def get_aircraftmodels(DB_FILE):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after getting all aircraft models")
-        connection.close()
+        logging.info("Connection released after getting all aircraft models")
+        db_connection.release_connection(connection)
     return returned_aircraftmodels
 
+@utils.trace
 def get_flights(DB_FILE):
-    utils.log_active_function()
     logging.info("Getting all flights")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
 
+        # reads the materialised board rather than joining nine tables, see flight_board.py for how it's kept up to date
         get_flights = '''
-                       SELECT 
-                       f.flight_id,
-                       f.flight_number,
-                       a.aircraft_name,
-                       am.aircraftmodel_name,
-                       p.pilot_name AS captain,
-                       ao.airport_code AS origin_airport,
-                       ad.airport_code AS destination_airport,
-                       s.departure_time,
-                       f.arrival_time
-
-                       FROM 
-                       Flight f
-                       
-                       INNER JOIN Aircraft a on f.aircraft_id = a.aircraft_id
-                       INNER JOIN AircraftModel am on a.aircraftmodel_id = am.aircraftmodel_id
-                       INNER JOIN Pilot p on f.pilot_id = p.pilot_id
-                       INNER JOIN Route r on f.route_id = r.route_id
-                       INNER JOIN Schedule s on f.schedule_id = s.schedule_id
-                       
-                       INNER JOIN CityAirport cao on r.origin_cityairport_id = cao.cityairport_id
-                       INNER JOIN Airport ao on cao.airport_id = ao.airport_id
-
-                       INNER JOIN CityAirport cad on r.destination_cityairport_id = cad.cityairport_id
-                       INNER JOIN Airport ad on cad.airport_id = ad.airport_id
-                                            
+                       SELECT
+                       flight_id,
+                       flight_number,
+                       aircraft_name,
+                       aircraftmodel_name,
+                       captain,
+                       origin_airport,
+                       destination_airport,
+                       departure_time,
+                       arrival_time
+
+                       FROM
+                       FlightBoard
+
                        ORDER by
-                       f.flight_id
+                       flight_id
                        '''
-        # I didn't know that cao/ao and cad/ad was "acceptable" practice when setting up table aliases (aliasii?)
-        # A colleague at work suggested it's fine to do so if it makes the code more readable, so I used the practice
-        # it makes it much clearer for me when i'm doing multiple joins on the same tables!
-
-        # most of the query is straightforward but the origin/destination is as follows
-        # Flight has a Route and a Route has an origin + destination airport
-        # So we need Flight > Route > CityAirport > Airport
-        # repeated for origin/destination
-
-        # flight time is calculated as the route distance/aircraftmodel speed
-
 
         logging.debug(get_flights)
         cursor.execute(get_flights)
 
         returned_flights = cursor.fetchall()
-        logging.debug(returned_flights)
+        logging.debug("Returned %s", utils.sample_rows(returned_flights))
 
     except sqlite3.DatabaseError as dbe:
         logging.error(f"Database error {dbe}")
@@ -325,40 +311,162 @@ def get_flights(DB_FILE):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after getting all flights")
-        connection.close()
+        logging.info("Connection released after getting all flights")
+        db_connection.release_connection(connection)
     return returned_flights
 
-def check_valid_flight(DB_FILE, flight_id):
-    utils.log_active_function()
-    logging.info("Getting list of valid flight IDs")
+# Paged flights
+# get_flights fetches every flight, which is fine for a few hundred but at 100k+ flights it builds the whole list in
+# memory just to draw the first screen. get_flights_page uses keyset pagination instead - rather than OFFSET (which
+# still has to step over every earlier row) it carries on from the last flight_id shown, so every page costs the
+# same however far through the list you are -
+#   first_page = db_get.get_flights_page(DB_FILE)
+#   next_page = db_get.get_flights_page(DB_FILE, after_flight_id=first_page[-1][0])
+#   previous_page = db_get.get_flights_page(DB_FILE, before_flight_id=next_page[0][0])
+# filters is an optional {column: value} of exact matches on the board columns below, e.g. {"origin_airport": "LHR"}
+FLIGHT_PAGE_SIZE = 20
+FLIGHT_FILTERS = ("flight_number", "aircraft_name", "aircraftmodel_name", "captain", "origin_airport",
+                  "destination_airport", "departure_time", "arrival_time")
+
+@utils.trace
+def get_flights_page(DB_FILE, page_size=FLIGHT_PAGE_SIZE, after_flight_id=None, before_flight_id=None, filters=None):
+    # up to page_size flights in flight_id order, or False on a database error
+    filters = filters or {}
+    for column in filters:
+        # column names can't be bound as ? parameters so they have to come off the list
+        if column not in FLIGHT_FILTERS:
+            raise ValueError(f"Can't filter flights on {column}")
+
+    conditions = [f"{column} = ?" for column in filters]
+    values = list(filters.values())
+    if after_flight_id is not None:
+        conditions.append("flight_id > ?")
+        values.append(after_flight_id)
+    if before_flight_id is not None:
+        conditions.append("flight_id < ?")
+        values.append(before_flight_id)
+    # going backwards the page nearest before_flight_id is wanted, so read in reverse and flip it round afterwards
+    backwards = before_flight_id is not None and after_flight_id is None
+    values.append(page_size)
+
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
-        get_flight_ids = '''
-               SELECT 
-               f.flight_id        
-           FROM 
-               Flight f
-           
-           '''
-
-        cursor.execute(get_flight_ids)
+        get_flights_page = f'''
+                       SELECT
+                       flight_id,
+                       flight_number,
+                       aircraft_name,
+                       aircraftmodel_name,
+                       captain,
+                       origin_airport,
+                       destination_airport,
+                       departure_time,
+                       arrival_time
+
+                       FROM
+                       FlightBoard
+                       {"WHERE " + " AND ".join(conditions) if conditions else ""}
+                       ORDER by
+                       flight_id {"DESC" if backwards else ""}
+                       LIMIT ?
+                       '''
+        logging.debug(get_flights_page)
+        cursor.execute(get_flights_page, values)
+        returned_flights = cursor.fetchall()
+        if backwards:
+            returned_flights.reverse()
+        logging.debug("Returned %s", utils.sample_rows(returned_flights))
 
-        returned_flight_ids = cursor.fetchall()
-        logging.debug(f"Returned flight id list  {returned_flight_ids}")
+    except sqlite3.DatabaseError as dbe:
+        logging.error(f"Database error {dbe}")
+        return False
+    except Exception as exc:
+        logging.error(f"Unknown error {exc}")
+        return False
+    finally:
+        db_connection.release_connection(connection)
+    return returned_flights
 
+def iter_flights(DB_FILE, page_size=FLIGHT_PAGE_SIZE, filters=None):
+    # every flight in flight_id order, fetched a page at a time as the caller works through them
+    # the connection is only held while a page is being read, not between pages
+    after_flight_id = None
+    while True:
+        flight_page = get_flights_page(DB_FILE, page_size, after_flight_id=after_flight_id, filters=filters)
+        if flight_page is False:
+            raise sqlite3.DatabaseError("Error reading flights, please check the log")
+        yield from flight_page
+        if len(flight_page) < page_size:
+            return
+        after_flight_id = flight_page[-1][0]
+
+# The check_valid_* functions used to SELECT every id in a table, build a python list and then do an "in" test
+# which meant a full table transfer for every validation. They now all go through check_exists/get_existing_values
+# which ask SQLite for just the row(s) we care about using the primary key (or an index, see db_initialisation)
+# check_exists is for one value typed in at a menu, get_existing_values for a whole file of ids at once (flight_import
+# checks every aircraft, pilot, route and schedule in a timetable with one query per column rather than one per row)
+
+# table and column names can't be bound as ? parameters so anything passed in must be on this list
+EXISTENCE_LOOKUPS = {
+    "Flight": ("flight_id",),
+    "Pilot": ("pilot_id",),
+    "Airport": ("airport_id", "airport_code"),
+    "City": ("city_id",),
+    "CityAirport": ("cityairport_id", "city_id", "airport_id"),
+    "Aircraft": ("aircraft_id", "aircraftmodel_id"),
+    "AircraftModel": ("aircraftmodel_id",),
+    "Route": ("route_id",),
+    "Schedule": ("schedule_id",),
+}
+
+# SQLite limits how many ? placeholders one statement can have, so batched lookups are split into chunks
+EXISTENCE_BATCH_SIZE = 500
+
+def check_lookup_allowed(table, column):
+    if column not in EXISTENCE_LOOKUPS.get(table, ()):
+        raise ValueError(f"Existence lookup not allowed on {table}.{column}")
+
+def check_exists(DB_FILE, table, column, value):
+    # does a row with table.column = value exist - database errors are raised rather than swallowed
+    # so callers can tell "not found" apart from "couldn't check"
+    check_lookup_allowed(table, column)
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        check_row_exists = f"SELECT 1 FROM {table} WHERE {column} = ? LIMIT 1"
+        row_found = connection.execute(check_row_exists, (value,)).fetchone() is not None
+    finally:
+        db_connection.release_connection(connection)
+    logging.debug("%s.%s = %r exists: %s", table, column, value, row_found)
+    return row_found
+
+def get_existing_values(DB_FILE, table, column, values):
+    # batched version of check_exists - returns the set of values that are present in table.column
+    check_lookup_allowed(table, column)
+    values = list(dict.fromkeys(values))  # de-duplicates but keeps order
+    existing_values = set()
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        for start in range(0, len(values), EXISTENCE_BATCH_SIZE):
+            batch = values[start:start + EXISTENCE_BATCH_SIZE]
+            placeholders = ", ".join("?" for _ in batch)
+            get_matching_values = f"SELECT {column} FROM {table} WHERE {column} IN ({placeholders})"
+            existing_values.update(row[0] for row in connection.execute(get_matching_values, batch))
+    finally:
+        db_connection.release_connection(connection)
+    logging.debug("%d of %d values found in %s.%s", len(existing_values), len(values), table, column)
+    return existing_values
 
-        valid_flight_ids = [returned_flight_id[0] for returned_flight_id in returned_flight_ids]
-        logging.debug(f"ID returned = {valid_flight_ids}")
-        logging.debug(f"flightID = {flight_id}")
-        if flight_id in valid_flight_ids:
+@utils.trace
+def check_valid_flight(DB_FILE, flight_id):
+    logging.info(f"Checking if flight id {flight_id} is valid")
+    try:
+        if check_exists(DB_FILE, "Flight", "flight_id", flight_id):
             logging.info(f"Flight id {flight_id} found in list of valid flights")
             return True
         else:
             logging.info(f"Flight id {flight_id} NOT found in list of valid flights")
             return False
-        logging.debug(returned_flight_ids)
 
     except sqlite3.DatabaseError as dbe:
         logging.error(f"Database error {dbe}")
@@ -367,41 +475,19 @@ def check_valid_flight(DB_FILE, flight_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking flight ids")
-        connection.close()
+        logging.info("Finished checking flight ids")
 
+@utils.trace
 def check_valid_pilot_id(DB_FILE, pilot_id):
-    utils.log_active_function()
-    logging.info("Getting list of valid pilot IDs")
+    logging.info(f"Checking if pilot id {pilot_id} is valid")
     pilot_id = int(pilot_id)
     try:
-        connection = sqlite3.connect(DB_FILE)
-        cursor = connection.cursor()
-        get_pilot_ids = '''
-            SELECT 
-            p.pilot_id        
-        FROM 
-            Pilot p
-        WHERE p.pilot_id = ?
-        '''
-        values = (pilot_id,)
-
-        cursor.execute(get_pilot_ids, values)
-
-        returned_pilot_ids = cursor.fetchall()
-        logging.debug(f"Returned pilot id list of tuples: {returned_pilot_ids}")
-
-        # the select query returns a tuple of pilot_ids, I need to gfrab the list of pilot IDs from the query result
-        valid_pilot_ids = [returned_pilot_id[0] for returned_pilot_id in returned_pilot_ids]
-        logging.debug(f"ID returned = {valid_pilot_ids}")
-        logging.debug(f"pilotID = {pilot_id}")
-        if pilot_id in valid_pilot_ids :
+        if check_exists(DB_FILE, "Pilot", "pilot_id", pilot_id):
             logging.info(f"Pilot id {pilot_id} found in list of valid pilots")
             return True
         else:
             logging.info(f"Pilot id {pilot_id} NOT found in list of valid pilots")
             return False
-        logging.debug(returned_pilot_ids)
 
     except sqlite3.DatabaseError as dbe:
         logging.error(f"Database error {dbe}")
@@ -410,14 +496,13 @@ def check_valid_pilot_id(DB_FILE, pilot_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking pilot id")
-        connection.close()
+        logging.info("Finished checking pilot id")
 
+@utils.trace
 def check_pilot_assigned_flight(DB_FILE, pilot_id):
-    utils.log_active_function()
     logging.info(f"Checking if pilot_id {pilot_id} is assigned to a flight...")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         check_pilot_flight = '''
             SELECT flight_id
@@ -428,7 +513,7 @@ def check_pilot_assigned_flight(DB_FILE, pilot_id):
         cursor.execute(check_pilot_flight, values)
 
         flight_pilot_ids = cursor.fetchall()
-        logging.debug(f"list of ids: {flight_pilot_ids}")
+        logging.debug("list of ids: %s", utils.sample_rows(flight_pilot_ids))
 
         if len(flight_pilot_ids) == 0:
             logging.info("Pilot not assigned to a flight")
@@ -444,33 +529,18 @@ def check_pilot_assigned_flight(DB_FILE, pilot_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking pilot flight mapping")
-        connection.close()
+        logging.info("Connection released after checking pilot flight mapping")
+        db_connection.release_connection(connection)
 
+@utils.trace
 def check_airport_code(DB_FILE, airport_code):
-    utils.log_active_function()
     logging.info(f"Checking if {airport_code} is a valid, unused airport code")
 
     if len(airport_code) == 3:
         logging.info(f"{airport_code} is 3 chars - valid format")
 
         try:
-            connection = sqlite3.connect(DB_FILE)
-            cursor = connection.cursor()
-            get_airport_codes = '''
-                        SELECT airport_code
-                        FROM Airport 
-                        '''
-
-            logging.debug(get_airport_codes)
-            cursor.execute(get_airport_codes)
-
-            existing_airport_codes = cursor.fetchall() #list of tuples here, needs converting
-            logging.debug(f"list of tuples: {existing_airport_codes}")
-            existing_airport_codes_list = [code[0] for code in existing_airport_codes]
-            logging.debug(f"list of codes: {existing_airport_codes_list}")
-
-            if airport_code in existing_airport_codes_list:
+            if check_exists(DB_FILE, "Airport", "airport_code", airport_code):
                 logging.info(f"Matched airport code {airport_code} to existing airport - new code invalid")
                 return False
             else:
@@ -484,33 +554,16 @@ def check_airport_code(DB_FILE, airport_code):
             logging.error(f"Unknown error {exc}")
             return False
         finally:
-            logging.info("Connection closed after checking airport code")
-            connection.close()
+            logging.info("Finished checking airport code")
     else:
         logging.info(f"{airport_code} not 3 chars long - invalid code")
         return False
 
+@utils.trace
 def check_valid_airport(DB_FILE, airport_id):
-    utils.log_active_function()
     logging.info(f"Checking if {airport_id} is a valid airportID")
-
     try:
-        connection = sqlite3.connect(DB_FILE)
-        cursor = connection.cursor()
-        get_airport_ids = '''
-                           SELECT airport_id
-                           FROM Airport 
-                           '''
-
-        logging.debug(get_airport_ids)
-        cursor.execute(get_airport_ids)
-
-        existing_airport_ids = cursor.fetchall()  # list of tuples here, needs converting
-        logging.debug(f"returned airport id tuples: {existing_airport_ids}")
-        existing_airport_ids_list = [airport[0] for airport in existing_airport_ids]
-        logging.debug(f"list of airport ids: {existing_airport_ids_list}")
-
-        if airport_id in existing_airport_ids_list:
+        if check_exists(DB_FILE, "Airport", "airport_id", airport_id):
             logging.info(f"Matched airport ID {airport_id} to existing airport")
             return True
         else:
@@ -524,30 +577,13 @@ def check_valid_airport(DB_FILE, airport_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking city ID")
-        connection.close()
+        logging.info("Finished checking airport ID")
 
+@utils.trace
 def check_valid_city(DB_FILE, city_id):
-    utils.log_active_function()
     logging.info(f"Checking if {city_id} is a valid city")
-
     try:
-        connection = sqlite3.connect(DB_FILE)
-        cursor = connection.cursor()
-        get_city_ids = '''
-                           SELECT city_id
-                           FROM City 
-                           '''
-
-        logging.debug(get_city_ids)
-        cursor.execute(get_city_ids)
-
-        existing_city_ids = cursor.fetchall()  # list of tuples here, needs converting
-        logging.debug(f"returned city id tuples: {existing_city_ids}")
-        existing_city_ids_list = [city[0] for city in existing_city_ids]
-        logging.debug(f"list of city ids: {existing_city_ids_list}")
-
-        if city_id in existing_city_ids_list:
+        if check_exists(DB_FILE, "City", "city_id", city_id):
             logging.info(f"Matched city ID {city_id} to existing city")
             return True
         else:
@@ -561,30 +597,13 @@ def check_valid_city(DB_FILE, city_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking city ID")
-        connection.close()
+        logging.info("Finished checking city ID")
 
+@utils.trace
 def check_city_has_airport(DB_FILE, city_id):
-    utils.log_active_function()
     logging.info(f"Checking if {city_id} has a mapped airport")
-
     try:
-        connection = sqlite3.connect(DB_FILE)
-        cursor = connection.cursor()
-        get_city_ids = '''
-                           SELECT city_id
-                           FROM CityAirport 
-                           '''
-
-        logging.debug(get_city_ids)
-        cursor.execute(get_city_ids)
-
-        existing_city_ids = cursor.fetchall()  # list of tuples here, needs converting
-        logging.debug(f"returned city id tuples: {existing_city_ids}")
-        existing_city_ids_list = [city[0] for city in existing_city_ids]
-        logging.debug(f"list of city ids: {existing_city_ids_list}")
-
-        if city_id in existing_city_ids_list:
+        if check_exists(DB_FILE, "CityAirport", "city_id", city_id):
             logging.info(f"Matched city ID {city_id} to existing cityairport mapping")
             return True
         else:
@@ -598,30 +617,14 @@ def check_city_has_airport(DB_FILE, city_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking city ID")
-        connection.close()
+        logging.info("Finished checking city ID")
 
+@utils.trace
 def check_valid_aircraft(DB_FILE, aircraft_id):
-    utils.log_active_function()
     logging.info(f"Checking if {aircraft_id} is a valid aircraft")
     aircraft_id = int(aircraft_id)
     try:
-        connection = sqlite3.connect(DB_FILE)
-        cursor = connection.cursor()
-        get_aircraft_ids = '''
-                               SELECT aircraft_id
-                               FROM Aircraft
-                               '''
-
-        logging.debug(get_aircraft_ids)
-        cursor.execute(get_aircraft_ids)
-
-        existing_aircraft_ids = cursor.fetchall()  # list of tuples here, needs converting
-        logging.debug(f"returned aircraft id tuples: {existing_aircraft_ids}")
-        existing_aircraft_ids_list = [aircraft[0] for aircraft in existing_aircraft_ids]
-        logging.debug(f"list of aircraft ids: {existing_aircraft_ids_list}")
-
-        if aircraft_id in existing_aircraft_ids_list:
+        if check_exists(DB_FILE, "Aircraft", "aircraft_id", aircraft_id):
             logging.info(f"Matched aircraft ID {aircraft_id} to existing aircraft")
             return True
         else:
@@ -635,30 +638,13 @@ def check_valid_aircraft(DB_FILE, aircraft_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking aircraft ID")
-        connection.close()
+        logging.info("Finished checking aircraft ID")
 
+@utils.trace
 def check_valid_route(DB_FILE, route_id):
-    utils.log_active_function()
     logging.info(f"Checking if {route_id} is valid")
-
     try:
-        connection = sqlite3.connect(DB_FILE)
-        cursor = connection.cursor()
-        get_route_id = '''
-                                   SELECT route_id
-                                   FROM Route
-                                   '''
-
-        logging.debug(get_route_id)
-        cursor.execute(get_route_id)
-
-        existing_route_ids = cursor.fetchall()  # list of tuples here, needs converting
-        logging.debug(f"returned id tuples: {existing_route_ids}")
-        existing_route_ids_list = [aircraft[0] for aircraft in existing_route_ids]
-        logging.debug(f"list of ids: {existing_route_ids_list}")
-
-        if route_id in existing_route_ids_list:
+        if check_exists(DB_FILE, "Route", "route_id", route_id):
             logging.info(f"Matched ID {route_id} to existing entry")
             return True
         else:
@@ -672,33 +658,16 @@ def check_valid_route(DB_FILE, route_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking route ID")
-        connection.close()
+        logging.info("Finished checking route ID")
+@utils.trace
 def check_valid_schedule(DB_FILE, schedule_id):
-    utils.log_active_function()
     logging.info(f"Checking if {schedule_id} is valid")
-
     try:
-        connection = sqlite3.connect(DB_FILE)
-        cursor = connection.cursor()
-        get_schedule_id = '''
-                                      SELECT schedule_id
-                                      FROM Schedule
-                                      '''
-
-        logging.debug(get_schedule_id)
-        cursor.execute(get_schedule_id)
-
-        existing_schedule_ids = cursor.fetchall()  # list of tuples here, needs converting
-        logging.debug(f"returned id tuples: {existing_schedule_ids}")
-        existing_schedule_ids_list = [aircraft[0] for aircraft in existing_schedule_ids]
-        logging.debug(f"list of ids: {existing_schedule_ids_list}")
-
-        if schedule_id in existing_schedule_ids_list:
+        if check_exists(DB_FILE, "Schedule", "schedule_id", schedule_id):
             logging.info(f"Matched ID {schedule_id} to existing entry")
             return True
         else:
-            logging.info(f"Entry for scedheule {schedule_id} not found ")
+            logging.info(f"Entry for schedule {schedule_id} not found ")
             return False
 
     except sqlite3.DatabaseError as dbe:
@@ -708,30 +677,13 @@ def check_valid_schedule(DB_FILE, schedule_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking schedule ID")
-        connection.close()
+        logging.info("Finished checking schedule ID")
 
+@utils.trace
 def check_valid_aircraftmodel(DB_FILE, aircraftmodel_id):
-    utils.log_active_function()
     logging.info(f"Checking if {aircraftmodel_id} is a valid aircraftmodel")
-
     try:
-        connection = sqlite3.connect(DB_FILE)
-        cursor = connection.cursor()
-        get_aircraftmodel_ids = '''
-                                   SELECT aircraftmodel_id
-                                   FROM AircraftModel
-                                   '''
-
-        logging.debug(get_aircraftmodel_ids)
-        cursor.execute(get_aircraftmodel_ids)
-
-        existing_aircraftmodel_ids = cursor.fetchall()  # list of tuples here, needs converting
-        logging.debug(f"returned aircraftmodel id tuples: {existing_aircraftmodel_ids}")
-        existing_aircraftmodel_ids_list = [aircraftmodel[0] for aircraftmodel in existing_aircraftmodel_ids]
-        logging.debug(f"list of aircraftmodel ids: {existing_aircraftmodel_ids_list}")
-
-        if aircraftmodel_id in existing_aircraftmodel_ids_list:
+        if check_exists(DB_FILE, "AircraftModel", "aircraftmodel_id", aircraftmodel_id):
             logging.info(f"Matched aircraftmodel ID {aircraftmodel_id} to existing aircraftmodel")
             return True
         else:
@@ -745,30 +697,13 @@ def check_valid_aircraftmodel(DB_FILE, aircraftmodel_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking aircraftmodel ID")
-        connection.close()
+        logging.info("Finished checking aircraftmodel ID")
 
+@utils.trace
 def check_aircraftmodel_in_use(DB_FILE, aircraftmodel_id):
-    utils.log_active_function()
     logging.info(f"Checking if {aircraftmodel_id} is assigned to a live aircraft")
-
     try:
-        connection = sqlite3.connect(DB_FILE)
-        cursor = connection.cursor()
-        get_aircraftmodel_ids_in_aircraft = '''
-                                       SELECT aircraftmodel_id
-                                       FROM Aircraft
-                                       '''
-
-        logging.debug(get_aircraftmodel_ids_in_aircraft)
-        cursor.execute(get_aircraftmodel_ids_in_aircraft)
-
-        existing_aircraftmodel_ids_in_aircraft = cursor.fetchall()  # list of tuples here, needs converting
-        logging.debug(f"returned aircraftmodel id tuples: {existing_aircraftmodel_ids_in_aircraft}")
-        existing_aircraftmodel_ids_in_aircraft_list = [aircraftmodel[0] for aircraftmodel in existing_aircraftmodel_ids_in_aircraft]
-        logging.debug(f"list of aircraftmodel ids: {existing_aircraftmodel_ids_in_aircraft_list}")
-
-        if aircraftmodel_id in existing_aircraftmodel_ids_in_aircraft_list:
+        if check_exists(DB_FILE, "Aircraft", "aircraftmodel_id", aircraftmodel_id):
             logging.info(f"Matched aircraftmodel ID {aircraftmodel_id} to existing aircraftmodel in aircraft table")
             return True
         else:
@@ -782,19 +717,18 @@ def check_aircraftmodel_in_use(DB_FILE, aircraftmodel_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking aircraftmodel ID")
-        connection.close()
+        logging.info("Finished checking aircraftmodel ID")
 
+@utils.trace
 def check_airport_in_route(DB_FILE, airport_id,):
     # thius is more complex than usual as we need to check if the airport is in cityairport and where it is,
     # is that cityairport_id in route
     # it feels kind of clunky
 
-    utils.log_active_function()
     logging.info(f"Checking if {airport_id} is assigned to a route")
 
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
 
         #get the cityairport_ids should they exist
@@ -806,13 +740,13 @@ def check_airport_in_route(DB_FILE, airport_id,):
 
         cityairport_values = (airport_id, )
 
-        logging.debug(f"Executing query: {get_cityairport_ids} with params: {cityairport_values}")
+        logging.debug("Executing query: %s with params: %s", get_cityairport_ids, cityairport_values)
         cursor.execute(get_cityairport_ids, cityairport_values)
         # so far so normal.  now we want to use a list of cityairport_ids that match our query
         # should they exist
         # iterating over the ca ids
         cityairport_ids = [ca_id[0] for ca_id in cursor.fetchall()]
-        logging.debug(f"found these cityairport_ids {cityairport_ids}")
+        logging.debug("found these cityairport_ids %s", utils.sample_rows(cityairport_ids))
 
         # stop immediately if airport not in cityairport
         if not cityairport_ids:
@@ -827,7 +761,7 @@ def check_airport_in_route(DB_FILE, airport_id,):
                 WHERE origin_cityairport_id = ? 
                OR destination_cityairport_id = ?
             '''
-            logging.debug(f"query {get_airport_in_route}")
+            logging.debug("query %s", get_airport_in_route)
             # it feels like there must be a more efficient or at least elegant way of doing this
             cursor.execute(get_airport_in_route, (cityairport_id, cityairport_id))
 
@@ -845,23 +779,23 @@ def check_airport_in_route(DB_FILE, airport_id,):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after the ugly check for airports in a route")
-        connection.close()
+        logging.info("Connection released after the ugly check for airports in a route")
+        db_connection.release_connection(connection)
 
+@utils.trace
 def check_attribute_in_flight(DB_FILE, attribute, attribute_value):
     # I wrote the logic to check if something was assigned to a flight at the end
     # in hindsight I could have created more generalised get/add/update/delete functions like this
     # this means when I do the check for whether something is assigned to a flight (usually deletions or updates)
     # I can pass in what I want to check and the value I'm looking for dynamically instead of having millions of
     # "check_if_attribute_A in flight", "check_if_attribute_b_in_flight" and so on
-    utils.log_active_function()
     logging.info(f"Checking if {attribute} with value {attribute_value} is assigned to a flight")
 
     # converting to an int to make sure it can find the IDs I'm looking for
     # this seems a bit hacky and would need more defenseive coding that I don't have time for
     attribute_value = int(attribute_value)
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         get_flight_content = f'''
                                      SELECT {attribute}
@@ -869,13 +803,13 @@ def check_attribute_in_flight(DB_FILE, attribute, attribute_value):
                                      WHERE {attribute} = ?
                                      '''
         values = (attribute_value,)
-        logging.debug(f"{get_flight_content} with values {values}")
+        logging.debug("%s with values %s", get_flight_content, values)
         cursor.execute(get_flight_content, values)
 
         flight_contents = cursor.fetchall()  # list of tuples here, needs converting
-        logging.debug(f"returned tuples: {flight_contents} for {attribute}")
+        logging.debug("returned tuples: %s for %s", utils.sample_rows(flight_contents), attribute)
         flight_content_list = [flight_content[0] for flight_content in flight_contents]
-        logging.debug(f"list of ids: {flight_content_list}")
+        logging.debug("list of ids: %s", utils.sample_rows(flight_content_list))
 
         if attribute_value in flight_content_list:
             logging.info(f"Matched attribute {attribute} with value {attribute_value} to existing flight ")
@@ -891,14 +825,15 @@ def check_attribute_in_flight(DB_FILE, attribute, attribute_value):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking flight contents")
-        connection.close()
+        logging.info("Connection released after checking flight contents")
+        db_connection.release_connection(connection)
 
+@utils.trace
+@db_cache.cached("AircraftModel")
 def get_aircraftmodeldata_for_aircraftmodel(DB_FILE, aircraftmodel_id):
-    utils.log_active_function()
     logging.info(f"Fetching aircraftmodel data for aircraftmodel_id {aircraftmodel_id}")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         get_aircraftmodel_data = '''
                                        SELECT aircraftmodel_range, aircraftmodel_speed , aircraftmodel_name
@@ -926,15 +861,15 @@ def get_aircraftmodeldata_for_aircraftmodel(DB_FILE, aircraftmodel_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking aircraftmodel data")
-        connection.close()
+        logging.info("Connection released after checking aircraftmodel data")
+        db_connection.release_connection(connection)
 
+@utils.trace
 def get_aircraftmodelid_for_aircraft(DB_FILE, aircraft_id):
-    utils.log_active_function()
     logging.info(f"Checking aircraftmodel id for aircraftID {aircraft_id}")
 
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         get_aircraftmodelid = '''
                                        SELECT aircraftmodel_id 
@@ -950,7 +885,7 @@ def get_aircraftmodelid_for_aircraft(DB_FILE, aircraft_id):
         if fetched_aircraftmodel_id:
             fetched_aircraftmodel_id = int(fetched_aircraftmodel_id[0])
 
-        logging.debug(f"returned aircraftmodel id : {fetched_aircraftmodel_id}")
+        logging.debug("returned aircraftmodel id : %s", fetched_aircraftmodel_id)
 
         if fetched_aircraftmodel_id:
             logging.info(f"Matched aircraftmodel ID {fetched_aircraftmodel_id} to existing aircraft")
@@ -966,14 +901,15 @@ def get_aircraftmodelid_for_aircraft(DB_FILE, aircraft_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking aircraftmodel ID")
-        connection.close()
+        logging.info("Connection released after checking aircraftmodel ID")
+        db_connection.release_connection(connection)
 
+@utils.trace
+@db_cache.cached("Schedule")
 def get_departuretime_for_schedule(DB_FILE, schedule_id):
-    utils.log_active_function()
     logging.info(f"Fetching schedule for  {schedule_id}")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         get_departure_time = '''
                                           SELECT departure_time 
@@ -1000,14 +936,14 @@ def get_departuretime_for_schedule(DB_FILE, schedule_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking schedule")
-        connection.close()
+        logging.info("Connection released after checking schedule")
+        db_connection.release_connection(connection)
 
+@utils.trace
 def get_distance_for_route(DB_FILE, route_id):
-    utils.log_active_function()
     logging.info(f"Fetching distance for  {route_id}")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         get_distance = '''
                                           SELECT route_distance 
@@ -1035,14 +971,14 @@ def get_distance_for_route(DB_FILE, route_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking schedule")
-        connection.close()
+        logging.info("Connection released after checking schedule")
+        db_connection.release_connection(connection)
 
+@utils.trace
 def get_airportcodes_on_route(DB_FILE, route_id):
-    utils.log_active_function()
     logging.info(f"Fetching route data for route_id {route_id}")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         get_airportcodes_on_route = '''
            SELECT 
@@ -1080,15 +1016,15 @@ def get_airportcodes_on_route(DB_FILE, route_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking route data")
-        connection.close()
+        logging.info("Connection released after checking route data")
+        db_connection.release_connection(connection)
 
+@utils.trace
 def get_pilot_name(DB_FILE, pilot_id):
-    utils.log_active_function()
     logging.info(f"Fetching pilot name for id {pilot_id}")
     pilot_id = int(pilot_id)
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         get_pilot_name = '''
            SELECT 
@@ -1117,15 +1053,15 @@ def get_pilot_name(DB_FILE, pilot_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking name")
-        connection.close()
+        logging.info("Connection released after checking name")
+        db_connection.release_connection(connection)
 
+@utils.trace
 def get_aircraft_name(DB_FILE, aircraft_id):
-    utils.log_active_function()
     logging.info(f"Fetching aircraft name for id {aircraft_id}")
     aircraft_id = int(aircraft_id)
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         get_aircraft_name = '''
            SELECT 
@@ -1154,15 +1090,15 @@ def get_aircraft_name(DB_FILE, aircraft_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking name")
-        connection.close()
+        logging.info("Connection released after checking name")
+        db_connection.release_connection(connection)
 
+@utils.trace
 def check_existing_route(DB_FILE, origin_airport_id, dest_airport_id):
-    utils.log_active_function()
     logging.info(f"origin_airport_id {origin_airport_id}, dest_airport_id {dest_airport_id}")
 
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         check_route_exists = '''
                 SELECT r.route_id
@@ -1192,14 +1128,14 @@ def check_existing_route(DB_FILE, origin_airport_id, dest_airport_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking route")
-        connection.close()
+        logging.info("Connection released after checking route")
+        db_connection.release_connection(connection)
 
+@utils.trace
 def get_cityairport_for_airport(DB_FILE, airport_id):
-    utils.log_active_function()
     logging.info(f"Fetching data for  {airport_id}")
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         get_cityairport_id_for_airport = '''
               SELECT 
@@ -1230,5 +1166,101 @@ def get_cityairport_for_airport(DB_FILE, airport_id):
         logging.error(f"Unknown error {exc}")
         return False
     finally:
-        logging.info("Connection closed after checking airport_id")
-        connection.close()
\ No newline at end of file
+        logging.info("Connection released after checking airport_id")
+        db_connection.release_connection(connection)
+# Adding a flight used to make around twenty separate calls (aircraft model, model data twice, aircraft name,
+# route distance three times, airport codes, pilot name, departure time plus the check_valid_* calls)
+# get_flight_build_context answers all of them for a candidate aircraft/route/pilot/schedule in one query.
+# Any id that doesn't exist comes back with *_exists False and its other fields as None.
+# Once everything needed to time the flight is known it also gets arrival_time, and aircraft_conflicts/pilot_conflicts -
+# the flight_ids the aircraft or pilot is already flying at that time (see flight_conflicts.py), empty if it fits.
+FLIGHT_BUILD_CONTEXT_FIELDS = (
+    "aircraft_exists", "aircraft_name", "aircraftmodel_id", "aircraftmodel_name", "aircraftmodel_range",
+    "aircraftmodel_speed",
+    "route_exists", "route_distance", "origin_airport_code", "destination_airport_code",
+    "pilot_exists", "pilot_name",
+    "schedule_exists", "departure_time",
+)
+
+# aircraft range must be at least 110% of the route distance
+RANGE_MARGIN = 1.1
+
+@utils.trace
+def get_flight_build_context(DB_FILE, aircraft_id, route_id, pilot_id, schedule_id):
+    logging.info(f"Fetching flight build context for aircraft {aircraft_id}, route {route_id}, pilot {pilot_id}, schedule {schedule_id}")
+    try:
+        connection = db_connection.get_connection(DB_FILE)
+        cursor = connection.cursor()
+        get_build_context = '''
+           WITH candidate (aircraft_id, route_id, pilot_id, schedule_id) AS (VALUES (?, ?, ?, ?))
+           SELECT
+           a.aircraft_id IS NOT NULL,
+           a.aircraft_name,
+           am.aircraftmodel_id,
+           am.aircraftmodel_name,
+           am.aircraftmodel_range,
+           am.aircraftmodel_speed,
+           r.route_id IS NOT NULL,
+           r.route_distance,
+           ao.airport_code,
+           ad.airport_code,
+           p.pilot_id IS NOT NULL,
+           p.pilot_name,
+           s.schedule_id IS NOT NULL,
+           s.departure_time
+
+           FROM candidate c
+
+           LEFT JOIN Aircraft a on a.aircraft_id = c.aircraft_id
+           LEFT JOIN AircraftModel am on am.aircraftmodel_id = a.aircraftmodel_id
+
+           LEFT JOIN Route r on r.route_id = c.route_id
+           LEFT JOIN CityAirport cao on r.origin_cityairport_id = cao.cityairport_id
+           LEFT JOIN Airport ao on cao.airport_id = ao.airport_id
+           LEFT JOIN CityAirport cad on r.destination_cityairport_id = cad.cityairport_id
+           LEFT JOIN Airport ad on cad.airport_id = ad.airport_id
+
+           LEFT JOIN Pilot p on p.pilot_id = c.pilot_id
+           LEFT JOIN Schedule s on s.schedule_id = c.schedule_id
+           '''
+        # every join is a LEFT JOIN from the one-row candidate so we always get exactly one row back,
+        # even when some of the ids are wrong - that's what lets us report on all four in one go
+
+        values = (aircraft_id, route_id, pilot_id, schedule_id)
+        logging.debug(get_build_context)
+        cursor.execute(get_build_context, values)
+
+        build_context = dict(zip(FLIGHT_BUILD_CONTEXT_FIELDS, cursor.fetchone()))
+        for field in ("aircraft_exists", "route_exists", "pilot_exists", "schedule_exists"):
+            build_context[field] = bool(build_context[field])
+
+        if build_context["aircraftmodel_range"] is not None and build_context["route_distance"] is not None:
+            build_context["range_ok"] = build_context["aircraftmodel_range"] >= RANGE_MARGIN * build_context["route_distance"]
+        else:
+            build_context["range_ok"] = False
+
+        build_context["arrival_time"] = None
+        build_context["aircraft_conflicts"] = []
+        build_context["pilot_conflicts"] = []
+        aircraftmodel_speed = build_context["aircraftmodel_speed"]
+        if (build_context["route_distance"] is not None and aircraftmodel_speed and aircraftmodel_speed > 0
+                and build_context["pilot_exists"] and build_context["schedule_exists"]):
+            build_context["arrival_time"] = flight_times.calculate_arrival_times(
+                [build_context["route_distance"]], [aircraftmodel_speed], [build_context["departure_time"]])[0]
+            # only this aircraft's and this pilot's flights are needed, the Flight indexes find them directly
+            conflict_index = flight_conflicts.load_conflict_index(cursor, "f.aircraft_id = ? OR f.pilot_id = ?", (aircraft_id, pilot_id))
+            build_context["aircraft_conflicts"], build_context["pilot_conflicts"] = conflict_index.find_conflicts(
+                aircraft_id, pilot_id, build_context["departure_time"], build_context["arrival_time"])
+
+        logging.debug("Flight build context %s", build_context)
+        return build_context
+
+    except sqlite3.DatabaseError as dbe:
+        logging.error(f"Database error {dbe}")
+        return False
+    except Exception as exc:
+        logging.error(f"Unknown error {exc}")
+        return False
+    finally:
+        logging.info("Connection released after fetching flight build context")
+        db_connection.release_connection(connection)
\ No newline at end of file
@@ -1,22 +1,221 @@
 import sqlite3
 import json # needed to read seeding data
 import os
+import time
 import logging
 import utils
+import db_connection
 
 logger = logging.getLogger(__name__)
 logger.info("Started logging in db_initialisation.py")
 
 # Initially this was core to bambi.py I refactored and placed in its' own script when bambi.py became too large
 
-def init(DB_FILE):
+# SQLite doesn't index foreign key columns for us, so without these every join in get_flights and every
+# "is this X used by a flight/route" check was a table scan
+# name: (table, columns) - names are prefixed idx_ so they are easy to pick out of sqlite_master
+INDEXES = {
+    "idx_flight_aircraft_id": ("Flight", ("aircraft_id",)),
+    "idx_flight_pilot_id": ("Flight", ("pilot_id",)),
+    "idx_flight_route_id": ("Flight", ("route_id",)),
+    "idx_flight_schedule_id": ("Flight", ("schedule_id",)),
+    "idx_cityairport_airport_id": ("CityAirport", ("airport_id",)),
+    "idx_cityairport_city_id": ("CityAirport", ("city_id",)),
+    "idx_route_origin_cityairport_id": ("Route", ("origin_cityairport_id",)),
+    "idx_route_destination_cityairport_id": ("Route", ("destination_cityairport_id",)),
+    "idx_airport_airport_code": ("Airport", ("airport_code",)),
+    "idx_aircraft_aircraftmodel_id": ("Aircraft", ("aircraftmodel_id",)),
+}
+
+def create_indexes(cursor):
+    # IF NOT EXISTS means this is safe to run against new and existing databases alike
+    for index_name, (table, columns) in INDEXES.items():
+        create_index = f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(columns)})"
+        logger.debug(create_index)
+        cursor.execute(create_index)
+    logger.info(f"Checked/created {len(INDEXES)} indexes")
+
+def get_missing_indexes(DB_FILE):
+    # reports which of INDEXES are not present in the database file
+    connection = sqlite3.connect(DB_FILE)
+    try:
+        existing_indexes = {row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    finally:
+        connection.close()
+    return [index_name for index_name in INDEXES if index_name not in existing_indexes]
+
+def apply_missing_indexes(DB_FILE):
+    # back-fills indexes onto a database created before they were introduced
+    missing_indexes = get_missing_indexes(DB_FILE)
+    if not missing_indexes:
+        logger.info("All indexes present")
+        return missing_indexes
+
+    logger.warning(f"Missing indexes found, creating: {', '.join(missing_indexes)}")
+    connection = sqlite3.connect(DB_FILE)
+    try:
+        create_indexes(connection.cursor())
+        connection.commit()
+    finally:
+        connection.close()
+    return missing_indexes
+
+# Seeding used to json.load the whole file and then execute one INSERT per row, logging every row as it went.
+# That was fine for the 80 odd rows in seed_data.json but far too slow and memory hungry for the millions of rows
+# we use to bootstrap test/staging databases, so now:
+#   - iter_seed_data streams the file, yielding one record at a time without loading the whole document
+#   - seed_database inserts in batches with executemany, one transaction per table, and logs rows/sec per table
+# A missing or malformed seed file leaves empty tables, as it always did; any other loading error deletes the file.
+
+# seed file key: (table, columns) - the columns are read from each json record in this order
+SEED_TABLES = {
+    "cities": ("City", ("city_id", "city_name")),
+    "airports": ("Airport", ("airport_id", "airport_name", "airport_code")),
+    "cityairports": ("CityAirport", ("cityairport_id", "city_id", "airport_id")),
+    "aircraft": ("Aircraft", ("aircraft_id", "aircraft_name", "aircraftmodel_id")),
+    "aircraftmodels": ("AircraftModel", ("aircraftmodel_id", "aircraftmodel_name", "aircraftmodel_range", "aircraftmodel_speed")),
+    "pilots": ("Pilot", ("pilot_id", "pilot_name")),
+    "schedules": ("Schedule", ("schedule_id", "departure_time")),
+    "routes": ("Route", ("route_id", "origin_cityairport_id", "destination_cityairport_id", "route_distance")),
+    "flights": ("Flight", ("flight_id", "flight_number", "pilot_id", "route_id", "aircraft_id", "schedule_id", "arrival_time")),
+}
+
+SEED_BATCH_SIZE = 5000
+SEED_READ_SIZE = 65536
+
+def iter_seed_data(file):
+    # yields (entity, record) for a file shaped like {"entity": [{record}, {record}], "entity2": [...]}
+    # there's no streaming parser in the standard library, but JSONDecoder.raw_decode can pull one value
+    # off the front of a string, so we keep a small buffer and top it up from the file whenever it runs dry
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    end_of_file = False
+
+    def next_char():
+        # skips whitespace and returns the next character without consuming it, reading more if needed
+        nonlocal buffer, position, end_of_file
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if end_of_file:
+                raise json.JSONDecodeError("Unexpected end of seed data", buffer, position)
+            buffer = file.read(SEED_READ_SIZE)
+            position = 0
+            end_of_file = not buffer
+
+    def expect(character):
+        nonlocal position
+        if next_char() != character:
+            raise json.JSONDecodeError(f"Expected {character!r}", buffer, position)
+        position += 1
+
+    def next_value():
+        # decodes one complete value, reading more of the file if the buffer ends part way through it
+        nonlocal buffer, position, end_of_file
+        next_char()
+        while True:
+            try:
+                value, value_end = decoder.raw_decode(buffer, position)
+                # a value that runs right to the end of the buffer might be cut short (e.g. a number)
+                if value_end < len(buffer) or end_of_file:
+                    position = value_end
+                    return value
+            except json.JSONDecodeError:
+                if end_of_file:
+                    raise
+            more = file.read(SEED_READ_SIZE)
+            end_of_file = not more
+            buffer = buffer[position:] + more
+            position = 0
+
+    expect("{")
+    if next_char() == "}":
+        return
+    while True:
+        entity = next_value()
+        expect(":")
+        expect("[")
+        if next_char() == "]":
+            position += 1
+        else:
+            while True:
+                yield entity, next_value()
+                if next_char() == ",":
+                    position += 1
+                    continue
+                expect("]")
+                break
+        if next_char() == ",":
+            position += 1
+            continue
+        expect("}")
+        return
+
+def seed_database(connection, SEED_DATA_FILE, batch_size=SEED_BATCH_SIZE):
+    # loads the seed file into the (already created) tables, returns the total number of rows inserted
+    # raises FileNotFoundError if there is no seed file, anything else is a genuine loading error
+    total_row_count = 0
+
+    with open(SEED_DATA_FILE, "r") as file:
+        logger.info(f"Streaming seed data from {SEED_DATA_FILE}")
+        print("Found data seed file - loading data...")
+
+        current_entity = None
+        batch = []
+        table_row_count = 0
+        table_started = 0
+
+        def flush(entity):
+            table, columns = SEED_TABLES[entity]
+            insert_rows = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+            connection.executemany(insert_rows, batch)
+            batch.clear()
+
+        def finish_table(entity):
+            # one transaction per table, so a big table costs one commit rather than one per row
+            flush(entity)
+            connection.commit()
+            elapsed = time.perf_counter() - table_started
+            rows_per_second = table_row_count / elapsed if elapsed > 0 else float("inf")
+            logger.info(f"Seeded {table_row_count} rows into {SEED_TABLES[entity][0]} in {elapsed:.3f}s ({rows_per_second:,.0f} rows/sec)")
+
+        for entity, record in iter_seed_data(file):
+            if entity not in SEED_TABLES:
+                raise ValueError(f"Unknown seed data section {entity}")
+            if entity != current_entity:
+                if current_entity is not None:
+                    finish_table(current_entity)
+                current_entity = entity
+                table_row_count = 0
+                table_started = time.perf_counter()
+
+            batch.append(tuple(record[column] for column in SEED_TABLES[entity][1]))
+            table_row_count += 1
+            total_row_count += 1
+            if len(batch) >= batch_size:
+                flush(entity)
+
+        if current_entity is not None:
+            finish_table(current_entity)
+
+    return total_row_count
+
+def init(DB_FILE, DB_PROFILE=db_connection.DEFAULT_PROFILE, SEED_DATA_FILE="seed_data.json"):
     # setup the connection and establish if existing db file exists or not
+    # DB_PROFILE picks the set of PRAGMAs (journal mode, sync level, timeouts, cache) from db_connection.PRAGMA_PROFILES
 
+    db_connection.set_profile(DB_PROFILE)
     DB_CHECK = os.path.exists(DB_FILE)
+    if not DB_CHECK:
+        # switching to WAL before the tables exist means the whole seeding run happens in WAL mode too
+        sqlite3.connect(DB_FILE).close()
+        db_connection.configure_database(DB_FILE)
     connection = sqlite3.connect(DB_FILE)
     cursor = connection.cursor()
 
-    SEED_DATA_FILE = "seed_data.json"
 
     if not DB_CHECK:
         print("No existing database found - creating from baseline data")
@@ -36,7 +235,7 @@ def init(DB_FILE):
             ) 
         '''
         logger.info("Creating Aircraft table")
-        logger.debug(f"{create_aircraft}")
+        logger.debug(create_aircraft)
         cursor.execute(create_aircraft)
 
         create_aircraftmodel = '''
@@ -48,7 +247,7 @@ def init(DB_FILE):
             )
         '''
         logger.info("Creating AircraftModel table")
-        logger.debug(f"{create_aircraftmodel}")
+        logger.debug(create_aircraftmodel)
         cursor.execute(create_aircraftmodel)
 
         create_pilot = '''
@@ -58,7 +257,7 @@ def init(DB_FILE):
             )
         '''
         logger.info("Creating Pilot table")
-        logger.debug(f"{create_pilot}")
+        logger.debug(create_pilot)
         cursor.execute(create_pilot)
 
         create_schedule = '''
@@ -68,7 +267,7 @@ def init(DB_FILE):
             )
         '''
         logger.info("Creating Schedule table")
-        logger.debug(f"{create_schedule}")
+        logger.debug(create_schedule)
         cursor.execute(create_schedule)
 
     # I learned that SQLLite does not seem to have native functions for handling "Monday 09:00" as a schedule would be
@@ -82,7 +281,7 @@ def init(DB_FILE):
             )
         '''
         logger.info("Creating City table")
-        logger.debug(f"{create_city}")
+        logger.debug(create_city)
         cursor.execute(create_city)
 
         create_airport = '''
@@ -93,7 +292,7 @@ def init(DB_FILE):
             )
         '''
         logger.info("Create Airport table")
-        logger.debug(f"{create_airport}")
+        logger.debug(create_airport)
         cursor.execute(create_airport)
 
         create_cityairport = '''
@@ -106,7 +305,7 @@ def init(DB_FILE):
             )
         '''
         logger.info("Create CityAirport table")
-        logger.debug(f"{create_cityairport}")
+        logger.debug(create_cityairport)
         cursor.execute(create_cityairport)
 
         create_route = '''
@@ -120,7 +319,7 @@ def init(DB_FILE):
             )
         '''
         logger.info("Create Route table")
-        logger.debug(f"{create_route}")
+        logger.debug(create_route)
         cursor.execute(create_route)
 
         create_flight = '''
@@ -139,7 +338,7 @@ def init(DB_FILE):
             )
         '''
         logger.info("Creating Flight table")
-        logger.debug(f"{create_flight}")
+        logger.debug(create_flight)
         cursor.execute(create_flight)
 
         print("Database tables created successfully, starting data seeding")
@@ -158,138 +357,45 @@ def init(DB_FILE):
         #               SELECT CAST(CEIL(CAST(Route.distance AS REAL) / Aircraftmodel.aircraftmodel_speed) AS INTEGER)
         # '''
 
-        try:
-            with open(SEED_DATA_FILE,"r") as file:
-                seed_data = json.load(file)
-
-            logger.info("Successfully loaded seed data file")
-            print("Found data seed file - loading data...")
-        except FileNotFoundError:
-            logger.error("Seed data FILE NOT FOUND!")
-            seed_data = {}
-        except json.JSONDecodeError as jde:
-            logger.error(f"Unknown json error: {jde}")
-            seed_data = {}
-        except Exception as ex:
-            logger.exception(f"Unknown error loading seed data file: {ex}")
-            seed_data = {}
-
-
         # Database tables should be created
-        # JSON file should be found
         # Time to create some sample data
-
-        #cities
+        # seed_database streams the file a record at a time so large seed files don't need to fit in memory
         try:
-            for city in seed_data.get("cities", []):
-                insert_city = '''
-                    INSERT INTO City (city_id, city_name)
-                    VALUES (?, ?)
-                '''
-                values = (city['city_id'], city['city_name'])
-
-                logger.info("Inserting city data")
-                logger.debug(f"Executing SQL: {insert_city.strip()} | Values: {values}")
-                cursor.execute(insert_city, values)
-
-            for airport in seed_data.get("airports", []):
-                insert_airport = '''
-                    INSERT INTO Airport (airport_id, airport_name, airport_code)
-                    VALUES (?, ?, ?)
-                '''
-                values = (airport['airport_id'], airport['airport_name'], airport['airport_code'])
-
-                logger.info("Inserting airport data")
-                logger.debug(f"Executing SQL: {insert_airport.strip()} | Values: {values}")
-                cursor.execute(insert_airport, values)
-
-            for cityairport in seed_data.get("cityairports", []):
-                insert_cityairport = '''
-                           INSERT INTO CityAirport (cityairport_id, city_id, airport_id)
-                           VALUES (?, ?, ?)
-                       '''
-                values = (cityairport['cityairport_id'], cityairport['city_id'], cityairport['airport_id'])
-
-                logger.info("Inserting cityairport data")
-                logger.debug(f"Executing SQL: {insert_cityairport.strip()} | Values: {values}")
-                cursor.execute(insert_cityairport, values)
-
-            for aircraft in seed_data.get("aircraft", []):
-                insert_aircraft = '''
-                                     INSERT INTO Aircraft (aircraft_id, aircraft_name, aircraftmodel_id)
-                                     VALUES (?, ?, ?)
-                                 '''
-                values = (aircraft['aircraft_id'], aircraft['aircraft_name'], aircraft['aircraftmodel_id'])
-
-                logger.info("Inserting aircraft data")
-                logger.debug(f"Executing SQL: {insert_aircraft.strip()} | Values: {values}")
-                cursor.execute(insert_aircraft, values)
-
-            for aircraftmodel in seed_data.get("aircraftmodels", []):
-                insert_aircraftmodels = '''
-                                             INSERT INTO AircraftModel (aircraftmodel_id, aircraftmodel_name, aircraftmodel_range, aircraftmodel_speed)
-                                             VALUES (?, ?, ?, ?)
-                                         '''
-                values = (aircraftmodel['aircraftmodel_id'], aircraftmodel['aircraftmodel_name'],
-                          aircraftmodel['aircraftmodel_range'], aircraftmodel['aircraftmodel_speed'])
-
-                logger.info("Inserting aircraftmodel data")
-                logger.debug(f"Executing SQL: {insert_aircraftmodels.strip()} | Values: {values}")
-                cursor.execute(insert_aircraftmodels, values)
-
-            for pilot in seed_data.get("pilots", []):
-                insert_pilot = '''
-                                           INSERT INTO Pilot (pilot_id, pilot_name)
-                                           VALUES (?, ?)
-                                       '''
-                values = (pilot['pilot_id'], pilot['pilot_name'])
-
-                logger.info("Inserting pilot data")
-                logger.debug(f"Executing SQL: {insert_pilot.strip()} | Values: {values}")
-                cursor.execute(insert_pilot, values)
-
-            for schedule in seed_data.get("schedules", []):
-                insert_schedule = '''
-                                         INSERT INTO Schedule (schedule_id, departure_time)
-                                         VALUES (?, ?)
-                                     '''
-                values = (schedule['schedule_id'], schedule['departure_time'])
-
-                logger.info("Inserting schedule data")
-                logger.debug(f"Executing SQL: {insert_schedule.strip()} | Values: {values}")
-                cursor.execute(insert_schedule, values)
-
-            for route in seed_data.get("routes", []):
-                insert_route = '''
-                                         INSERT INTO Route (route_id, origin_cityairport_id, destination_cityairport_id, route_distance)
-                                         VALUES (?, ?, ?, ?)
-                                     '''
-                values = (route['route_id'], route['origin_cityairport_id'], route['destination_cityairport_id'], route['route_distance'])
-
-                logger.info("Inserting route data")
-                logger.debug(f"Executing SQL: {insert_route.strip()} | Values: {values}")
-                cursor.execute(insert_route, values)
-
-            for flight in seed_data.get("flights", []):
-                insert_flight = '''
-                                                INSERT INTO Flight (flight_id, flight_number, pilot_id, route_id, aircraft_id, schedule_id, arrival_time)
-                                                VALUES (?, ?, ?, ?, ?, ?, ?)
-                                            '''
-                values = (flight['flight_id'], flight['flight_number'], flight['pilot_id'], flight['route_id'], flight['aircraft_id'], flight['schedule_id'], flight['arrival_time'])
-
-                logger.info("Inserting flight data")
-                logger.debug(f"Executing SQL: {insert_flight.strip()} | Values: {values}")
-                cursor.execute(insert_flight, values)
+            seeded_row_count = seed_database(connection, SEED_DATA_FILE)
+
+            # indexes are built after the data goes in, it's quicker than maintaining them row by row
+            create_indexes(cursor)
+
+            connection.commit()
+            connection.close()
+            print(f"Database seeded successfully - {seeded_row_count} rows loaded")
 
+        except FileNotFoundError:
+            # same as before - carry on with empty tables if there is no seed file
+            logger.error("Seed data FILE NOT FOUND!")
+            create_indexes(cursor)
             connection.commit()
             connection.close()
-            print("Database seeded successfully")
 
+        except json.JSONDecodeError as jde:
+            # also the same as before - a malformed seed file still gets you a database with empty tables, but the
+            # tables loaded before the bad part of the file have already been committed so they're emptied again
+            print("Seed data file is not valid json - starting with empty tables, please check the log file")
+            logger.error(f"Seed data file {SEED_DATA_FILE} is not valid json, created empty tables instead: {jde}")
+            connection.rollback()
+            for table, _ in reversed(list(SEED_TABLES.values())):
+                cursor.execute(f"DELETE FROM {table}")
+            create_indexes(cursor)
+            connection.commit()
+            connection.close()
 
         except Exception as ex:
-            print(f"Error loading data, please check log: {LOGFILE_NAME}")
+            print("Error loading data, please check the log file")
             logger.exception(f"Error inserting data: {ex}")
             connection.rollback()
+            connection.close()
+            # any long-lived connections to the half-built file need closing before we can delete it
+            db_connection.close_all(DB_FILE)
             os.remove(DB_FILE)
             print("Deleted db file for fresh start")
             logger.info(f"Deleted {DB_FILE} on terminal exception")
@@ -299,4 +405,11 @@ def init(DB_FILE):
 
     else:
         print("Existing DB found, skipping creation step")
-        logger.info("Existing DB found, skipping creation step")
\ No newline at end of file
+        logger.info("Existing DB found, skipping creation step")
+        connection.close()
+        # databases created before WAL was introduced are still on the rollback journal, so check on every startup
+        journal_mode = db_connection.configure_database(DB_FILE)
+        logger.info(f"Existing DB using {journal_mode} journal mode with {DB_PROFILE} profile")
+        missing_indexes = apply_missing_indexes(DB_FILE)
+        if missing_indexes:
+            print(f"Added {len(missing_indexes)} missing indexes to existing database")
\ No newline at end of file
@@ -0,0 +1,130 @@
+import sqlite3
+import logging
+import time
+import sys
+import db_connection
+import db_initialisation
+import flight_board
+import great_circle
+import change_tracking
+import change_feed
+
+# db_initialisation only builds the schema when bambi.db doesn't exist yet, so before this script the only way to get
+# a schema change (new index, table, column) onto a live database was to delete it and lose the data.
+# Each migration below is an ordered, numbered step. The number of the last step applied is stored in the
+# database itself using PRAGMA user_version (a spare integer SQLite keeps in the file header, 0 on a new file),
+# so on startup we only run the steps that database hasn't had yet.
+#
+# Rules for adding a migration -
+#   - append it to MIGRATIONS with the next version number, never renumber or edit one that has shipped
+#   - it must also work on a freshly seeded database, as new databases run every migration after seeding
+#   - it gets a cursor inside a transaction, don't commit from inside it
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in db_migrations.py")
+
+
+def migration_add_indexes(cursor):
+    db_initialisation.create_indexes(cursor)
+
+def migration_analyze(cursor):
+    # gives the query planner row counts for the new indexes so it actually picks them for the flight joins
+    cursor.execute("ANALYZE")
+
+def migration_flight_board(cursor):
+    # see flight_board.py - the table, the triggers that keep it in step, and its first fill from the live join
+    flight_board.create_flight_board(cursor)
+
+def migration_airport_coordinates(cursor):
+    # see great_circle.py - coordinates for working out route distances, filled in for the airports we seed
+    cursor.execute("ALTER TABLE Airport ADD COLUMN latitude REAL")
+    cursor.execute("ALTER TABLE Airport ADD COLUMN longitude REAL")
+    cursor.executemany("UPDATE Airport SET latitude = ?, longitude = ? WHERE airport_code = ?",
+                       [(latitude, longitude, airport_code)
+                        for airport_code, (latitude, longitude) in great_circle.BASELINE_AIRPORT_COORDINATES.items()])
+
+def migration_change_tracking(cursor):
+    # see change_tracking.py - per-table change counters for the web app's ETags and response cache
+    change_tracking.create_change_tracking(cursor)
+
+def migration_change_feed(cursor):
+    # see change_feed.py - the sequenced log of flight additions, deletions and arrival time changes
+    change_feed.create_change_feed(cursor)
+
+
+# (version, description, step)
+MIGRATIONS = [
+    (1, "Add foreign-key and lookup indexes", migration_add_indexes),
+    (2, "Gather query planner statistics", migration_analyze),
+    (3, "Add materialised flight board", migration_flight_board),
+    (4, "Add airport coordinates", migration_airport_coordinates),
+    (5, "Add per-table change counters", migration_change_tracking),
+    (6, "Add flight change feed", migration_change_feed),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(DB_FILE):
+    connection = sqlite3.connect(DB_FILE)
+    try:
+        return connection.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        connection.close()
+
+def get_pending_migrations(DB_FILE):
+    current_version = get_schema_version(DB_FILE)
+    return [migration for migration in MIGRATIONS if migration[0] > current_version]
+
+def migrate(DB_FILE, dry_run=False):
+    # applies every pending migration in order, each in its own transaction along with the user_version bump
+    # so a failure leaves the database at the last step that worked rather than half way through one
+    # dry_run still runs each step (so the timings are real) but rolls it back afterwards
+    # returns a list of (version, description, seconds) for the steps that ran
+    pending_migrations = get_pending_migrations(DB_FILE)
+    if not pending_migrations:
+        logger.info(f"{DB_FILE} schema is up to date at version {LATEST_VERSION}")
+        return []
+
+    mode = "Dry run of" if dry_run else "Applying"
+    logger.info(f"{mode} {len(pending_migrations)} migration(s) on {DB_FILE}")
+
+    # isolation_level None turns off the sqlite3 module's own transaction handling - it doesn't BEGIN before
+    # DDL statements like CREATE INDEX, so we manage the transactions ourselves
+    connection = sqlite3.connect(DB_FILE, isolation_level=None)
+    completed_migrations = []
+    try:
+        for version, description, step in pending_migrations:
+            started = time.perf_counter()
+            cursor = connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                step(cursor)
+                cursor.execute(f"PRAGMA user_version = {int(version)}")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                logger.exception(f"Migration {version} ({description}) failed - rolled back")
+                raise
+
+            cursor.execute("ROLLBACK" if dry_run else "COMMIT")
+            elapsed = time.perf_counter() - started
+            completed_migrations.append((version, description, elapsed))
+            logger.info(f"{mode} migration {version} ({description}) took {elapsed:.3f}s")
+    finally:
+        connection.close()
+
+    if not dry_run:
+        # long-lived connections may have cached the old schema, close them so the next query sees the new one
+        db_connection.close_all(DB_FILE)
+    return completed_migrations
+
+
+if __name__ == "__main__":
+    # python db_migrations.py [database file] [--dry-run]
+    arguments = [argument for argument in sys.argv[1:] if argument != "--dry-run"]
+    dry_run = "--dry-run" in sys.argv[1:]
+    DB_FILE = arguments[0] if arguments else "bambi.db"
+
+    print(f"{DB_FILE} is at schema version {get_schema_version(DB_FILE)}, latest is {LATEST_VERSION}")
+    for version, description, elapsed in migrate(DB_FILE, dry_run=dry_run):
+        print(f"{'Would apply' if dry_run else 'Applied'} migration {version} - {description} ({elapsed:.3f}s)")
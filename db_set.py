@@ -1,6 +1,13 @@
 import os
 import time
 import utils
+import db_connection
+import db_cache
+import flight_times
+import flight_conflicts
+import route_graph
+import route_feasibility
+import change_feed
 import logging
 import sqlite3
 
@@ -14,11 +21,22 @@ import sqlite3
 logger = logging.getLogger(__name__)
 logger.info("Started logging in db_set.py")
 
+# The in-memory route graph and feasibility index, and the change feed's waiting readers, are told about a write once
+# it has committed. By then the write has happened whatever they do, so a failure here is logged and the indexes are
+# thrown away to be rebuilt on next use rather than the write being reported as failed.
+def after_commit(DB_FILE, update, *args):
+    try:
+        update(DB_FILE, *args)
+    except Exception as exc:
+        logger.error(f"Error in {update.__module__}.{update.__name__} after commit, indexes will be rebuilt - {exc}")
+        route_graph.invalidate(DB_FILE)
+        route_feasibility.invalidate(DB_FILE)
 
+
+@utils.trace
 def add_pilot(DB_FILE, new_pilot_name):
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         insert_new_pilot = '''
                 INSERT INTO Pilot (pilot_name)
@@ -33,7 +51,7 @@ def add_pilot(DB_FILE, new_pilot_name):
         # Answered Martijn Peters May 31 2013, checked April 5th
         # Adding , after the value makes it a tuple not a list of characters
 
-        logging.debug(f"{insert_new_pilot}")
+        logging.debug(insert_new_pilot)
         cursor.execute(insert_new_pilot, values)
         connection.commit()
         logging.info(f"New pilot inserted {new_pilot_name}")
@@ -43,11 +61,11 @@ def add_pilot(DB_FILE, new_pilot_name):
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
+@utils.trace
 def update_pilot(DB_FILE, updated_pilot_name, pilot_id):
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         update_pilot = '''
                 UPDATE Pilot
@@ -56,7 +74,7 @@ def update_pilot(DB_FILE, updated_pilot_name, pilot_id):
             '''
         values = (updated_pilot_name,pilot_id)
 
-        logging.debug(f"{update_pilot}")
+        logging.debug(update_pilot)
         cursor.execute(update_pilot, values)
         connection.commit()
         logging.info(f"Pilot {pilot_id} updated, new name {updated_pilot_name}")
@@ -66,13 +84,13 @@ def update_pilot(DB_FILE, updated_pilot_name, pilot_id):
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
-        logging.info("Connection closed for pilot update")
+        db_connection.release_connection(connection)
+        logging.info("Connection released for pilot update")
+@utils.trace
 def delete_pilot(DB_FILE, pilot_id):
 
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         delete_pilot = '''
                       DELETE FROM Pilot 
@@ -80,7 +98,7 @@ def delete_pilot(DB_FILE, pilot_id):
                   '''
         values = (pilot_id,)
 
-        logging.debug(f"{delete_pilot}")
+        logging.debug(delete_pilot)
         cursor.execute(delete_pilot, values)
         connection.commit()
         logging.info(f"pilot deleted {pilot_id}")
@@ -90,11 +108,12 @@ def delete_pilot(DB_FILE, pilot_id):
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
+@utils.trace
+@db_cache.invalidates("Airport", "CityAirport")
 def add_airport(DB_FILE, airport_name, airport_code, city_id):
-    utils.log_active_function()
     logging.info(f"Attempting to add new airport {airport_name} with code {airport_code} to city {city_id}")
-    connection = sqlite3.connect(DB_FILE)
+    connection = db_connection.get_connection(DB_FILE)
     cursor = connection.cursor()
 
     try:
@@ -128,13 +147,14 @@ def add_airport(DB_FILE, airport_name, airport_code, city_id):
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
 
     # validation of code and city are done outside this step, we can just insert now
+@utils.trace
+@db_cache.invalidates("Airport")
 def update_airport(DB_FILE, airport_id, new_airport_name, new_airport_code):
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         update_airport = '''
                     UPDATE Airport
@@ -143,7 +163,7 @@ def update_airport(DB_FILE, airport_id, new_airport_name, new_airport_code):
                 '''
         values = (new_airport_name, new_airport_code, airport_id)
 
-        logging.debug(f"{update_city}")
+        logging.debug(update_airport)
         cursor.execute(update_airport, values)
         connection.commit()
         logging.info(f"Airport {airport_id} updated, new name {new_airport_name}, new code {new_airport_code}")
@@ -155,12 +175,13 @@ def update_airport(DB_FILE, airport_id, new_airport_name, new_airport_code):
         logger.error(f"Unknown error {exc}")
         return False
     finally:
-        connection.close()
-        logging.info("Connection closed for city update")
+        db_connection.release_connection(connection)
+        logging.info("Connection released for city update")
+@utils.trace
+@db_cache.invalidates("CityAirport")
 def remap_airport(DB_FILE, airport_id, new_city_id):
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         update_cityairport = '''
                         UPDATE CityAirport
@@ -169,8 +190,8 @@ def remap_airport(DB_FILE, airport_id, new_city_id):
                     '''
         values = (new_city_id, airport_id)
 
-        logging.debug(f"{update_cityairport}")
-        logging.debug(f"{values}")
+        logging.debug(update_cityairport)
+        logging.debug("%s", values)
         cursor.execute(update_cityairport, values)
         connection.commit()
         logging.info(f"Airport {airport_id} updated, new city is {new_city_id}")
@@ -182,12 +203,13 @@ def remap_airport(DB_FILE, airport_id, new_city_id):
         logger.error(f"Unknown error {exc}")
         return False
     finally:
-        connection.close()
-        logging.info("Connection closed for airport mapping update")
+        db_connection.release_connection(connection)
+        logging.info("Connection released for airport mapping update")
+@utils.trace
+@db_cache.invalidates("Airport", "CityAirport")
 def delete_airport(DB_FILE, airport_id):
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
 
 
@@ -203,7 +225,7 @@ def delete_airport(DB_FILE, airport_id):
                                '''
         airportvalues = (airport_id,)
 
-        logging.debug(f"{delete_cityairport}")
+        logging.debug(delete_cityairport)
         cursor.execute(delete_cityairport, city_airportvalues)
         cursor.execute(delete_airport, airportvalues)
         connection.commit()
@@ -214,14 +236,15 @@ def delete_airport(DB_FILE, airport_id):
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
+@utils.trace
+@db_cache.invalidates("City")
 def add_city(DB_FILE, city_name):
-    utils.log_active_function()
     logging.info(f"Attempting to add new city  {city_name}")
 
     # checks to avoid duplicate cities are done before this stage so we can simply insert
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         insert_new_city = '''
                 INSERT INTO City (city_name)
@@ -229,7 +252,7 @@ def add_city(DB_FILE, city_name):
             '''
         values = (city_name,)
 
-        logging.debug(f"{insert_new_city}")
+        logging.debug(insert_new_city)
         cursor.execute(insert_new_city, values)
         connection.commit()
         logging.info(f"New city inserted {city_name}")
@@ -240,11 +263,12 @@ def add_city(DB_FILE, city_name):
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
+@utils.trace
+@db_cache.invalidates("City")
 def update_city(DB_FILE, existing_city_id, new_city_name):
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         update_city = '''
                 UPDATE City
@@ -253,7 +277,7 @@ def update_city(DB_FILE, existing_city_id, new_city_name):
             '''
         values = (new_city_name, existing_city_id)
 
-        logging.debug(f"{update_city}")
+        logging.debug(update_city)
         cursor.execute(update_city, values)
         connection.commit()
         logging.info(f"City {existing_city_id} updated, new name {new_city_name}")
@@ -265,13 +289,14 @@ def update_city(DB_FILE, existing_city_id, new_city_name):
         logger.error(f"Unknown error {exc}")
         return False
     finally:
-        connection.close()
-        logging.info("Connection closed for city update")
+        db_connection.release_connection(connection)
+        logging.info("Connection released for city update")
+@utils.trace
+@db_cache.invalidates("City")
 def delete_city(DB_FILE, city_id):
 
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         delete_city = '''
                         DELETE FROM City 
@@ -279,7 +304,7 @@ def delete_city(DB_FILE, city_id):
                     '''
         values = (city_id,)
 
-        logging.debug(f"{delete_city}")
+        logging.debug(delete_city)
         cursor.execute(delete_city, values)
         connection.commit()
         logging.info(f"city deleted {city_id} from City table")
@@ -289,13 +314,13 @@ def delete_city(DB_FILE, city_id):
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
+@utils.trace
 def add_aircraft(DB_FILE, new_aircraft_name, new_aircraft_model_id):
-    utils.log_active_function()
     logging.info(f"Attempting to add new aircraft {new_aircraft_name} of model {new_aircraft_model_id}")
 
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         insert_new_aircraft = '''
                   INSERT INTO Aircraft (aircraft_name, aircraftmodel_id)
@@ -303,10 +328,11 @@ def add_aircraft(DB_FILE, new_aircraft_name, new_aircraft_model_id):
               '''
         values = (new_aircraft_name,new_aircraft_model_id)
 
-        logging.debug(f"{insert_new_aircraft}")
+        logging.debug(insert_new_aircraft)
         cursor.execute(insert_new_aircraft, values)
         connection.commit()
         logging.info(f"New aircraft inserted {new_aircraft_name}")
+        after_commit(DB_FILE, route_feasibility.aircraft_added, cursor.lastrowid, new_aircraft_model_id)
 
         return True
     except sqlite3.DatabaseError as dbe:
@@ -314,13 +340,13 @@ def add_aircraft(DB_FILE, new_aircraft_name, new_aircraft_model_id):
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
 
+@utils.trace
 def delete_aircraft(DB_FILE, aircraft_id):
 
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         delete_aircraft = '''
                         DELETE FROM Aircraft 
@@ -328,21 +354,22 @@ def delete_aircraft(DB_FILE, aircraft_id):
                     '''
         values = (aircraft_id,)
 
-        logging.debug(f"{delete_aircraft}")
+        logging.debug(delete_aircraft)
         cursor.execute(delete_aircraft, values)
         connection.commit()
         logging.info(f"aircraft deleted {aircraft_id} from Aircraft table")
+        after_commit(DB_FILE, route_feasibility.aircraft_deleted, aircraft_id)
         return True
     except sqlite3.DatabaseError as dbe:
         logger.error(f"Database error {dbe}")
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
+@utils.trace
 def rename_aircraft(DB_FILE, aircraft_id, new_aircraft_name):
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         update_aircraft = '''
                     UPDATE Aircraft
@@ -351,7 +378,7 @@ def rename_aircraft(DB_FILE, aircraft_id, new_aircraft_name):
                 '''
         values = (new_aircraft_name, aircraft_id)
 
-        logging.debug(f"{update_aircraft}")
+        logging.debug(update_aircraft)
         cursor.execute(update_aircraft, values)
         connection.commit()
         logging.info(f"aircraft {aircraft_id} updated, new name {new_aircraft_name}")
@@ -363,14 +390,15 @@ def rename_aircraft(DB_FILE, aircraft_id, new_aircraft_name):
         logger.error(f"Unknown error {exc}")
         return False
     finally:
-        connection.close()
-        logging.info("Connection closed for aircraft update")
+        db_connection.release_connection(connection)
+        logging.info("Connection released for aircraft update")
+@utils.trace
+@db_cache.invalidates("AircraftModel")
 def add_aircraftmodel(DB_FILE, new_aircraftmodel_name, new_aircraftmodel_range, new_aircraftmodel_speed):
-    utils.log_active_function()
     logging.info(f"Attempting to add new aircraftmodel {new_aircraftmodel_name}")
 
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         insert_new_aircraftmodel = '''
                   INSERT INTO AircraftModel (aircraftmodel_name, aircraftmodel_range, aircraftmodel_speed)
@@ -378,7 +406,7 @@ def add_aircraftmodel(DB_FILE, new_aircraftmodel_name, new_aircraftmodel_range,
               '''
         values = (new_aircraftmodel_name,new_aircraftmodel_range,new_aircraftmodel_speed)
 
-        logging.debug(f"{insert_new_aircraftmodel}")
+        logging.debug(insert_new_aircraftmodel)
         cursor.execute(insert_new_aircraftmodel, values)
         connection.commit()
         logging.info(f"New aircraftmodel inserted {new_aircraftmodel_name}")
@@ -389,11 +417,12 @@ def add_aircraftmodel(DB_FILE, new_aircraftmodel_name, new_aircraftmodel_range,
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
+@utils.trace
+@db_cache.invalidates("AircraftModel")
 def delete_aircraftmodel(DB_FILE, aircraftmodel_id):
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         delete_aircraftmodel = '''
                         DELETE FROM AircraftModel 
@@ -401,7 +430,7 @@ def delete_aircraftmodel(DB_FILE, aircraftmodel_id):
                     '''
         values = (aircraftmodel_id,)
 
-        logging.debug(f"{delete_aircraftmodel}")
+        logging.debug(delete_aircraftmodel)
         cursor.execute(delete_aircraftmodel, values)
         connection.commit()
         logging.info(f"aircraftmodel_id deleted {aircraftmodel_id} from AircraftModel table")
@@ -411,11 +440,11 @@ def delete_aircraftmodel(DB_FILE, aircraftmodel_id):
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
+@utils.trace
 def add_flight(DB_FILE, flight_number, aircraft_id, pilot_id, route_id, schedule_id, arrival_time):
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         add_flight = '''
                             INSERT INTO Flight (flight_number, aircraft_id, pilot_id, route_id, schedule_id, arrival_time)
@@ -423,9 +452,10 @@ def add_flight(DB_FILE, flight_number, aircraft_id, pilot_id, route_id, schedule
                         '''
         values = (flight_number, aircraft_id, pilot_id, route_id, schedule_id, arrival_time)
 
-        logging.debug(f"{add_flight}")
+        logging.debug(add_flight)
         cursor.execute(add_flight, values)
         connection.commit()
+        after_commit(DB_FILE, change_feed.flights_changed)
         logging.info(f"Flight added OK")
         return True
     except sqlite3.DatabaseError as dbe:
@@ -433,11 +463,11 @@ def add_flight(DB_FILE, flight_number, aircraft_id, pilot_id, route_id, schedule
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
+@utils.trace
 def delete_flight(DB_FILE, flight_id):
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         delete_flight = '''
                         DELETE FROM Flight 
@@ -445,9 +475,10 @@ def delete_flight(DB_FILE, flight_id):
                     '''
         values = (flight_id,)
 
-        logging.debug(f"{delete_flight}")
+        logging.debug(delete_flight)
         cursor.execute(delete_flight, values)
         connection.commit()
+        after_commit(DB_FILE, change_feed.flights_changed)
         logging.info(f"Flight deleted {flight_id} from Flight table")
         return True
     except sqlite3.DatabaseError as dbe:
@@ -455,13 +486,13 @@ def delete_flight(DB_FILE, flight_id):
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
+@utils.trace
 def add_route(DB_FILE, origin_cityairport_id, destination_cityairport_id, route_distance):
-    utils.log_active_function()
     logging.info(f"Attempting to add new route")
 
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         insert_new_route = '''
                   INSERT INTO Route (origin_cityairport_id, destination_cityairport_id, route_distance)
@@ -469,10 +500,12 @@ def add_route(DB_FILE, origin_cityairport_id, destination_cityairport_id, route_
               '''
         values = (origin_cityairport_id,destination_cityairport_id, route_distance)
 
-        logging.debug(f"{insert_new_route}")
+        logging.debug(insert_new_route)
         cursor.execute(insert_new_route, values)
         connection.commit()
         logging.info(f"New route inserted")
+        after_commit(DB_FILE, route_graph.route_added, cursor.lastrowid, origin_cityairport_id, destination_cityairport_id, route_distance)
+        after_commit(DB_FILE, route_feasibility.route_added, cursor.lastrowid, route_distance)
 
         return True
     except sqlite3.DatabaseError as dbe:
@@ -480,11 +513,11 @@ def add_route(DB_FILE, origin_cityairport_id, destination_cityairport_id, route_
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
     finally:
-        connection.close()
+        db_connection.release_connection(connection)
+@utils.trace
 def delete_route(DB_FILE, route_id):
-    utils.log_active_function()
     try:
-        connection = sqlite3.connect(DB_FILE)
+        connection = db_connection.get_connection(DB_FILE)
         cursor = connection.cursor()
         delete_route = '''
                          DELETE FROM Route 
@@ -492,14 +525,336 @@ def delete_route(DB_FILE, route_id):
                      '''
         values = (route_id,)
 
-        logging.debug(f"{delete_city}")
+        logging.debug(delete_route)
         cursor.execute(delete_route, values)
         connection.commit()
         logging.info(f"route deleted {route_id}")
+        after_commit(DB_FILE, route_graph.route_deleted, route_id)
+        after_commit(DB_FILE, route_feasibility.route_deleted, route_id)
+        return True
+    except sqlite3.DatabaseError as dbe:
+        logger.error(f"Database error {dbe}")
+    except Exception as exc:
+        logger.error(f"Unknown error {exc}")
+    finally:
+        db_connection.release_connection(connection)
+# Bulk flight creation
+# add_flight inserts one flight that the CLI has already checked piece by piece, which is no good for loading a
+# season's timetable. add_flights takes any number of candidate flights, loads them into a temporary table and
+# validates the lot with one set-based query using the same rules as the (F) add flight screen -
+#   aircraft, pilot, route and schedule must exist
+#   the aircraft and pilot can't already be flying at that time, either on a stored flight or an earlier row of the
+#   same batch (see flight_conflicts.py)
+#   aircraft range must be at least 110% of the route distance
+# arrival times are then worked out for the rows that passed with flight_times, rounding the flight time up to the hour
+# like calculate_flight_time in bambi.py. Valid rows are inserted in one transaction, the rest come back with the reason they were rejected.
+CANDIDATE_FLIGHT_FIELDS = ("flight_number", "aircraft_id", "pilot_id", "route_id", "schedule_id")
+
+def describe_conflicts(conflicts):
+    # stored flights are in the conflict index by flight_id, rows from the batch as "row n"
+    return ", ".join(f"flight {conflict}" if isinstance(conflict, int) else f"batch {conflict}" for conflict in conflicts)
+
+@utils.trace
+def add_flights(DB_FILE, candidate_flights):
+    # candidate_flights - dicts with the CANDIDATE_FLIGHT_FIELDS keys, or tuples in that order
+    # returns (number of flights inserted, [(row number, candidate flight, rejection reason), ...])
+    # row numbers start at 1 in the order the candidates were given
+    logging.info("Attempting bulk flight creation")
+    try:
+        connection = db_connection.get_connection(DB_FILE)
+        cursor = connection.cursor()
+
+        candidate_rows = []
+        for row_number, candidate_flight in enumerate(candidate_flights, start=1):
+            if isinstance(candidate_flight, dict):
+                candidate_flight = tuple(candidate_flight.get(field) for field in CANDIDATE_FLIGHT_FIELDS)
+            candidate_rows.append((row_number, *candidate_flight))
+
+        # temp tables only exist on this connection and vanish when it closes
+        cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS candidate_flight (
+                    row_number INTEGER PRIMARY KEY,
+                    flight_number TEXT,
+                    aircraft_id INTEGER,
+                    pilot_id INTEGER,
+                    route_id INTEGER,
+                    schedule_id INTEGER
+                )
+            ''')
+        cursor.execute('''
+                CREATE TEMP TABLE IF NOT EXISTS validated_flight (
+                    row_number INTEGER PRIMARY KEY,
+                    rejection TEXT,
+                    arrival_time TEXT
+                )
+            ''')
+        cursor.execute("DELETE FROM temp.candidate_flight")
+        cursor.execute("DELETE FROM temp.validated_flight")
+        cursor.executemany('''
+                INSERT INTO temp.candidate_flight (row_number, flight_number, aircraft_id, pilot_id, route_id, schedule_id)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', candidate_rows)
+
+        # everything that can be decided by a join - arrival times are worked out below, in python
+        validate_flights = '''
+                INSERT INTO temp.validated_flight (row_number, rejection)
+                SELECT
+                c.row_number,
+                CASE
+                    WHEN a.aircraft_id IS NULL THEN 'aircraft does not exist'
+                    WHEN am.aircraftmodel_id IS NULL THEN 'aircraft has no valid aircraft model'
+                    WHEN p.pilot_id IS NULL THEN 'pilot does not exist'
+                    WHEN r.route_id IS NULL THEN 'route does not exist'
+                    WHEN s.schedule_id IS NULL THEN 'schedule does not exist'
+                    WHEN r.route_distance IS NULL THEN 'route has no distance'
+                    WHEN am.aircraftmodel_range < 1.1 * r.route_distance THEN 'aircraft range is less than 110% of route distance'
+                    WHEN am.aircraftmodel_speed IS NULL OR am.aircraftmodel_speed <= 0 THEN 'aircraft model speed is not valid'
+                END
+                FROM temp.candidate_flight c
+                LEFT JOIN Aircraft a on a.aircraft_id = c.aircraft_id
+                LEFT JOIN AircraftModel am on am.aircraftmodel_id = a.aircraftmodel_id
+                LEFT JOIN Pilot p on p.pilot_id = c.pilot_id
+                LEFT JOIN Route r on r.route_id = c.route_id
+                LEFT JOIN Schedule s on s.schedule_id = c.schedule_id
+            '''
+        logging.debug(validate_flights)
+        cursor.execute(validate_flights)
+
+        # the same flight_times maths as _recalculate_arrival_times, so a flight added here gets exactly the arrival
+        # time a recalculation would give it - a departure flight_times can't read is a rejection, not a NULL arrival
+        cursor.execute('''
+                SELECT v.row_number, r.route_distance, am.aircraftmodel_speed, s.departure_time
+                FROM temp.validated_flight v
+                INNER JOIN temp.candidate_flight c on c.row_number = v.row_number
+                INNER JOIN Aircraft a on a.aircraft_id = c.aircraft_id
+                INNER JOIN AircraftModel am on am.aircraftmodel_id = a.aircraftmodel_id
+                INNER JOIN Route r on r.route_id = c.route_id
+                INNER JOIN Schedule s on s.schedule_id = c.schedule_id
+                WHERE v.rejection IS NULL
+            ''')
+        timed_flights = []
+        departure_rejections = []
+        for row_number, route_distance, aircraft_speed, departure_time in cursor.fetchall():
+            try:
+                flight_times.departure_minutes(departure_time)
+                timed_flights.append((row_number, route_distance, aircraft_speed, departure_time))
+            except (AttributeError, ValueError):
+                departure_rejections.append(("departure time is not valid, so the arrival time can't be worked out", row_number))
+        cursor.executemany("UPDATE temp.validated_flight SET rejection = ? WHERE row_number = ?", departure_rejections)
+        if timed_flights:
+            row_numbers, route_distances, aircraft_speeds, departure_times = zip(*timed_flights)
+            arrival_times = flight_times.calculate_arrival_times(route_distances, aircraft_speeds, departure_times)
+            cursor.executemany("UPDATE temp.validated_flight SET arrival_time = ? WHERE row_number = ?",
+                               zip(arrival_times, row_numbers))
+
+        # double-booking needs the arrival times worked out above, and has to take the batch rows in order
+        # so each one is checked against the stored flights plus the rows accepted before it
+        conflict_index = flight_conflicts.load_conflict_index(cursor, '''
+                f.aircraft_id IN (SELECT aircraft_id FROM temp.candidate_flight)
+                OR f.pilot_id IN (SELECT pilot_id FROM temp.candidate_flight)
+            ''')
+        cursor.execute('''
+                SELECT c.row_number, c.aircraft_id, c.pilot_id, s.departure_time, v.arrival_time
+                FROM temp.candidate_flight c
+                INNER JOIN temp.validated_flight v on v.row_number = c.row_number
+                INNER JOIN Schedule s on s.schedule_id = c.schedule_id
+                WHERE v.rejection IS NULL
+                ORDER BY c.row_number
+            ''')
+        conflict_rejections = []
+        for row_number, aircraft_id, pilot_id, departure_time, arrival_time in cursor.fetchall():
+            aircraft_conflicts, pilot_conflicts = conflict_index.find_conflicts(aircraft_id, pilot_id, departure_time, arrival_time)
+            if aircraft_conflicts:
+                conflict_rejections.append((f"aircraft already flying {describe_conflicts(aircraft_conflicts)} at that time", row_number))
+            elif pilot_conflicts:
+                conflict_rejections.append((f"pilot already flying {describe_conflicts(pilot_conflicts)} at that time", row_number))
+            else:
+                conflict_index.add_flight(f"row {row_number}", aircraft_id, pilot_id, departure_time, arrival_time)
+        cursor.executemany("UPDATE temp.validated_flight SET rejection = ? WHERE row_number = ?", conflict_rejections)
+
+        cursor.execute('''
+                INSERT INTO Flight (flight_number, aircraft_id, pilot_id, route_id, schedule_id, arrival_time)
+                SELECT c.flight_number, c.aircraft_id, c.pilot_id, c.route_id, c.schedule_id, v.arrival_time
+                FROM temp.candidate_flight c
+                INNER JOIN temp.validated_flight v on v.row_number = c.row_number
+                WHERE v.rejection IS NULL
+                ORDER BY c.row_number
+            ''')
+        inserted_flight_count = cursor.rowcount
+
+        cursor.execute('''
+                SELECT c.row_number, c.flight_number, c.aircraft_id, c.pilot_id, c.route_id, c.schedule_id, v.rejection
+                FROM temp.candidate_flight c
+                INNER JOIN temp.validated_flight v on v.row_number = c.row_number
+                WHERE v.rejection IS NOT NULL
+                ORDER BY c.row_number
+            ''')
+        rejections = [(row[0], dict(zip(CANDIDATE_FLIGHT_FIELDS, row[1:6])), row[6]) for row in cursor.fetchall()]
+
+        cursor.execute("DELETE FROM temp.candidate_flight")
+        cursor.execute("DELETE FROM temp.validated_flight")
+        connection.commit()
+        after_commit(DB_FILE, change_feed.flights_changed)
+        logging.info(f"Bulk flight creation - {inserted_flight_count} inserted, {len(rejections)} rejected")
+        return inserted_flight_count, rejections
+    except sqlite3.DatabaseError as dbe:
+        logger.error(f"Database error {dbe}")
+        return False
+    except Exception as exc:
+        logger.error(f"Unknown error {exc}")
+        return False
+    finally:
+        db_connection.release_connection(connection)
+
+# Arrival time recalculation
+# Flight.arrival_time is worked out once when the flight is added, from the route distance and the aircraft model
+# speed at that moment. If either of those changes afterwards every flight using them is out of date, so the
+# update functions below recalculate the affected flights in the same transaction as the change itself, with the
+# batch maths in flight_times rather than calculate_flight_time one flight at a time.
+# recalculate_arrival_times can also be run on its own (python flight_times.py) to fix up a whole database.
+def _recalculate_arrival_times(cursor, route_ids=None, aircraftmodel_ids=None):
+    # doesn't commit - the caller does that, so the recalculation lands together with whatever caused it
+    # with no ids given every flight is checked; flights with no usable distance, speed or departure are left alone
+    conditions = ["r.route_distance IS NOT NULL", "am.aircraftmodel_speed > 0", "s.departure_time IS NOT NULL"]
+    values = []
+    if route_ids is not None:
+        route_ids = list(route_ids)
+        conditions.append(f"f.route_id IN ({', '.join('?' * len(route_ids))})")
+        values.extend(route_ids)
+    if aircraftmodel_ids is not None:
+        aircraftmodel_ids = list(aircraftmodel_ids)
+        conditions.append(f"a.aircraftmodel_id IN ({', '.join('?' * len(aircraftmodel_ids))})")
+        values.extend(aircraftmodel_ids)
+
+    select_affected_flights = f'''
+                    SELECT f.flight_id, r.route_distance, am.aircraftmodel_speed, s.departure_time, f.arrival_time
+                    FROM Flight f
+                    INNER JOIN Route r on r.route_id = f.route_id
+                    INNER JOIN Aircraft a on a.aircraft_id = f.aircraft_id
+                    INNER JOIN AircraftModel am on am.aircraftmodel_id = a.aircraftmodel_id
+                    INNER JOIN Schedule s on s.schedule_id = f.schedule_id
+                    WHERE {" AND ".join(conditions)}
+                '''
+    logging.debug(select_affected_flights)
+    cursor.execute(select_affected_flights, values)
+    affected_flights = cursor.fetchall()
+    if not affected_flights:
+        return 0
+
+    flight_ids, route_distances, aircraft_speeds, departure_times, stored_arrival_times = zip(*affected_flights)
+    arrival_times = flight_times.calculate_arrival_times(route_distances, aircraft_speeds, departure_times)
+
+    # only rewrite the ones that actually changed
+    changed_flights = [(arrival_time, flight_id)
+                       for flight_id, arrival_time, stored_arrival_time in zip(flight_ids, arrival_times, stored_arrival_times)
+                       if arrival_time != stored_arrival_time]
+    cursor.executemany("UPDATE Flight SET arrival_time = ? WHERE flight_id = ?", changed_flights)
+    logging.info("Recalculated %d arrival times, %d changed", len(affected_flights), len(changed_flights))
+    return len(changed_flights)
+
+@utils.trace
+def recalculate_arrival_times(DB_FILE, route_ids=None, aircraftmodel_ids=None):
+    # returns the number of flights whose arrival time changed, or False on error
+    try:
+        connection = db_connection.get_connection(DB_FILE)
+        cursor = connection.cursor()
+        changed_flight_count = _recalculate_arrival_times(cursor, route_ids, aircraftmodel_ids)
+        connection.commit()
+        after_commit(DB_FILE, change_feed.flights_changed)
+        return changed_flight_count
+    except sqlite3.DatabaseError as dbe:
+        logger.error(f"Database error {dbe}")
+        return False
+    except Exception as exc:
+        logger.error(f"Unknown error {exc}")
+        return False
+    finally:
+        db_connection.release_connection(connection)
+@utils.trace
+def update_route_distance(DB_FILE, route_id, new_route_distance):
+    try:
+        connection = db_connection.get_connection(DB_FILE)
+        cursor = connection.cursor()
+        update_route_distance = '''
+                        UPDATE Route
+                        SET route_distance = ?
+                        WHERE route_id = ?
+                    '''
+        values = (new_route_distance, route_id)
+
+        logging.debug(update_route_distance)
+        cursor.execute(update_route_distance, values)
+        changed_flight_count = _recalculate_arrival_times(cursor, route_ids=[route_id])
+        connection.commit()
+        after_commit(DB_FILE, change_feed.flights_changed)
+        after_commit(DB_FILE, route_graph.route_distance_changed, route_id, new_route_distance)
+        after_commit(DB_FILE, route_feasibility.route_distance_changed, route_id, new_route_distance)
+        logging.info(f"Route {route_id} distance updated to {new_route_distance}, {changed_flight_count} arrival times changed")
+        return True
+    except sqlite3.DatabaseError as dbe:
+        logger.error(f"Database error {dbe}")
+        return False
+    except Exception as exc:
+        logger.error(f"Unknown error {exc}")
+        return False
+    finally:
+        db_connection.release_connection(connection)
+@utils.trace
+@db_cache.invalidates("AircraftModel")
+def update_aircraftmodel_speed(DB_FILE, aircraftmodel_id, new_aircraftmodel_speed):
+    try:
+        connection = db_connection.get_connection(DB_FILE)
+        cursor = connection.cursor()
+        update_aircraftmodel_speed = '''
+                        UPDATE AircraftModel
+                        SET aircraftmodel_speed = ?
+                        WHERE aircraftmodel_id = ?
+                    '''
+        values = (new_aircraftmodel_speed, aircraftmodel_id)
+
+        logging.debug(update_aircraftmodel_speed)
+        cursor.execute(update_aircraftmodel_speed, values)
+        changed_flight_count = _recalculate_arrival_times(cursor, aircraftmodel_ids=[aircraftmodel_id])
+        connection.commit()
+        after_commit(DB_FILE, change_feed.flights_changed)
+        logging.info(f"Aircraft model {aircraftmodel_id} speed updated to {new_aircraftmodel_speed}, {changed_flight_count} arrival times changed")
         return True
     except sqlite3.DatabaseError as dbe:
         logger.error(f"Database error {dbe}")
+        return False
+    except Exception as exc:
+        logger.error(f"Unknown error {exc}")
+        return False
+    finally:
+        db_connection.release_connection(connection)
+@utils.trace
+@db_cache.invalidates("Airport")
+def set_airport_coordinates(DB_FILE, airport_coordinates):
+    # airport_coordinates - (airport_code, latitude, longitude) rows, returns how many airports were updated
+    try:
+        connection = db_connection.get_connection(DB_FILE)
+        cursor = connection.cursor()
+        update_airport_coordinates = '''
+                        UPDATE Airport
+                        SET latitude = ?, longitude = ?
+                        WHERE airport_code = ?
+                    '''
+        values = [(latitude, longitude, airport_code) for airport_code, latitude, longitude in airport_coordinates
+                  if -90 <= latitude <= 90 and -180 <= longitude <= 180]
+        if len(values) < len(airport_coordinates):
+            logger.warning(f"{len(airport_coordinates) - len(values)} airport coordinates out of range, not set")
+
+        logging.debug(update_airport_coordinates)
+        cursor.executemany(update_airport_coordinates, values)
+        updated_airport_count = cursor.rowcount
+        connection.commit()
+        logging.info(f"Coordinates set for {updated_airport_count} airports")
+        return updated_airport_count
+    except sqlite3.DatabaseError as dbe:
+        logger.error(f"Database error {dbe}")
+        return False
     except Exception as exc:
         logger.error(f"Unknown error {exc}")
+        return False
     finally:
-        connection.close()
\ No newline at end of file
+        db_connection.release_connection(connection)
\ No newline at end of file
@@ -0,0 +1,244 @@
+import sys
+import time
+import bisect
+import logging
+import db_connection
+import db_get
+import db_set
+import flight_times
+import flight_conflicts
+import flight_import
+
+# Automatic aircraft and pilot assignment
+# Building a flight in cli_view_flights means reading through render_aircraft and render_pilots and picking an
+# aircraft_id and pilot_id by hand. This takes a set of flights that only have a route and a departure schedule and
+# works out an aircraft and a pilot for each of them -
+#   - the aircraft's range must be at least 110% of the route distance (db_get.RANGE_MARGIN)
+#   - no aircraft or pilot can be given two flights whose times overlap, including the flights already stored
+#     (the same daily-repeating rule as flight_conflicts.py)
+#
+# It's a bipartite matching of flights to aircraft (then to pilots) using augmenting paths, i.e. Kuhn's algorithm.
+# The difference from the textbook version is that an aircraft isn't "used up" by one flight, it can take any number
+# that don't overlap. When a flight can't be placed, we look for an aircraft where exactly one flight planned in this
+# run is in the way and try to move that flight to another aircraft, recursively, before giving up.
+# Flights already in the database are never moved.
+#
+# Flights are placed longest route first, since fewer aircraft can fly those, and each flight tries the
+# shortest-range aircraft that can manage it first so the long-range aircraft are kept for the routes that need them.
+# An aircraft's speed changes the arrival time, so aircraft are assigned first and pilots are then matched to the
+# finished flight times.
+#
+#   python flight_assignment.py timetable.csv [database file]
+# with a header row of flight_number,route_id,schedule_id (or a .json list of objects with those keys)
+#
+# The results are written with db_set.add_flights, in one transaction, so every assignment is checked again there.
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in flight_assignment.py")
+
+UNASSIGNED_FLIGHT_FIELDS = ("flight_number", "route_id", "schedule_id")
+
+# how many flights one attempt may shuffle along - stops a hopeless flight searching every chain of moves
+MAX_REASSIGNMENT_DEPTH = 50
+
+
+class AssignmentPlan:
+    # the flights planned onto each aircraft or pilot during one run, on top of the stored flights which can't move
+    def __init__(self, stored_index):
+        self.stored_index = stored_index
+        self.planned = {}      # resource id: IntervalIndex of candidate positions
+        self.placements = {}   # candidate position: (resource id, segments)
+
+    def stored_conflicts(self, resource_id, segments):
+        if resource_id not in self.stored_index:
+            return False
+        return any(self.stored_index[resource_id].overlapping(start, end) for start, end in segments)
+
+    def planned_conflicts(self, resource_id, segments):
+        if resource_id not in self.planned:
+            return set()
+        return {owner for start, end in segments for owner in self.planned[resource_id].overlapping(start, end)}
+
+    def place(self, position, resource_id, segments):
+        resource_index = self.planned.setdefault(resource_id, flight_conflicts.IntervalIndex())
+        for start, end in segments:
+            resource_index.add(start, end, position)
+        self.placements[position] = (resource_id, segments)
+
+    def unplace(self, position):
+        resource_id, segments = self.placements.pop(position)
+        for start, end in segments:
+            self.planned[resource_id].remove(start, end, position)
+
+
+def match_flights(positions, eligible_resources, segments_for, plan):
+    # Kuhn's algorithm over interval capacities - returns the positions that couldn't be placed
+    def try_place(position, visited, depth):
+        # a free resource first - moving flights about only when nothing is free keeps the gaps in everyone's day
+        # for the flights still to come
+        blocked_resources = []
+        for resource_id in eligible_resources(position):
+            if resource_id in visited:
+                continue
+            segments = segments_for(position, resource_id)
+            if plan.stored_conflicts(resource_id, segments):
+                continue
+            blocking_positions = plan.planned_conflicts(resource_id, segments)
+            if not blocking_positions:
+                plan.place(position, resource_id, segments)
+                return True
+            if len(blocking_positions) == 1:
+                blocked_resources.append((resource_id, segments, blocking_positions.pop()))
+
+        if depth >= MAX_REASSIGNMENT_DEPTH:
+            return False
+        # one planned flight in the way - see if it can go somewhere else instead
+        for resource_id, segments, blocking_position in blocked_resources:
+            if resource_id in visited:
+                continue
+            visited.add(resource_id)
+            if blocking_position in plan.placements and plan.placements[blocking_position][0] == resource_id:
+                blocking_segments = plan.placements[blocking_position][1]
+                plan.unplace(blocking_position)
+                if try_place(blocking_position, visited, depth + 1):
+                    plan.place(position, resource_id, segments)
+                    return True
+                plan.place(blocking_position, resource_id, blocking_segments)
+        return False
+
+    return [position for position in positions if not try_place(position, set(), 0)]
+
+
+def load_assignment_data(DB_FILE):
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        cursor = connection.cursor()
+        cursor.execute('''
+                SELECT a.aircraft_id, am.aircraftmodel_range, am.aircraftmodel_speed
+                FROM Aircraft a
+                INNER JOIN AircraftModel am on am.aircraftmodel_id = a.aircraftmodel_id
+                WHERE am.aircraftmodel_speed > 0 AND am.aircraftmodel_range IS NOT NULL
+                ORDER BY am.aircraftmodel_range, a.aircraft_id
+            ''')
+        aircraft = cursor.fetchall()
+        pilot_ids = [row[0] for row in cursor.execute("SELECT pilot_id FROM Pilot ORDER BY pilot_id")]
+        route_distances = dict(cursor.execute("SELECT route_id, route_distance FROM Route WHERE route_distance IS NOT NULL"))
+        departure_times = dict(cursor.execute("SELECT schedule_id, departure_time FROM Schedule WHERE departure_time IS NOT NULL"))
+        stored_index = flight_conflicts.load_conflict_index(cursor)
+    finally:
+        db_connection.release_connection(connection)
+    return aircraft, pilot_ids, route_distances, departure_times, stored_index
+
+
+def plan_assignments(DB_FILE, unassigned_flights):
+    # unassigned_flights - dicts with the UNASSIGNED_FLIGHT_FIELDS keys, or tuples in that order
+    # returns (candidate flights with aircraft_id and pilot_id filled in, [(row number, flight, reason)], timings)
+    timings = {}
+    started = time.perf_counter()
+    aircraft, pilot_ids, route_distances, departure_times, stored_index = load_assignment_data(DB_FILE)
+    timings["load"] = time.perf_counter() - started
+
+    flights = []
+    unassignable = []
+    for row_number, flight in enumerate(unassigned_flights, start=1):
+        if not isinstance(flight, dict):
+            flight = dict(zip(UNASSIGNED_FLIGHT_FIELDS, flight))
+        flight = {field: flight.get(field) for field in UNASSIGNED_FLIGHT_FIELDS}
+        flight["route_id"] = flight_import.parse_id(flight["route_id"])
+        flight["schedule_id"] = flight_import.parse_id(flight["schedule_id"])
+        if flight["route_id"] not in route_distances:
+            unassignable.append((row_number, flight, "route does not exist"))
+        elif flight["schedule_id"] not in departure_times:
+            unassignable.append((row_number, flight, "schedule does not exist"))
+        else:
+            flights.append((row_number, flight))
+
+    # positions into flights, longest route first
+    positions = sorted(range(len(flights)), key=lambda position: -route_distances[flights[position][1]["route_id"]])
+
+    started = time.perf_counter()
+    # the aircraft list is already in range order, so the aircraft that can fly a route are everything from the first
+    # with enough range onwards (the same threshold lookup as route_feasibility) - shortest range first, one per route
+    aircraft_speeds = {aircraft_id: speed for aircraft_id, _, speed in aircraft}
+    aircraft_ranges = [aircraft_range for _, aircraft_range, _ in aircraft]
+    route_aircraft = {}
+    eligible_aircraft = {}
+    for position, (_, flight) in enumerate(flights):
+        route_id = flight["route_id"]
+        if route_id not in route_aircraft:
+            first = bisect.bisect_left(aircraft_ranges, db_get.RANGE_MARGIN * route_distances[route_id])
+            route_aircraft[route_id] = [aircraft_id for aircraft_id, _, _ in aircraft[first:]]
+        eligible_aircraft[position] = route_aircraft[route_id]
+
+    arrival_times = {}
+
+    def aircraft_segments(position, aircraft_id):
+        flight = flights[position][1]
+        speed = aircraft_speeds[aircraft_id]
+        if (position, speed) not in arrival_times:
+            arrival_times[position, speed] = flight_times.calculate_arrival_times(
+                [route_distances[flight["route_id"]]], [speed], [departure_times[flight["schedule_id"]]])[0]
+        return flight_conflicts.flight_segments(departure_times[flight["schedule_id"]], arrival_times[position, speed])
+
+    aircraft_plan = AssignmentPlan(stored_index.aircraft)
+    no_aircraft = set(match_flights(positions, eligible_aircraft.__getitem__, aircraft_segments, aircraft_plan))
+    timings["aircraft"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    pilot_positions = [position for position in positions if position not in no_aircraft]
+    pilot_plan = AssignmentPlan(stored_index.pilots)
+    no_pilot = set(match_flights(pilot_positions, lambda position: pilot_ids,
+                                 lambda position, pilot_id: aircraft_plan.placements[position][1], pilot_plan))
+    timings["pilots"] = time.perf_counter() - started
+
+    assigned_flights = []
+    for position, (row_number, flight) in enumerate(flights):
+        if position in no_aircraft:
+            reason = "no aircraft with enough range is free at that time" if eligible_aircraft[position] else "no aircraft has enough range"
+            unassignable.append((row_number, flight, reason))
+        elif position in no_pilot:
+            unassignable.append((row_number, flight, "no pilot is free at that time"))
+        else:
+            assigned_flights.append({**flight, "aircraft_id": aircraft_plan.placements[position][0],
+                                     "pilot_id": pilot_plan.placements[position][0]})
+    unassignable.sort(key=lambda rejection: rejection[0])
+    logger.info(f"Assignment planned for {len(assigned_flights)} of {len(assigned_flights) + len(unassignable)} flights - "
+                + ", ".join(f"{step} {seconds:.3f}s" for step, seconds in timings.items()))
+    return assigned_flights, unassignable, timings
+
+
+def assign_flights(DB_FILE, unassigned_flights):
+    # plans the assignments and adds the flights in one transaction with db_set.add_flights
+    # returns (inserted count, [(row number, flight, reason)], timings), or False on a database error
+    assigned_flights, unassignable, timings = plan_assignments(DB_FILE, unassigned_flights)
+    started = time.perf_counter()
+    result = db_set.add_flights(DB_FILE, assigned_flights)
+    timings["write"] = time.perf_counter() - started
+    if result is False:
+        return False
+
+    inserted_flight_count, rejections = result
+    # add_flights numbers its rows from the assigned list, there shouldn't be any but report them if so
+    for _, flight, reason in rejections:
+        unassignable.append((None, flight, reason))
+    return inserted_flight_count, unassignable, timings
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python flight_assignment.py <timetable.csv|timetable.json> [database file]")
+        sys.exit(1)
+
+    timetable_file = sys.argv[1]
+    DB_FILE = sys.argv[2] if len(sys.argv) > 2 else "bambi.db"
+    unassigned_flights = flight_import.read_candidate_flights(timetable_file, UNASSIGNED_FLIGHT_FIELDS)
+    result = assign_flights(DB_FILE, unassigned_flights)
+    if result is False:
+        print("Error adding flights, please check the log")
+        sys.exit(1)
+
+    inserted_flight_count, unassignable, timings = result
+    print(f"{inserted_flight_count} flights assigned and added, {len(unassignable)} could not be assigned")
+    print("Took " + ", ".join(f"{step} {seconds:.3f}s" for step, seconds in timings.items()))
+    for row_number, flight, reason in unassignable:
+        print(f"Row {row_number} ({flight['flight_number']}) - {reason}")
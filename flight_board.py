@@ -0,0 +1,218 @@
+import sys
+import time
+import logging
+import sqlite3
+import db_connection
+
+# Materialised flight board
+# The flight list (render_flights) is the screen that gets refreshed the most, and building it means joining Flight to
+# Aircraft, AircraftModel, Pilot, Route, Schedule and CityAirport/Airport twice - on every refresh, and the cost grows
+# with every one of those tables. FlightBoard holds the finished rows instead, so db_get.get_flights is a plain
+# read of one table in flight_id order.
+#
+# FlightBoard is kept in step by triggers rather than by db_set, so it stays right whatever writes to the database
+# (db_set, the bulk import, another BAMBI process or someone with the sqlite3 shell). Each trigger works out which
+# flights the changed row feeds into, deletes their board rows and re-inserts them from the live join - a flight
+# that no longer joins up (e.g. its pilot was deleted) simply drops off the board, the same as the join would hide it.
+# The table and triggers are created by migration 3 in db_migrations.
+#
+#   python flight_board.py [database file]            - compares FlightBoard against the live join
+#   python flight_board.py [database file] --rebuild  - throws FlightBoard away and rebuilds it from the live join
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in flight_board.py")
+
+FLIGHT_BOARD_COLUMNS = ("flight_id", "flight_number", "aircraft_name", "aircraftmodel_name", "captain",
+                        "origin_airport", "destination_airport", "departure_time", "arrival_time")
+
+CREATE_FLIGHT_BOARD = '''
+            CREATE TABLE IF NOT EXISTS FlightBoard (
+                flight_id INTEGER PRIMARY KEY,
+                flight_number TEXT,
+                aircraft_name TEXT,
+                aircraftmodel_name TEXT,
+                captain TEXT,
+                origin_airport TEXT,
+                destination_airport TEXT,
+                departure_time TEXT,
+                arrival_time TEXT
+            )
+        '''
+
+# the join get_flights used to run every time, now only run for the flights a write has touched
+LIVE_FLIGHT_BOARD_QUERY = '''
+                       SELECT
+                       f.flight_id,
+                       f.flight_number,
+                       a.aircraft_name,
+                       am.aircraftmodel_name,
+                       p.pilot_name AS captain,
+                       ao.airport_code AS origin_airport,
+                       ad.airport_code AS destination_airport,
+                       s.departure_time,
+                       f.arrival_time
+
+                       FROM
+                       Flight f
+
+                       INNER JOIN Aircraft a on f.aircraft_id = a.aircraft_id
+                       INNER JOIN AircraftModel am on a.aircraftmodel_id = am.aircraftmodel_id
+                       INNER JOIN Pilot p on f.pilot_id = p.pilot_id
+                       INNER JOIN Route r on f.route_id = r.route_id
+                       INNER JOIN Schedule s on f.schedule_id = s.schedule_id
+
+                       INNER JOIN CityAirport cao on r.origin_cityairport_id = cao.cityairport_id
+                       INNER JOIN Airport ao on cao.airport_id = ao.airport_id
+
+                       INNER JOIN CityAirport cad on r.destination_cityairport_id = cad.cityairport_id
+                       INNER JOIN Airport ad on cad.airport_id = ad.airport_id
+                       '''
+# I didn't know that cao/ao and cad/ad was "acceptable" practice when setting up table aliases (aliasii?)
+# A colleague at work suggested it's fine to do so if it makes the code more readable, so I used the practice
+# it makes it much clearer for me when i'm doing multiple joins on the same tables!
+
+# most of the query is straightforward but the origin/destination is as follows
+# Flight has a Route and a Route has an origin + destination airport
+# So we need Flight > Route > CityAirport > Airport
+# repeated for origin/destination
+
+# For every table the board reads from - the columns that change what is shown, and which flights (as a condition on
+# Flight f) a row of that table feeds into. {row} becomes NEW or OLD inside the trigger.
+FLIGHT_BOARD_SOURCES = {
+    "Aircraft": (("aircraft_id", "aircraft_name", "aircraftmodel_id"),
+                 "f.aircraft_id = {row}.aircraft_id"),
+    "AircraftModel": (("aircraftmodel_id", "aircraftmodel_name"),
+                      "f.aircraft_id IN (SELECT aircraft_id FROM Aircraft WHERE aircraftmodel_id = {row}.aircraftmodel_id)"),
+    "Pilot": (("pilot_id", "pilot_name"),
+              "f.pilot_id = {row}.pilot_id"),
+    "Schedule": (("schedule_id", "departure_time"),
+                 "f.schedule_id = {row}.schedule_id"),
+    "Route": (("route_id", "origin_cityairport_id", "destination_cityairport_id"),
+              "f.route_id = {row}.route_id"),
+    "CityAirport": (("cityairport_id", "airport_id"),
+                    "f.route_id IN (SELECT route_id FROM Route WHERE origin_cityairport_id = {row}.cityairport_id "
+                    "UNION SELECT route_id FROM Route WHERE destination_cityairport_id = {row}.cityairport_id)"),
+    "Airport": (("airport_id", "airport_code"),
+                "f.route_id IN (SELECT route_id FROM Route WHERE origin_cityairport_id IN "
+                "(SELECT cityairport_id FROM CityAirport WHERE airport_id = {row}.airport_id) "
+                "UNION SELECT route_id FROM Route WHERE destination_cityairport_id IN "
+                "(SELECT cityairport_id FROM CityAirport WHERE airport_id = {row}.airport_id))"),
+}
+
+
+def refresh_statements(flight_condition):
+    # SQL to bring the board rows for every flight matching flight_condition back in line with the live join
+    return [
+        f"DELETE FROM FlightBoard WHERE flight_id IN (SELECT f.flight_id FROM Flight f WHERE {flight_condition})",
+        f"INSERT OR REPLACE INTO FlightBoard ({', '.join(FLIGHT_BOARD_COLUMNS)}) {LIVE_FLIGHT_BOARD_QUERY} WHERE {flight_condition}",
+    ]
+
+
+def build_triggers():
+    # returns {trigger name: CREATE TRIGGER statement}
+    triggers = {}
+
+    def add_trigger(table, event, statements):
+        trigger_name = f"flightboard_{table.lower()}_{event.split()[0].lower()}"
+        body = ";\n".join(statements)
+        triggers[trigger_name] = f"CREATE TRIGGER IF NOT EXISTS {trigger_name} AFTER {event} ON {table}\nBEGIN\n{body};\nEND"
+
+    flight_columns = ("flight_id", "flight_number", "aircraft_id", "pilot_id", "route_id", "schedule_id", "arrival_time")
+    add_trigger("Flight", "INSERT", refresh_statements("f.flight_id = NEW.flight_id"))
+    add_trigger("Flight", f"UPDATE OF {', '.join(flight_columns)}",
+                ["DELETE FROM FlightBoard WHERE flight_id = OLD.flight_id"] + refresh_statements("f.flight_id = NEW.flight_id"))
+    add_trigger("Flight", "DELETE", ["DELETE FROM FlightBoard WHERE flight_id = OLD.flight_id"])
+
+    for table, (columns, flight_condition) in FLIGHT_BOARD_SOURCES.items():
+        # an insert can complete a join for flights that point at a row that didn't exist before
+        add_trigger(table, "INSERT", refresh_statements(flight_condition.format(row="NEW")))
+        add_trigger(table, f"UPDATE OF {', '.join(columns)}",
+                    refresh_statements(flight_condition.format(row="OLD")) + refresh_statements(flight_condition.format(row="NEW")))
+        add_trigger(table, "DELETE", refresh_statements(flight_condition.format(row="OLD")))
+    return triggers
+
+
+FLIGHT_BOARD_TRIGGERS = build_triggers()
+
+
+def populate_flight_board(cursor):
+    cursor.execute("DELETE FROM FlightBoard")
+    cursor.execute(f"INSERT INTO FlightBoard ({', '.join(FLIGHT_BOARD_COLUMNS)}) {LIVE_FLIGHT_BOARD_QUERY}")
+    return cursor.rowcount
+
+
+def create_flight_board(cursor):
+    # table, triggers and the initial rows - used by db_migrations, so doesn't commit
+    cursor.execute(CREATE_FLIGHT_BOARD)
+    for trigger_name, create_trigger in FLIGHT_BOARD_TRIGGERS.items():
+        logger.debug(create_trigger)
+        cursor.execute(create_trigger)
+    board_row_count = populate_flight_board(cursor)
+    logger.info(f"FlightBoard created with {len(FLIGHT_BOARD_TRIGGERS)} triggers and {board_row_count} rows")
+
+
+def check_flight_board(DB_FILE):
+    # compares FlightBoard against the live join, returns {"missing": [...], "unexpected": [...], "different": [...]}
+    # of flight_ids - all three empty means the board is correct
+    columns = ", ".join(FLIGHT_BOARD_COLUMNS)
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        # one read transaction so both sides are compared at the same moment even with writers about
+        connection.execute("BEGIN")
+        live_only = {row[0] for row in connection.execute(
+            f"SELECT flight_id FROM ({LIVE_FLIGHT_BOARD_QUERY} EXCEPT SELECT {columns} FROM FlightBoard)")}
+        board_only = {row[0] for row in connection.execute(
+            f"SELECT flight_id FROM (SELECT {columns} FROM FlightBoard EXCEPT {LIVE_FLIGHT_BOARD_QUERY})")}
+        connection.rollback()
+    finally:
+        db_connection.release_connection(connection)
+
+    differences = {
+        "missing": sorted(live_only - board_only),
+        "unexpected": sorted(board_only - live_only),
+        "different": sorted(live_only & board_only),
+    }
+    if any(differences.values()):
+        logger.warning(f"FlightBoard is out of step with the live join - {differences}")
+    else:
+        logger.info("FlightBoard matches the live join")
+    return differences
+
+
+def rebuild_flight_board(DB_FILE):
+    # returns the number of rows on the rebuilt board
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        cursor = connection.cursor()
+        board_row_count = populate_flight_board(cursor)
+        connection.commit()
+    except sqlite3.DatabaseError:
+        connection.rollback()
+        raise
+    finally:
+        db_connection.release_connection(connection)
+    logger.info(f"FlightBoard rebuilt with {board_row_count} rows")
+    return board_row_count
+
+
+if __name__ == "__main__":
+    arguments = [argument for argument in sys.argv[1:] if argument != "--rebuild"]
+    DB_FILE = arguments[0] if arguments else "bambi.db"
+
+    if "--rebuild" in sys.argv[1:]:
+        started = time.perf_counter()
+        board_row_count = rebuild_flight_board(DB_FILE)
+        print(f"FlightBoard rebuilt with {board_row_count} rows in {time.perf_counter() - started:.3f}s")
+        sys.exit(0)
+
+    started = time.perf_counter()
+    differences = check_flight_board(DB_FILE)
+    print(f"Checked in {time.perf_counter() - started:.3f}s")
+    if not any(differences.values()):
+        print("FlightBoard matches the live join")
+        sys.exit(0)
+    for difference, flight_ids in differences.items():
+        if flight_ids:
+            print(f"{len(flight_ids)} {difference} flight(s): {', '.join(str(flight_id) for flight_id in flight_ids)}")
+    print("Run again with --rebuild to fix")
+    sys.exit(1)
@@ -0,0 +1,153 @@
+import bisect
+import logging
+import collections
+import flight_times
+
+# Time-aware double-booking checks
+# Adding a flight used to refuse any aircraft that was already on a flight at all (check_attribute_in_flight), because
+# there was no idea of when a flight actually happens. That meant one aircraft per flight, so we had to keep far more
+# aircraft and pilots in the database than a real airline would need.
+# Each flight is now treated as the time it occupies its aircraft and pilot - departure to arrival - and a new flight is
+# only refused if that overlaps one of their existing flights, so an aircraft can fly a whole day's rotation.
+#
+# The timetable repeats every day (a schedule is just a departure time), so times are looked at on a 24 hour clock -
+# a flight leaving at 22:00 and landing at 05:00 +1 also blocks 00:00-05:00 for a flight leaving at 03:00.
+# A flight of 24 hours or more blocks the whole day.
+#
+# Intervals are half-open, [departure, arrival), so a flight can leave the minute the previous one lands.
+# There's no turnaround time or check that the aircraft is actually at the origin airport, this is only about time.
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in flight_conflicts.py")
+
+MINUTES_PER_DAY = flight_times.MINUTES_PER_DAY
+
+
+def daily_segments(departure_minute, arrival_minute):
+    # a flight's minutes on the repeating 24 hour clock as a list of (start, end) with 0 <= start < end <= 1440
+    duration = arrival_minute - departure_minute
+    if duration >= MINUTES_PER_DAY:
+        return [(0, MINUTES_PER_DAY)]
+    start = departure_minute % MINUTES_PER_DAY
+    end = start + duration
+    if end <= MINUTES_PER_DAY:
+        return [(start, end)]
+    return [(start, MINUTES_PER_DAY), (0, end - MINUTES_PER_DAY)]
+
+
+def flight_segments(departure_time, arrival_time):
+    return daily_segments(flight_times.departure_minutes(departure_time), flight_times.arrival_minutes(arrival_time))
+
+
+class IntervalIndex:
+    # the busy times of one aircraft or one pilot
+    # Intervals that have been accepted never overlap each other, so sorted by start they are also sorted by end.
+    # That means the ones overlapping [start, end) are always a single run of the list, found with two bisects -
+    # everything before the first interval ending after start, and from the first starting at or after end, is clear.
+    # A check is O(log n) however many flights the aircraft or pilot has.
+    __slots__ = ("_starts", "_ends", "_owners", "_unindexed")
+
+    def __init__(self):
+        self._starts = []
+        self._ends = []
+        self._owners = []
+        # busy times that were already overlapping when they were loaded (data from before these checks, or typed
+        # into the database by hand) - kept out of the sorted lists so they don't break them, and checked one by one
+        self._unindexed = []
+
+    def __len__(self):
+        return len(self._starts) + len(self._unindexed)
+
+    def overlapping(self, start, end):
+        # owners of every interval overlapping [start, end)
+        first = bisect.bisect_right(self._ends, start)
+        last = bisect.bisect_left(self._starts, end)
+        owners = self._owners[first:last]
+        owners.extend(owner for busy_start, busy_end, owner in self._unindexed if busy_start < end and busy_end > start)
+        return owners
+
+    def add(self, start, end, owner):
+        # returns False (and keeps the interval to one side) if it overlaps something already there
+        if self.overlapping(start, end):
+            self._unindexed.append((start, end, owner))
+            return False
+        position = bisect.bisect_left(self._starts, start)
+        self._starts.insert(position, start)
+        self._ends.insert(position, end)
+        self._owners.insert(position, owner)
+        return True
+
+    def remove(self, start, end, owner):
+        # takes back an interval added earlier, used by flight_assignment when it moves a planned flight
+        position = bisect.bisect_left(self._starts, start)
+        while position < len(self._starts) and self._starts[position] == start:
+            if self._owners[position] == owner and self._ends[position] == end:
+                del self._starts[position], self._ends[position], self._owners[position]
+                return
+            position += 1
+        self._unindexed.remove((start, end, owner))
+
+
+class FlightConflictIndex:
+    # an IntervalIndex per aircraft and per pilot
+    def __init__(self):
+        self.aircraft = collections.defaultdict(IntervalIndex)
+        self.pilots = collections.defaultdict(IntervalIndex)
+
+    def find_conflicts(self, aircraft_id, pilot_id, departure_time, arrival_time):
+        # returns (owners clashing on the aircraft, owners clashing on the pilot), both empty if the flight fits
+        aircraft_conflicts = []
+        pilot_conflicts = []
+        for start, end in flight_segments(departure_time, arrival_time):
+            if aircraft_id in self.aircraft:
+                aircraft_conflicts.extend(self.aircraft[aircraft_id].overlapping(start, end))
+            if pilot_id in self.pilots:
+                pilot_conflicts.extend(self.pilots[pilot_id].overlapping(start, end))
+        # a flight wrapping past midnight can hit the same one from both ends
+        return list(dict.fromkeys(aircraft_conflicts)), list(dict.fromkeys(pilot_conflicts))
+
+    def add_flight(self, owner, aircraft_id, pilot_id, departure_time, arrival_time):
+        # owner is what gets reported back as the clash - the flight_id for stored flights
+        fits = True
+        for start, end in flight_segments(departure_time, arrival_time):
+            fits = self.aircraft[aircraft_id].add(start, end, owner) and fits
+            fits = self.pilots[pilot_id].add(start, end, owner) and fits
+        if not fits:
+            logger.warning(f"Flight {owner} was already double-booked on aircraft {aircraft_id} or pilot {pilot_id}")
+        return fits
+
+
+def load_conflict_index(cursor, flight_condition="1", values=()):
+    # builds a FlightConflictIndex from the stored flights matching flight_condition (a condition on Flight f)
+    # takes a cursor rather than DB_FILE so it can be used inside a caller's transaction
+    cursor.execute(f'''
+            SELECT f.flight_id, f.aircraft_id, f.pilot_id, s.departure_time, f.arrival_time,
+            r.route_distance, am.aircraftmodel_speed
+            FROM Flight f
+            INNER JOIN Schedule s on s.schedule_id = f.schedule_id
+            LEFT JOIN Route r on r.route_id = f.route_id
+            LEFT JOIN Aircraft a on a.aircraft_id = f.aircraft_id
+            LEFT JOIN AircraftModel am on am.aircraftmodel_id = a.aircraftmodel_id
+            WHERE {flight_condition}
+        ''', values)
+    stored_flights = cursor.fetchall()
+
+    # flights added before arrival times were always set are timed from their route and aircraft instead
+    untimed_flights = [flight for flight in stored_flights
+                       if flight[4] is None and flight[5] is not None and flight[6] and flight[6] > 0]
+    calculated_arrival_times = {}
+    if untimed_flights:
+        arrival_times = flight_times.calculate_arrival_times([flight[5] for flight in untimed_flights],
+                                                             [flight[6] for flight in untimed_flights],
+                                                             [flight[3] for flight in untimed_flights])
+        calculated_arrival_times = {flight[0]: arrival_time for flight, arrival_time in zip(untimed_flights, arrival_times)}
+
+    conflict_index = FlightConflictIndex()
+    for flight_id, aircraft_id, pilot_id, departure_time, arrival_time, _, _ in stored_flights:
+        arrival_time = arrival_time or calculated_arrival_times.get(flight_id)
+        if departure_time is None or arrival_time is None:
+            logger.warning(f"Flight {flight_id} has no departure or arrival time, left out of the conflict checks")
+            continue
+        conflict_index.add_flight(flight_id, aircraft_id, pilot_id, departure_time, arrival_time)
+    logger.debug("Loaded %d flights into the conflict index", len(stored_flights))
+    return conflict_index
@@ -0,0 +1,121 @@
+import os
+import csv
+import sys
+import json
+import time
+import logging
+import sqlite3
+import db_get
+import db_set
+
+# Loads a timetable of candidate flights from a file and creates them in bulk with db_set.add_flights
+# Accepted files -
+#   .csv  with a header row of flight_number,aircraft_id,pilot_id,route_id,schedule_id
+#   .json a list of objects with those same keys
+#   python flight_import.py timetable.csv [database file]
+#
+# Before the batch goes to add_flights the aircraft, pilot, route and schedule ids are checked with
+# db_get.get_existing_values, one query per column for the whole file. Rows that point at something that doesn't exist
+# are rejected here and only the rest are written, so a file full of typos doesn't cost a join per bad row.
+# Rejections keep the row numbers of the original file either way.
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in flight_import.py")
+
+# (candidate field, table, reason) in the same order add_flights checks them, so a row gets the same rejection either way
+REFERENCED_IDS = (
+    ("aircraft_id", "Aircraft", "aircraft does not exist"),
+    ("pilot_id", "Pilot", "pilot does not exist"),
+    ("route_id", "Route", "route does not exist"),
+    ("schedule_id", "Schedule", "schedule does not exist"),
+)
+
+
+def read_candidate_flights(file_path, fields=db_set.CANDIDATE_FLIGHT_FIELDS):
+    extension = os.path.splitext(file_path)[1].lower()
+    with open(file_path, "r", newline="") as file:
+        if extension == ".csv":
+            candidate_flights = list(csv.DictReader(file))
+        elif extension == ".json":
+            candidate_flights = json.load(file)
+        else:
+            raise ValueError(f"Unsupported timetable file type {extension} - use .csv or .json")
+
+    missing_fields = [field for field in fields if candidate_flights and field not in candidate_flights[0]]
+    if missing_fields:
+        raise ValueError(f"Timetable file is missing columns: {', '.join(missing_fields)}")
+    logger.info(f"Read {len(candidate_flights)} candidate flights from {file_path}")
+    return candidate_flights
+
+
+def parse_id(value):
+    # ids read from a csv file are strings, anything that isn't a whole number just won't be found
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def check_referenced_ids(DB_FILE, candidate_flights):
+    # returns ([(row number, candidate flight)] for rows whose ids all exist, [(row number, candidate flight, reason)])
+    rows = []
+    for row_number, candidate_flight in enumerate(candidate_flights, start=1):
+        if not isinstance(candidate_flight, dict):
+            candidate_flight = dict(zip(db_set.CANDIDATE_FLIGHT_FIELDS, candidate_flight))
+        rows.append((row_number, candidate_flight))
+
+    existing_ids = {}
+    for field, table, _ in REFERENCED_IDS:
+        ids = {parse_id(candidate_flight.get(field)) for _, candidate_flight in rows} - {None}
+        existing_ids[field] = db_get.get_existing_values(DB_FILE, table, field, ids)
+
+    checked_flights = []
+    rejections = []
+    for row_number, candidate_flight in rows:
+        reason = next((reason for field, _, reason in REFERENCED_IDS
+                       if parse_id(candidate_flight.get(field)) not in existing_ids[field]), None)
+        if reason is None:
+            checked_flights.append((row_number, candidate_flight))
+        else:
+            rejections.append((row_number, candidate_flight, reason))
+    return checked_flights, rejections
+
+
+def import_flights(DB_FILE, file_path):
+    # returns the same (inserted count, rejections) as db_set.add_flights, or False on a database error
+    candidate_flights = read_candidate_flights(file_path)
+    started = time.perf_counter()
+    try:
+        checked_flights, rejections = check_referenced_ids(DB_FILE, candidate_flights)
+    except sqlite3.DatabaseError as dbe:
+        logger.error(f"Database error {dbe}")
+        return False
+    result = db_set.add_flights(DB_FILE, [candidate_flight for _, candidate_flight in checked_flights])
+    logger.info(f"Imported {file_path} in {time.perf_counter() - started:.3f}s")
+    if result is False:
+        return False
+
+    inserted_flight_count, write_rejections = result
+    # add_flights numbers the rows it was given from 1, map those back to the rows of the file
+    for row_number, candidate_flight, reason in write_rejections:
+        rejections.append((checked_flights[row_number - 1][0], candidate_flight, reason))
+    rejections.sort(key=lambda rejection: rejection[0])
+    return inserted_flight_count, rejections
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python flight_import.py <timetable.csv|timetable.json> [database file]")
+        sys.exit(1)
+
+    timetable_file = sys.argv[1]
+    DB_FILE = sys.argv[2] if len(sys.argv) > 2 else "bambi.db"
+    result = import_flights(DB_FILE, timetable_file)
+    if result is False:
+        print("Error importing flights, please check the log")
+        sys.exit(1)
+
+    inserted_flight_count, rejections = result
+    print(f"{inserted_flight_count} flights added, {len(rejections)} rejected")
+    for row_number, candidate_flight, rejection in rejections:
+        print(f"Row {row_number} ({candidate_flight['flight_number']}) - {rejection}")
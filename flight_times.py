@@ -0,0 +1,87 @@
+import sys
+import math
+import time
+import logging
+import utils
+
+# Arrival time maths for whole batches of flights
+# calculate_flight_time in bambi.py works on one flight at a time with strptime/timedelta/strftime, which is fine for
+# the (F) add flight screen but far too slow for recalculating thousands of stored flights. The rule is the same -
+#   flight time = distance / speed, rounded up to the whole hour
+#   arrival     = departure + flight time, as "HH:MM" with " +N" added when it lands N days later
+# but here it's done as plain minute arithmetic over whole lists, using numpy arrays when numpy is installed.
+#   arrival_times = flight_times.calculate_arrival_times([3460, 5570], [830, 900], ["09:00", "22:00"])
+#   ['14:00', '05:00 +1']
+#
+# Run this file to recalculate every stored arrival time, e.g. after editing routes or aircraft models by hand -
+#   python flight_times.py [database file]
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in flight_times.py")
+
+NUMPY_AVAILABLE = utils.check_numpy()
+if NUMPY_AVAILABLE:
+    import numpy
+logger.info(f"numpy available for arrival time calculation: {NUMPY_AVAILABLE}")
+
+MINUTES_PER_DAY = 24 * 60
+
+# every "HH:MM" label in a day, indexed by minute of the day, so formatting is a list lookup rather than strftime
+TIME_LABELS = [f"{minute // 60:02d}:{minute % 60:02d}" for minute in range(MINUTES_PER_DAY)]
+
+
+def departure_minutes(departure_time):
+    # "HH:MM" to minutes after midnight - raises ValueError on anything calculate_flight_time's strptime would reject
+    hours, minutes = departure_time.split(":")
+    hours, minutes = int(hours), int(minutes)
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Invalid departure time {departure_time}")
+    return hours * 60 + minutes
+
+
+def format_arrival_time(arrival_minutes):
+    # minutes after midnight on the day of departure to "HH:MM" or "HH:MM +N"
+    day_difference, minute_of_day = divmod(arrival_minutes, MINUTES_PER_DAY)
+    if day_difference > 0:
+        return f"{TIME_LABELS[minute_of_day]} +{day_difference}"
+    return TIME_LABELS[minute_of_day]
+
+
+def arrival_minutes(arrival_time):
+    # the other way round to format_arrival_time - "05:00 +1" to 1740
+    arrival_time, _, day_difference = arrival_time.partition(" +")
+    return departure_minutes(arrival_time) + int(day_difference or 0) * MINUTES_PER_DAY
+
+
+def calculate_arrival_times(route_distances, aircraft_speeds, departure_times):
+    # three equal length sequences in, a list of arrival time strings out in the same order
+    # there are only a couple of dozen schedules, so each distinct departure string is only parsed once
+    parsed_departures = {}
+    departures = []
+    for departure_time in departure_times:
+        if departure_time not in parsed_departures:
+            parsed_departures[departure_time] = departure_minutes(departure_time)
+        departures.append(parsed_departures[departure_time])
+
+    if NUMPY_AVAILABLE:
+        distances = numpy.asarray(route_distances, dtype=numpy.float64)
+        speeds = numpy.asarray(aircraft_speeds, dtype=numpy.float64)
+        flight_hours = numpy.ceil(distances / speeds).astype(numpy.int64)
+        arrival_minutes = (numpy.asarray(departures, dtype=numpy.int64) + flight_hours * 60).tolist()
+    else:
+        arrival_minutes = [departure + math.ceil(distance / speed) * 60
+                           for distance, speed, departure in zip(route_distances, aircraft_speeds, departures)]
+
+    return [format_arrival_time(minutes) for minutes in arrival_minutes]
+
+
+if __name__ == "__main__":
+    import db_set
+
+    DB_FILE = sys.argv[1] if len(sys.argv) > 1 else "bambi.db"
+    started = time.perf_counter()
+    updated_flight_count = db_set.recalculate_arrival_times(DB_FILE)
+    if updated_flight_count is False:
+        print("Error recalculating arrival times, please check the log")
+        sys.exit(1)
+    print(f"{updated_flight_count} arrival times corrected in {time.perf_counter() - started:.3f}s")
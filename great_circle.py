@@ -0,0 +1,210 @@
+import sys
+import csv
+import math
+import time
+import logging
+import utils
+import db_connection
+import db_set
+
+# Great-circle distances from airport coordinates
+# Route distances used to be typed in by hand on the (T) add route screen and nothing ever checked them. Airports now
+# carry a latitude and longitude (migration 4) so the distance between any two can be worked out with the haversine
+# formula - the shortest distance over the surface of the earth, treated as a sphere. That's used to
+#   - suggest the distance when adding a route
+#   - audit the distances already stored against what they ought to be (audit_route_distances)
+#   - build the full airport to airport distance matrix in one go (airport_distance_matrix)
+# The maths works on whole arrays at once, with numpy when it's installed (the same optional check as flight_times)
+# and plain python lists otherwise.
+#
+#   python great_circle.py audit [database file]                      - lists routes whose distance looks wrong
+#   python great_circle.py matrix [database file]                     - times building the full distance matrix
+#   python great_circle.py coordinates airports.csv [database file]   - loads airport_code,latitude,longitude rows
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in great_circle.py")
+
+NUMPY_AVAILABLE = utils.check_numpy()
+if NUMPY_AVAILABLE:
+    import numpy
+
+# mean radius of the earth
+EARTH_RADIUS_KM = 6371.0088
+
+# a stored route distance more than this fraction away from the great-circle distance is reported by the audit
+# real flown distances are a little longer than great-circle ones, so this is deliberately not tight
+ROUTE_DISTANCE_TOLERANCE = 0.15
+
+# the airports in the baseline seed data, so a new database has coordinates from the start
+BASELINE_AIRPORT_COORDINATES = {
+    "LHR": (51.4700, -0.4543),
+    "LGW": (51.1537, -0.1821),
+    "NCL": (55.0375, -1.6917),
+    "CDG": (49.0097, 2.5479),
+    "CTC": (-33.9715, 18.6021),
+    "LGA": (40.7769, -73.8740),
+    "JFK": (40.6413, -73.7781),
+    "SIN": (1.3644, 103.9915),
+}
+
+
+def pair_distances(origin_latitudes, origin_longitudes, destination_latitudes, destination_longitudes):
+    # great-circle distance in km between each origin and the destination in the same position, as a list
+    if NUMPY_AVAILABLE:
+        origin_latitudes = numpy.radians(numpy.asarray(origin_latitudes, dtype=numpy.float64))
+        origin_longitudes = numpy.radians(numpy.asarray(origin_longitudes, dtype=numpy.float64))
+        destination_latitudes = numpy.radians(numpy.asarray(destination_latitudes, dtype=numpy.float64))
+        destination_longitudes = numpy.radians(numpy.asarray(destination_longitudes, dtype=numpy.float64))
+        haversine = (numpy.sin((destination_latitudes - origin_latitudes) / 2) ** 2
+                     + numpy.cos(origin_latitudes) * numpy.cos(destination_latitudes)
+                     * numpy.sin((destination_longitudes - origin_longitudes) / 2) ** 2)
+        return (2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(haversine, 1.0)))).tolist()
+
+    distances = []
+    for origin_latitude, origin_longitude, destination_latitude, destination_longitude in zip(
+            origin_latitudes, origin_longitudes, destination_latitudes, destination_longitudes):
+        origin_latitude, destination_latitude = math.radians(origin_latitude), math.radians(destination_latitude)
+        haversine = (math.sin((destination_latitude - origin_latitude) / 2) ** 2
+                     + math.cos(origin_latitude) * math.cos(destination_latitude)
+                     * math.sin(math.radians(destination_longitude - origin_longitude) / 2) ** 2)
+        distances.append(2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(haversine, 1.0))))
+    return distances
+
+
+def distance_matrix(latitudes, longitudes):
+    # every airport to every other - an n x n numpy array, or a list of n lists without numpy
+    if NUMPY_AVAILABLE:
+        latitudes = numpy.radians(numpy.asarray(latitudes, dtype=numpy.float64))
+        longitudes = numpy.radians(numpy.asarray(longitudes, dtype=numpy.float64))
+        # broadcasting a column against a row does all n x n pairs in one go
+        haversine = (numpy.sin((latitudes[None, :] - latitudes[:, None]) / 2) ** 2
+                     + numpy.cos(latitudes[:, None]) * numpy.cos(latitudes[None, :])
+                     * numpy.sin((longitudes[None, :] - longitudes[:, None]) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * numpy.arcsin(numpy.sqrt(numpy.minimum(haversine, 1.0)))
+
+    # sines and cosines worked out once per airport rather than once per pair, and only the upper triangle is
+    # calculated since the distance from a to b is the distance from b to a
+    latitudes = [math.radians(latitude) for latitude in latitudes]
+    longitudes = [math.radians(longitude) for longitude in longitudes]
+    cos_latitudes = [math.cos(latitude) for latitude in latitudes]
+    airport_count = len(latitudes)
+    matrix = [[0.0] * airport_count for _ in range(airport_count)]
+    diameter = 2 * EARTH_RADIUS_KM
+    sin, sqrt, asin = math.sin, math.sqrt, math.asin
+    for row in range(airport_count):
+        latitude, longitude, cos_latitude = latitudes[row], longitudes[row], cos_latitudes[row]
+        matrix_row = matrix[row]
+        for column in range(row + 1, airport_count):
+            haversine = (sin((latitudes[column] - latitude) / 2) ** 2
+                         + cos_latitude * cos_latitudes[column] * sin((longitudes[column] - longitude) / 2) ** 2)
+            distance = diameter * asin(sqrt(min(haversine, 1.0)))
+            matrix_row[column] = distance
+            matrix[column][row] = distance
+    return matrix
+
+
+def get_airport_coordinates(DB_FILE, airport_ids=None):
+    # {airport_id: (airport_code, latitude, longitude)} for every airport that has coordinates, or just the
+    # airport_ids given
+    condition, values = "", ()
+    if airport_ids is not None:
+        values = tuple(airport_ids)
+        condition = f"AND airport_id IN ({', '.join('?' * len(values))})"
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        rows = connection.execute(f'''
+                SELECT airport_id, airport_code, latitude, longitude
+                FROM Airport
+                WHERE latitude IS NOT NULL AND longitude IS NOT NULL {condition}
+                ORDER BY airport_id
+            ''', values).fetchall()
+    finally:
+        db_connection.release_connection(connection)
+    return {airport_id: (airport_code, latitude, longitude) for airport_id, airport_code, latitude, longitude in rows}
+
+
+def suggest_route_distance(DB_FILE, origin_airport_id, destination_airport_id):
+    # whole km between two airports, or None if either one has no coordinates yet
+    # only the two airports are read - this runs every time a route is added
+    airport_coordinates = get_airport_coordinates(DB_FILE, (origin_airport_id, destination_airport_id))
+    if origin_airport_id not in airport_coordinates or destination_airport_id not in airport_coordinates:
+        return None
+    _, origin_latitude, origin_longitude = airport_coordinates[origin_airport_id]
+    _, destination_latitude, destination_longitude = airport_coordinates[destination_airport_id]
+    return round(pair_distances([origin_latitude], [origin_longitude], [destination_latitude], [destination_longitude])[0])
+
+
+def audit_route_distances(DB_FILE, tolerance=ROUTE_DISTANCE_TOLERANCE):
+    # returns [(route_id, origin code, destination code, stored km, great-circle km)] for every route whose stored
+    # distance is more than tolerance away from the great-circle distance - routes without coordinates are skipped
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        routes = connection.execute('''
+                SELECT r.route_id, ao.airport_code, ad.airport_code, r.route_distance,
+                ao.latitude, ao.longitude, ad.latitude, ad.longitude
+                FROM Route r
+                INNER JOIN CityAirport cao on r.origin_cityairport_id = cao.cityairport_id
+                INNER JOIN Airport ao on cao.airport_id = ao.airport_id
+                INNER JOIN CityAirport cad on r.destination_cityairport_id = cad.cityairport_id
+                INNER JOIN Airport ad on cad.airport_id = ad.airport_id
+                WHERE ao.latitude IS NOT NULL AND ad.latitude IS NOT NULL
+                ORDER BY r.route_id
+            ''').fetchall()
+    finally:
+        db_connection.release_connection(connection)
+    if not routes:
+        return []
+
+    _, _, _, stored_distances, *coordinates = zip(*routes)
+    great_circle_distances = pair_distances(*coordinates)
+    suspect_routes = []
+    for route, stored_distance, great_circle_distance in zip(routes, stored_distances, great_circle_distances):
+        if stored_distance is None or abs(stored_distance - great_circle_distance) > tolerance * great_circle_distance:
+            suspect_routes.append((route[0], route[1], route[2], stored_distance, round(great_circle_distance)))
+    logger.info(f"Route distance audit - {len(suspect_routes)} of {len(routes)} routes outside {tolerance:.0%}")
+    return suspect_routes
+
+
+def airport_distance_matrix(DB_FILE):
+    # (airport codes, matrix) with matrix[i][j] the distance from the i'th airport to the j'th
+    airport_coordinates = get_airport_coordinates(DB_FILE)
+    airport_codes = [airport_code for airport_code, _, _ in airport_coordinates.values()]
+    latitudes = [latitude for _, latitude, _ in airport_coordinates.values()]
+    longitudes = [longitude for _, _, longitude in airport_coordinates.values()]
+    return airport_codes, distance_matrix(latitudes, longitudes)
+
+
+def load_airport_coordinates(DB_FILE, file_path):
+    # reads airport_code,latitude,longitude rows from a csv file - returns the number of airports updated
+    with open(file_path, "r", newline="") as file:
+        coordinates = [(row["airport_code"], float(row["latitude"]), float(row["longitude"])) for row in csv.DictReader(file)]
+    return db_set.set_airport_coordinates(DB_FILE, coordinates)
+
+
+if __name__ == "__main__":
+    commands = ("audit", "matrix", "coordinates")
+    if len(sys.argv) < 2 or sys.argv[1] not in commands or (sys.argv[1] == "coordinates" and len(sys.argv) < 3):
+        print("Usage: python great_circle.py audit|matrix [database file]")
+        print("       python great_circle.py coordinates <airports.csv> [database file]")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    if command == "coordinates":
+        DB_FILE = sys.argv[3] if len(sys.argv) > 3 else "bambi.db"
+        updated_airport_count = load_airport_coordinates(DB_FILE, sys.argv[2])
+        if updated_airport_count is False:
+            print("Error loading coordinates, please check the log")
+            sys.exit(1)
+        print(f"Coordinates set for {updated_airport_count} airports")
+    elif command == "audit":
+        DB_FILE = sys.argv[2] if len(sys.argv) > 2 else "bambi.db"
+        suspect_routes = audit_route_distances(DB_FILE)
+        print(f"{len(suspect_routes)} route(s) more than {ROUTE_DISTANCE_TOLERANCE:.0%} away from the great-circle distance")
+        for route_id, origin_airport_code, destination_airport_code, stored_distance, great_circle_distance in suspect_routes:
+            print(f"Route {route_id} {origin_airport_code} > {destination_airport_code} - stored {stored_distance}km, great-circle {great_circle_distance}km")
+    else:
+        DB_FILE = sys.argv[2] if len(sys.argv) > 2 else "bambi.db"
+        started = time.perf_counter()
+        airport_codes, matrix = airport_distance_matrix(DB_FILE)
+        print(f"{len(airport_codes)} x {len(airport_codes)} distance matrix ({'numpy' if NUMPY_AVAILABLE else 'plain python'}) "
+              f"built in {time.perf_counter() - started:.3f}s")
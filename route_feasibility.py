@@ -0,0 +1,242 @@
+import sys
+import time
+import bisect
+import logging
+import threading
+import collections
+import db_connection
+import db_cache
+import db_get
+
+# Aircraft model / route feasibility index
+# An aircraft can only fly a route if its model's range is at least 110% of the route distance (db_get.RANGE_MARGIN).
+# That used to be worked out one aircraft and one route at a time while building a flight, so asking "what can fly
+# route 12" or "which routes can our fleet cover" meant a join per question.
+#
+# Because the rule is a single threshold, both directions are answered by bisecting two sorted lists -
+#   models sorted by range                   - every model at or after the route's required range can fly it
+#   routes sorted by required range          - every route at or before the model's range is within reach
+# so a lookup is O(log n) plus the size of the answer, and there's no models x routes table to keep in step.
+#
+# Like the route graph the index is cached per database. Routes are updated in place by db_set (add_route,
+# delete_route and update_route_distance call route_added/route_deleted/route_distance_changed), as are aircraft
+# (add_aircraft and delete_aircraft). Aircraft model changes go through db_cache, which throws the index away.
+#
+#   python route_feasibility.py route <route_id> [database file]   - the models and aircraft that can fly a route
+#   python route_feasibility.py model <model_id> [database file]   - the routes a model can fly
+#   python route_feasibility.py fleet [database file]              - the routes the whole fleet can and can't cover
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in route_feasibility.py")
+
+
+class FeasibilityIndex:
+    def __init__(self, aircraftmodels, routes, aircraft):
+        # aircraftmodels - (aircraftmodel_id, range), routes - (route_id, distance), aircraft - (aircraft_id, aircraftmodel_id)
+        self.model_ranges = {}
+        self._sorted_models = []     # (range, aircraftmodel_id)
+        for aircraftmodel_id, aircraftmodel_range in aircraftmodels:
+            if aircraftmodel_range is None:
+                logger.warning(f"Aircraft model {aircraftmodel_id} has no range, left out of the feasibility index")
+                continue
+            self.model_ranges[aircraftmodel_id] = aircraftmodel_range
+            self._sorted_models.append((aircraftmodel_range, aircraftmodel_id))
+        self._sorted_models.sort()
+        self._model_range_keys = [aircraftmodel_range for aircraftmodel_range, _ in self._sorted_models]
+
+        self.route_requirements = {}
+        self._sorted_routes = []     # (required range, route_id)
+        for route_id, route_distance in routes:
+            if route_distance is not None:
+                self.route_requirements[route_id] = db_get.RANGE_MARGIN * route_distance
+                self._sorted_routes.append((self.route_requirements[route_id], route_id))
+        self._sorted_routes.sort()
+
+        self.model_aircraft = collections.defaultdict(dict)   # aircraftmodel_id: {aircraft_id: None}, kept in id order
+        self.aircraft_models = {}
+        for aircraft_id, aircraftmodel_id in aircraft:
+            self.add_aircraft(aircraft_id, aircraftmodel_id)
+        self.built_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add_route(self, route_id, route_distance):
+        self.remove_route(route_id)
+        if route_distance is None:
+            return
+        required_range = db_get.RANGE_MARGIN * route_distance
+        self.route_requirements[route_id] = required_range
+        bisect.insort(self._sorted_routes, (required_range, route_id))
+
+    def remove_route(self, route_id):
+        required_range = self.route_requirements.pop(route_id, None)
+        if required_range is not None:
+            del self._sorted_routes[bisect.bisect_left(self._sorted_routes, (required_range, route_id))]
+
+    def add_aircraft(self, aircraft_id, aircraftmodel_id):
+        self.remove_aircraft(aircraft_id)
+        self.aircraft_models[aircraft_id] = aircraftmodel_id
+        self.model_aircraft[aircraftmodel_id][aircraft_id] = None
+
+    def remove_aircraft(self, aircraft_id):
+        aircraftmodel_id = self.aircraft_models.pop(aircraft_id, None)
+        if aircraftmodel_id is not None:
+            del self.model_aircraft[aircraftmodel_id][aircraft_id]
+
+    def can_fly(self, aircraftmodel_id, route_id):
+        if aircraftmodel_id not in self.model_ranges or route_id not in self.route_requirements:
+            return False
+        return self.model_ranges[aircraftmodel_id] >= self.route_requirements[route_id]
+
+    def routes_within(self, aircraftmodel_range):
+        # route_ids whose required range is no more than aircraftmodel_range, shortest first
+        last = bisect.bisect_right(self._sorted_routes, (aircraftmodel_range, float("inf")))
+        return [route_id for _, route_id in self._sorted_routes[:last]]
+
+    def models_for_route(self, route_id):
+        # aircraftmodel_ids that can fly the route, shortest range first
+        if route_id not in self.route_requirements:
+            return []
+        first = bisect.bisect_left(self._model_range_keys, self.route_requirements[route_id])
+        return [aircraftmodel_id for _, aircraftmodel_id in self._sorted_models[first:]]
+
+    def routes_for_model(self, aircraftmodel_id):
+        if aircraftmodel_id not in self.model_ranges:
+            return []
+        return self.routes_within(self.model_ranges[aircraftmodel_id])
+
+    def aircraft_for_route(self, route_id):
+        # shortest range model first, like models_for_route, then by aircraft_id
+        return [aircraft_id for aircraftmodel_id in self.models_for_route(route_id)
+                for aircraft_id in self.model_aircraft.get(aircraftmodel_id, ())]
+
+    def routes_for_fleet(self, aircraft_ids=None):
+        # every route at least one of the aircraft (the whole fleet when None) can fly - the longest range decides it
+        if aircraft_ids is None:
+            aircraft_ids = self.aircraft_models
+        fleet_ranges = [self.model_ranges[self.aircraft_models[aircraft_id]] for aircraft_id in aircraft_ids
+                        if self.aircraft_models.get(aircraft_id) in self.model_ranges]
+        return self.routes_within(max(fleet_ranges)) if fleet_ranges else []
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def build_feasibility_index(DB_FILE):
+    started = time.perf_counter()
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        cursor = connection.cursor()
+        aircraftmodels = cursor.execute("SELECT aircraftmodel_id, aircraftmodel_range FROM AircraftModel").fetchall()
+        routes = cursor.execute("SELECT route_id, route_distance FROM Route").fetchall()
+        aircraft = cursor.execute("SELECT aircraft_id, aircraftmodel_id FROM Aircraft ORDER BY aircraft_id").fetchall()
+    finally:
+        db_connection.release_connection(connection)
+    feasibility_index = FeasibilityIndex(aircraftmodels, routes, aircraft)
+    logger.info(f"Feasibility index built with {len(feasibility_index.model_ranges)} models, "
+                f"{len(feasibility_index.route_requirements)} routes and {len(feasibility_index.aircraft_models)} aircraft "
+                f"in {time.perf_counter() - started:.3f}s")
+    return feasibility_index
+
+
+def get_feasibility_index(DB_FILE):
+    with _indexes_lock:
+        feasibility_index = _indexes.get(DB_FILE)
+        if feasibility_index is None or time.monotonic() - feasibility_index.built_at > db_cache.MAX_AGE_SECONDS:
+            feasibility_index = _indexes[DB_FILE] = build_feasibility_index(DB_FILE)
+        return feasibility_index
+
+
+def invalidate(DB_FILE):
+    with _indexes_lock:
+        _indexes.pop(DB_FILE, None)
+
+
+def _reference_tables_changed(DB_FILE, tables):
+    if "AircraftModel" in tables:
+        invalidate(DB_FILE)
+
+
+db_cache.add_invalidation_listener(_reference_tables_changed)
+
+
+# called by db_set once a change has been committed - only touches an index that has already been built
+def _update(DB_FILE, update, *args):
+    feasibility_index = _indexes.get(DB_FILE)
+    if feasibility_index is not None:
+        with feasibility_index.lock:
+            update(feasibility_index, *args)
+
+
+def route_added(DB_FILE, route_id, route_distance):
+    _update(DB_FILE, FeasibilityIndex.add_route, route_id, route_distance)
+
+
+def route_deleted(DB_FILE, route_id):
+    _update(DB_FILE, FeasibilityIndex.remove_route, route_id)
+
+
+def route_distance_changed(DB_FILE, route_id, route_distance):
+    _update(DB_FILE, FeasibilityIndex.add_route, route_id, route_distance)
+
+
+def aircraft_added(DB_FILE, aircraft_id, aircraftmodel_id):
+    # the menus pass the model id on as it was typed - SQLite stores "3" as 3, so file it the same way a rebuilt
+    # index would or aircraft_for_route never finds it
+    try:
+        aircraftmodel_id = int(aircraftmodel_id)
+    except (TypeError, ValueError):
+        pass
+    _update(DB_FILE, FeasibilityIndex.add_aircraft, aircraft_id, aircraftmodel_id)
+
+
+def aircraft_deleted(DB_FILE, aircraft_id):
+    _update(DB_FILE, FeasibilityIndex.remove_aircraft, aircraft_id)
+
+
+def _lookup(DB_FILE, method, *args):
+    feasibility_index = get_feasibility_index(DB_FILE)
+    with feasibility_index.lock:
+        return method(feasibility_index, *args)
+
+
+def can_fly(DB_FILE, aircraftmodel_id, route_id):
+    return _lookup(DB_FILE, FeasibilityIndex.can_fly, aircraftmodel_id, route_id)
+
+
+def models_for_route(DB_FILE, route_id):
+    return _lookup(DB_FILE, FeasibilityIndex.models_for_route, route_id)
+
+
+def routes_for_model(DB_FILE, aircraftmodel_id):
+    return _lookup(DB_FILE, FeasibilityIndex.routes_for_model, aircraftmodel_id)
+
+
+def aircraft_for_route(DB_FILE, route_id):
+    return _lookup(DB_FILE, FeasibilityIndex.aircraft_for_route, route_id)
+
+
+def routes_for_fleet(DB_FILE, aircraft_ids=None):
+    return _lookup(DB_FILE, FeasibilityIndex.routes_for_fleet, aircraft_ids)
+
+
+if __name__ == "__main__":
+    commands = {"route": 3, "model": 3, "fleet": 2}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands or len(sys.argv) < commands[sys.argv[1]]:
+        print("Usage: python route_feasibility.py route <route_id>|model <model_id>|fleet [database file]")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    DB_FILE = sys.argv[commands[command]] if len(sys.argv) > commands[command] else "bambi.db"
+    if command == "route":
+        route_id = int(sys.argv[2])
+        print(f"Models that can fly route {route_id}: {models_for_route(DB_FILE, route_id)}")
+        print(f"Aircraft that can fly route {route_id}: {aircraft_for_route(DB_FILE, route_id)}")
+    elif command == "model":
+        aircraftmodel_id = int(sys.argv[2])
+        print(f"Routes model {aircraftmodel_id} can fly: {routes_for_model(DB_FILE, aircraftmodel_id)}")
+    else:
+        covered_route_ids = routes_for_fleet(DB_FILE)
+        uncovered_route_ids = sorted(set(get_feasibility_index(DB_FILE).route_requirements) - set(covered_route_ids))
+        print(f"The fleet can cover {len(covered_route_ids)} routes")
+        print(f"Routes no aircraft has the range for: {uncovered_route_ids}")
@@ -0,0 +1,250 @@
+import time
+import heapq
+import logging
+import threading
+import collections
+import db_connection
+import db_cache
+
+# Route network graph
+# The Route table can only tell us whether a direct route exists (db_get.check_existing_route). To answer "how do
+# I get from Leeds to Sydney" the routes have to be treated as a graph, and doing that with a SQL query per hop is far
+# too slow to use from the menus. RouteGraph is an in-memory adjacency list built once from Route, CityAirport,
+# City and Airport -
+#   nodes are CityAirport rows (an airport in a city), edges are routes from origin to destination (routes are one-way)
+#
+# The graph is cached per database and kept up to date in place - db_set.add_route, delete_route and
+# update_route_distance call route_added/route_deleted/route_distance_changed after they commit, so adding a route
+# doesn't mean rebuilding the whole graph. Writes to City, Airport or CityAirport (which change the names and codes
+# on the nodes) throw the cached graph away through db_cache, and like the reference cache it's also rebuilt after
+# db_cache.MAX_AGE_SECONDS to pick up other BAMBI processes' changes.
+#
+# Searches return itineraries, shortest first -
+#   route_graph.find_city_itineraries(DB_FILE, origin_city_id, destination_city_id, k=3, by="distance")
+#   route_graph.find_airport_itineraries(DB_FILE, "LHR", "SYD", by="legs")
+# by="distance" is the shortest total distance (fewest legs breaks ties), by="legs" the fewest legs (shortest total
+# distance breaks ties). k > 1 uses Yen's algorithm for the k shortest itineraries that never visit an airport twice.
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in route_graph.py")
+
+SEARCH_ORDERS = ("distance", "legs")
+
+# Virtual start and end nodes, joined to every origin and destination airport, let one search cover every airport
+# in a city at each end
+START = "start"
+END = "end"
+NO_COST = (0, 0)
+
+
+class RouteGraph:
+    def __init__(self, cityairports, routes):
+        # cityairports - (cityairport_id, city_id, city_name, airport_code), routes - (route_id, origin, destination, distance)
+        self.cityairports = {}
+        self.city_nodes = collections.defaultdict(set)
+        self.airport_code_nodes = collections.defaultdict(set)
+        for cityairport_id, city_id, city_name, airport_code in cityairports:
+            self.cityairports[cityairport_id] = (city_id, city_name, airport_code)
+            self.city_nodes[city_id].add(cityairport_id)
+            self.airport_code_nodes[airport_code].add(cityairport_id)
+
+        self.routes = {}
+        self.adjacency = collections.defaultdict(dict)  # origin: {route_id: (destination, distance)}
+        for route_id, origin, destination, distance in routes:
+            self.add_route(route_id, origin, destination, distance)
+        self.built_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def add_route(self, route_id, origin, destination, distance):
+        if distance is None:
+            logger.warning(f"Route {route_id} has no distance, left out of the route graph")
+            return
+        self.routes[route_id] = (origin, destination, distance)
+        self.adjacency[origin][route_id] = (destination, distance)
+
+    def remove_route(self, route_id):
+        if route_id in self.routes:
+            origin, _, _ = self.routes.pop(route_id)
+            del self.adjacency[origin][route_id]
+
+    def edges(self, node, origins, destinations, by):
+        # (edge, next node, cost) leaving node - cost is (distance, legs) or (legs, distance) so tuples sort by order
+        if node == START:
+            for origin in origins:
+                yield (START, origin), origin, NO_COST
+            return
+        for route_id, (destination, distance) in self.adjacency.get(node, {}).items():
+            yield route_id, destination, (distance, 1) if by == "distance" else (1, distance)
+        if node in destinations:
+            yield (node, END), END, NO_COST
+
+    def shortest_path(self, start, origins, destinations, by, removed_edges=(), removed_nodes=()):
+        # Dijkstra from start to END - returns (cost, [nodes], [edges]) or None
+        best_costs = {start: NO_COST}
+        previous = {}
+        queue = [(NO_COST, 0, start)]
+        pushed = 1  # tie-breaker so the heap never has to compare node ids of different types
+        while queue:
+            cost, _, node = heapq.heappop(queue)
+            if node == END:
+                nodes, edges = [END], []
+                while node != start:
+                    node, edge = previous[node]
+                    nodes.append(node)
+                    edges.append(edge)
+                return cost, nodes[::-1], edges[::-1]
+            if cost > best_costs.get(node, cost):
+                continue
+            for edge, next_node, edge_cost in self.edges(node, origins, destinations, by):
+                if edge in removed_edges or next_node in removed_nodes:
+                    continue
+                next_cost = (cost[0] + edge_cost[0], cost[1] + edge_cost[1])
+                if next_node not in best_costs or next_cost < best_costs[next_node]:
+                    best_costs[next_node] = next_cost
+                    previous[next_node] = (node, edge)
+                    heapq.heappush(queue, (next_cost, pushed, next_node))
+                    pushed += 1
+        return None
+
+    def edge_cost(self, edge, by):
+        if edge in self.routes:
+            distance = self.routes[edge][2]
+            return (distance, 1) if by == "distance" else (1, distance)
+        return NO_COST
+
+    def k_shortest_paths(self, origins, destinations, k, by):
+        # Yen's algorithm - each next path branches off one already found at a "spur" node, with the edges the
+        # earlier paths took from that point and the nodes before it removed so nothing is found twice or loops
+        first_path = self.shortest_path(START, origins, destinations, by)
+        if first_path is None:
+            return []
+        found_paths = [first_path]
+        candidates = []
+        seen_edges = {tuple(first_path[2])}
+        pushed = 0
+        while len(found_paths) < k:
+            _, last_nodes, last_edges = found_paths[-1]
+            for spur_index in range(len(last_nodes) - 1):
+                spur_node = last_nodes[spur_index]
+                root_nodes, root_edges = last_nodes[:spur_index + 1], last_edges[:spur_index]
+                # compared by edges, not nodes - with two routes between the same airports the same nodes can be
+                # reached by a different root, and that path's next edge is still open from this one
+                removed_edges = {edges[spur_index] for _, _, edges in found_paths if edges[:spur_index] == root_edges}
+                spur_path = self.shortest_path(spur_node, origins, destinations, by, removed_edges, set(root_nodes[:-1]))
+                if spur_path is None:
+                    continue
+                edges = root_edges + spur_path[2]
+                if tuple(edges) in seen_edges:
+                    continue
+                seen_edges.add(tuple(edges))
+                root_cost = (sum(self.edge_cost(edge, by)[0] for edge in root_edges), sum(self.edge_cost(edge, by)[1] for edge in root_edges))
+                cost = (root_cost[0] + spur_path[0][0], root_cost[1] + spur_path[0][1])
+                heapq.heappush(candidates, (cost, pushed, root_nodes + spur_path[1][1:], edges))
+                pushed += 1
+            if not candidates:
+                break
+            cost, _, nodes, edges = heapq.heappop(candidates)
+            found_paths.append((cost, nodes, edges))
+        return found_paths
+
+    def find_itineraries(self, origins, destinations, k=1, by="distance"):
+        if by not in SEARCH_ORDERS:
+            raise ValueError(f"Itineraries can be ordered by {' or '.join(SEARCH_ORDERS)}, not {by}")
+        # an airport is never its own destination, but another airport in the same city can be
+        origins = set(origins)
+        destinations = set(destinations) - origins
+        with self.lock:
+            paths = self.k_shortest_paths(origins, destinations, k, by)
+            itineraries = []
+            for _, nodes, edges in paths:
+                route_ids = [edge for edge in edges if edge in self.routes]
+                itineraries.append({
+                    "route_ids": route_ids,
+                    "airports": [self.cityairports.get(node, (None, None, None))[2] for node in nodes[1:-1]],
+                    "cities": [self.cityairports.get(node, (None, None, None))[1] for node in nodes[1:-1]],
+                    "distance": sum(self.routes[route_id][2] for route_id in route_ids),
+                    "legs": len(route_ids),
+                })
+            return itineraries
+
+
+_graphs = {}
+_graphs_lock = threading.Lock()
+
+
+def build_route_graph(DB_FILE):
+    started = time.perf_counter()
+    connection = db_connection.get_connection(DB_FILE)
+    try:
+        cursor = connection.cursor()
+        cursor.execute('''
+                SELECT ca.cityairport_id, ca.city_id, c.city_name, a.airport_code
+                FROM CityAirport ca
+                LEFT JOIN City c on c.city_id = ca.city_id
+                LEFT JOIN Airport a on a.airport_id = ca.airport_id
+            ''')
+        cityairports = cursor.fetchall()
+        cursor.execute("SELECT route_id, origin_cityairport_id, destination_cityairport_id, route_distance FROM Route")
+        routes = cursor.fetchall()
+    finally:
+        db_connection.release_connection(connection)
+    route_graph = RouteGraph(cityairports, routes)
+    logger.info(f"Route graph built with {len(route_graph.cityairports)} airports and {len(route_graph.routes)} routes "
+                f"in {time.perf_counter() - started:.3f}s")
+    return route_graph
+
+
+def get_route_graph(DB_FILE):
+    with _graphs_lock:
+        route_graph = _graphs.get(DB_FILE)
+        if route_graph is None or time.monotonic() - route_graph.built_at > db_cache.MAX_AGE_SECONDS:
+            route_graph = _graphs[DB_FILE] = build_route_graph(DB_FILE)
+        return route_graph
+
+
+def invalidate(DB_FILE):
+    with _graphs_lock:
+        _graphs.pop(DB_FILE, None)
+
+
+def _reference_tables_changed(DB_FILE, tables):
+    if {"City", "Airport", "CityAirport"} & set(tables):
+        invalidate(DB_FILE)
+
+
+db_cache.add_invalidation_listener(_reference_tables_changed)
+
+
+# called by db_set once a route change has been committed - only touches a graph that has already been built
+def route_added(DB_FILE, route_id, origin_cityairport_id, destination_cityairport_id, route_distance):
+    route_graph = _graphs.get(DB_FILE)
+    if route_graph is not None:
+        with route_graph.lock:
+            route_graph.add_route(route_id, origin_cityairport_id, destination_cityairport_id, route_distance)
+
+
+def route_deleted(DB_FILE, route_id):
+    route_graph = _graphs.get(DB_FILE)
+    if route_graph is not None:
+        with route_graph.lock:
+            route_graph.remove_route(route_id)
+
+
+def route_distance_changed(DB_FILE, route_id, route_distance):
+    route_graph = _graphs.get(DB_FILE)
+    if route_graph is not None and route_id in route_graph.routes:
+        origin, destination, _ = route_graph.routes[route_id]
+        with route_graph.lock:
+            route_graph.add_route(route_id, origin, destination, route_distance)
+
+
+def find_city_itineraries(DB_FILE, origin_city_id, destination_city_id, k=1, by="distance"):
+    route_graph = get_route_graph(DB_FILE)
+    return route_graph.find_itineraries(route_graph.city_nodes.get(origin_city_id, ()),
+                                        route_graph.city_nodes.get(destination_city_id, ()), k, by)
+
+
+def find_airport_itineraries(DB_FILE, origin_airport_code, destination_airport_code, k=1, by="distance"):
+    route_graph = get_route_graph(DB_FILE)
+    return route_graph.find_itineraries(route_graph.airport_code_nodes.get(origin_airport_code, ()),
+                                        route_graph.airport_code_nodes.get(destination_airport_code, ()), k, by)
@@ -1,5 +1,8 @@
-import inspect # imported to help log out where I am in the code
+import os
+import time
 import logging
+import functools
+import threading
 import importlib.util # needed for flask checking
 
 # Need to setup logging in utils
@@ -7,20 +10,100 @@ logger = logging.getLogger(__name__)
 
 logger.info("Started logging in utils.py")
 
-def log_active_function():
-    # I was finding myself doing a lot of "logging.info("Entering function ABC")" so wrote this helper function to automate it
-    # I didn't know how to do this so I looked up some solutions on stackoverflow
-    # https://stackoverflow.com/questions/10973362/python-logging-function-name-file-name-line-number-using-a-single-file
-    # the response dated Jun 11 2012 from Matthew Schinkel contained
-    # func = inspect.currentframe().f_back.f_code
-    # I then looked up how to get just the function name and added .co_name after reading the link below and experimenting
-    # https://stackoverflow.com/questions/5067604/determine-function-name-from-within-that-function
+# Function tracing
+# I used to call log_active_function() at the top of nearly every function, which walked the call stack with
+# inspect.currentframe().f_back to find the caller's name and wrote an INFO line on every single call.
+# Profiling showed that was a big chunk of the time spent in the check_* helpers, so it's now a decorator -
+#   @utils.trace
+#   def get_routes(DB_FILE):
+# the function name is worked out once when the module is imported rather than on every call, and the mode is
+# chosen with the BAMBI_TRACE environment variable before starting BAMBI -
+#   off   - (default) the decorator hands back the original function untouched, so it costs nothing at all
+#   log   - writes "Entered function - name" at INFO like log_active_function used to
+#   stats - as log, plus call counts and total time per function, see get_trace_stats
+TRACE_MODES = ("off", "log", "stats")
+TRACE_MODE = os.environ.get("BAMBI_TRACE", "off").lower()
+if TRACE_MODE not in TRACE_MODES:
+    logger.warning(f"Unknown BAMBI_TRACE mode {TRACE_MODE}, tracing turned off")
+    TRACE_MODE = "off"
 
-    active_function = inspect.currentframe().f_back.f_code.co_name
-    logger.info(f"Entered function - {active_function}")
+_trace_stats = {}
+_trace_stats_lock = threading.Lock()
+
+def trace(function):
+    # the mode is fixed at decoration time, so BAMBI_TRACE has to be set before BAMBI starts
+    if TRACE_MODE == "off":
+        return function
+
+    function_name = f"{function.__module__}.{function.__qualname__}"
+    entered_message = f"Entered function - {function.__name__}"
+
+    if TRACE_MODE == "log":
+        @functools.wraps(function)
+        def logged(*args, **kwargs):
+            logger.info(entered_message)
+            return function(*args, **kwargs)
+        return logged
+
+    @functools.wraps(function)
+    def timed(*args, **kwargs):
+        logger.info(entered_message)
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            with _trace_stats_lock:
+                function_stats = _trace_stats.setdefault(function_name, [0, 0.0])
+                function_stats[0] += 1
+                function_stats[1] += elapsed
+    return timed
+
+def get_trace_stats():
+    # {function name: (call count, total seconds)} - only populated when BAMBI_TRACE=stats
+    # bear in mind the times for the cli_* menu screens include the operator reading and typing
+    with _trace_stats_lock:
+        return {function_name: tuple(function_stats) for function_name, function_stats in _trace_stats.items()}
+
+def reset_trace_stats():
+    with _trace_stats_lock:
+        _trace_stats.clear()
+
+def log_trace_stats():
+    for function_name, (call_count, total_seconds) in sorted(get_trace_stats().items(), key=lambda item: -item[1][1]):
+        logger.info(f"{function_name}: {call_count} calls, {total_seconds:.4f}s total, {total_seconds / call_count * 1000:.3f}ms average")
+
+# Debug logging of result sets
+# logging.debug(f"... {rows}") builds the whole string even when DEBUG is off, and on big tables formatting the
+# row dump cost more than the query did. Pass the values as logging arguments instead so they are only formatted
+# if the record is actually written, and wrap result sets in sample_rows so only the first few rows are dumped -
+#   logging.debug("Returned %s", utils.sample_rows(returned_flights))
+LOG_ROW_SAMPLE_SIZE = 5
+
+class RowSample:
+    __slots__ = ("rows", "limit")
+
+    def __init__(self, rows, limit):
+        self.rows = rows
+        self.limit = limit
+
+    def __str__(self):
+        # only called by logging once it has decided to write the record
+        row_count = len(self.rows)
+        if row_count <= self.limit:
+            return repr(self.rows)
+        return f"{self.rows[:self.limit]!r} ... ({row_count - self.limit} more, {row_count} rows in total)"
+
+def sample_rows(rows, limit=LOG_ROW_SAMPLE_SIZE):
+    return RowSample(rows, limit)
 
 def check_flask():
     # checks if flask is installed, if not it won't even offer the web app as an option until it is
     flaskstatus = importlib.util.find_spec("flask")
     # if this evaluates true, allows usage of web-app mode
-    return flaskstatus is not None
\ No newline at end of file
+    return flaskstatus is not None
+
+def check_numpy():
+    # same idea as check_flask - numpy is optional, the batch arrival time maths falls back to plain python without it
+    numpystatus = importlib.util.find_spec("numpy")
+    return numpystatus is not None
\ No newline at end of file
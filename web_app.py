@@ -0,0 +1,427 @@
+import sys
+import json
+import time
+import logging
+import functools
+import flask
+import db_connection
+import db_cache
+import db_initialisation
+import db_migrations
+import db_get
+import db_set
+import great_circle
+import route_graph
+import route_feasibility
+import change_tracking
+import change_feed
+
+# BAMBI web mode
+# The CLI serves one operator at a time. This is the web option start_journey always meant to offer - a JSON API over
+# the same db_get/db_set functions the menus use, so the checks are the same whichever way a change comes in.
+# Only imported once utils.check_flask() has found Flask, bambi.py offers it as option 2.
+#
+# Flask's server is run threaded, one thread per request. Every request leases a connection from a
+# db_connection.ConnectionPool for as long as it runs, so the db_get/db_set calls it makes all use that one
+# connection (see ConnectionPool.connection) and threads that come and go don't each leave a connection open behind
+# them. Under WAL the readers never wait on each other or on a writer, and the flight list is a read of FlightBoard,
+# so lots of dispatchers can watch the board at once. Once every pooled connection is busy, a request waits up to
+# WEB_POOL_TIMEOUT seconds for one rather than opening more.
+#
+# Most reads are dashboards polling data that hasn't changed. Every GET endpoint names the tables it reads and its
+# ETag is made from their change_tracking counters, so
+#   - a client sending If-None-Match with the current ETag gets an empty 304 Not Modified
+#   - otherwise the last response built for that URL is reused if the counters still match
+# either way an unchanged read costs one primary key lookup rather than the query behind it.
+#
+#   GET    /api/flights?limit=20&after=<flight_id>&before=<flight_id>&origin_airport=LHR   (any db_get.FLIGHT_FILTERS)
+#   POST   /api/flights           {"flight_number", "aircraft_id", "pilot_id", "route_id", "schedule_id"}
+#   DELETE /api/flights/<id>
+#   GET    /api/routes            POST /api/routes {"origin_airport_id", "destination_airport_id", "route_distance"}
+#   DELETE /api/routes/<id>       GET /api/routes/<id>/aircraft
+#   GET    /api/pilots            POST /api/pilots {"pilot_name"}         DELETE /api/pilots/<id>
+#   GET    /api/aircraft          POST /api/aircraft {"aircraft_name", "aircraftmodel_id"}   DELETE /api/aircraft/<id>
+#   GET    /api/aircraftmodels    GET /api/cityairports    GET /api/schedules
+#   GET    /api/itineraries?origin_city_id=1&destination_city_id=6&k=3&by=distance
+#   GET    /api/flights/changes?after=<sequence>&wait=20    long poll of the flight change feed, see change_feed.py
+#   GET    /api/flights/changes/stream                       the same as server-sent events, resumes from Last-Event-ID
+#
+#   python web_app.py [database file] [port]
+
+logger = logging.getLogger(__name__)
+logger.info("Started logging in web_app.py")
+
+WEB_HOST = "127.0.0.1"
+WEB_PORT = 5000
+WEB_POOL_SIZE = 16
+WEB_POOL_TIMEOUT = 10
+MAX_FLIGHT_PAGE_SIZE = 500
+WEB_RESPONSE_CACHE_SIZE = 512
+MAX_FEED_WAIT_SECONDS = 30
+# a comment line sent down an idle event stream this often, so a client that has gone away is noticed
+FEED_HEARTBEAT_SECONDS = 15
+# the change feed waits between reads, so these lease a pooled connection per read rather than per request
+FEED_ENDPOINTS = ("flight_changes", "flight_change_stream")
+
+# column names for the rows db_get returns, so the API hands back objects rather than bare lists
+FLIGHT_COLUMNS = ("flight_id", "flight_number", "aircraft_name", "aircraftmodel_name", "captain",
+                  "origin_airport", "destination_airport", "departure_time", "arrival_time")
+ROUTE_COLUMNS = ("route_id", "origin_city", "origin_airport", "origin_airport_code", "destination_city",
+                 "destination_airport", "destination_airport_code", "route_distance")
+CITYAIRPORT_COLUMNS = ("city_id", "city_name", "airport_id", "airport_name", "airport_code")
+SCHEDULE_COLUMNS = ("schedule_id", "departure_time")
+AIRCRAFTMODEL_COLUMNS = ("aircraftmodel_id", "aircraftmodel_name", "aircraftmodel_range", "aircraftmodel_speed")
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def rows_to_dicts(rows, columns):
+    if rows is False:
+        raise ApiError("Database error, please check the log", 500)
+    return [dict(zip(columns, row)) for row in rows]
+
+
+def group_flight_ids(rows, id_column, name_column, flight_column):
+    # get_pilots and get_aircraft return a row per assigned flight - folded into one object with a list of flight ids
+    grouped = {}
+    for row in rows:
+        entry = grouped.setdefault(row[id_column], {"name": row[name_column], "row": row, "flight_ids": []})
+        if row[flight_column] is not None:
+            entry["flight_ids"].append(row[flight_column])
+    return grouped.values()
+
+
+def get_id(body, field, required=True):
+    value = body.get(field)
+    if value is None and not required:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ApiError(f"{field} must be a whole number")
+    return value
+
+
+def get_text(body, field, max_length):
+    value = body.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise ApiError(f"{field} is required")
+    return value.strip()[:max_length]
+
+
+def check_write(result, message="Database error, please check the log"):
+    # db_set functions return True on success and False or None when the write failed
+    if not result:
+        raise ApiError(message, 500)
+
+
+def create_app(DB_FILE):
+    app = flask.Flask(__name__)
+    app.json.sort_keys = False
+    pool = db_connection.ConnectionPool(DB_FILE, max_connections=WEB_POOL_SIZE, timeout=WEB_POOL_TIMEOUT)
+    # (DB_FILE, path and query string): (ETag, response body)
+    response_cache = db_cache.ReferenceCache(max_entries=WEB_RESPONSE_CACHE_SIZE)
+
+    @app.before_request
+    def lease_connection():
+        if flask.request.endpoint in FEED_ENDPOINTS:
+            return
+        lease = pool.connection()
+        lease.__enter__()
+        flask.g.connection_lease = lease
+
+    @app.teardown_request
+    def return_connection(exception):
+        lease = flask.g.pop("connection_lease", None)
+        if lease is not None:
+            lease.__exit__(None, None, None)
+
+    @app.errorhandler(ApiError)
+    def api_error(error):
+        return flask.jsonify({"error": error.message}), error.status
+
+    @app.errorhandler(TimeoutError)
+    def pool_timeout(error):
+        logger.warning(f"Web request gave up waiting for a connection - {error}")
+        return flask.jsonify({"error": "Server busy, please try again"}), 503
+
+    def request_body():
+        body = flask.request.get_json(silent=True)
+        if not isinstance(body, dict):
+            raise ApiError("Request body must be a JSON object")
+        return body
+
+    def query_id(name):
+        value = flask.request.args.get(name)
+        if value is None:
+            return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ApiError(f"{name} must be a whole number")
+
+    def conditional(*tables):
+        # tables is every table the endpoint reads, see the top of this file
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                # the counters are read before the query runs, so a stored body can be newer than its ETag but
+                # never older - the worst a write in between can cause is one extra rebuild
+                etag = change_tracking.version_tag(DB_FILE, tables)
+                if flask.request.if_none_match.contains(etag):
+                    response = flask.Response(status=304)
+                else:
+                    key = (DB_FILE, flask.request.full_path)
+                    found, cached_response = response_cache.get(key)
+                    if found and cached_response[0] == etag:
+                        response = flask.Response(cached_response[1], mimetype="application/json")
+                    else:
+                        response = view(*args, **kwargs)
+                        response_cache.put(key, frozenset(tables), (etag, response.get_data()))
+                response.set_etag(etag)
+                # clients may keep the response but have to check the ETag before using it again
+                response.headers["Cache-Control"] = "no-cache"
+                return response
+            return wrapper
+        return decorator
+
+    # flights
+
+    @app.get("/api/flights")
+    @conditional(*change_tracking.FLIGHT_LIST_TABLES)
+    def list_flights():
+        page_size = query_id("limit") or db_get.FLIGHT_PAGE_SIZE
+        page_size = max(1, min(page_size, MAX_FLIGHT_PAGE_SIZE))
+        filters = {column: value for column, value in flask.request.args.items() if column in db_get.FLIGHT_FILTERS}
+        flights = rows_to_dicts(db_get.get_flights_page(DB_FILE, page_size, after_flight_id=query_id("after"),
+                                                        before_flight_id=query_id("before"), filters=filters), FLIGHT_COLUMNS)
+        return flask.jsonify({
+            "flights": flights,
+            # where the next/previous page starts, if the caller wants it - the same keyset paging the CLI uses
+            "next_after": flights[-1]["flight_id"] if len(flights) == page_size else None,
+            "previous_before": flights[0]["flight_id"] if flights else None,
+        })
+
+    @app.post("/api/flights")
+    def add_flight():
+        body = request_body()
+        candidate_flight = {
+            "flight_number": get_text(body, "flight_number", 6),
+            "aircraft_id": get_id(body, "aircraft_id"),
+            "pilot_id": get_id(body, "pilot_id"),
+            "route_id": get_id(body, "route_id"),
+            "schedule_id": get_id(body, "schedule_id"),
+        }
+        # add_flights runs every check the (F) add flight screen does - existence, range and double-booking
+        result = db_set.add_flights(DB_FILE, [candidate_flight])
+        check_write(result)
+        inserted_flight_count, rejections = result
+        if rejections:
+            raise ApiError(rejections[0][2], 409)
+        return flask.jsonify({"added": inserted_flight_count}), 201
+
+    @app.get("/api/flights/changes")
+    def flight_changes():
+        # with no after, just says where the feed is up to so the caller can start from there
+        after_sequence = query_id("after")
+        if after_sequence is None:
+            with pool.connection():
+                return flask.jsonify({"changes": [], "last_sequence": change_feed.get_latest_sequence(DB_FILE), "reset": False})
+        wait = max(0, min(query_id("wait") or 0, MAX_FEED_WAIT_SECONDS))
+        changes, reset = change_feed.wait_for_changes(DB_FILE, after_sequence, wait, connection_lease=pool.connection)
+        return flask.jsonify({"changes": changes, "last_sequence": changes[-1]["sequence"] if changes else after_sequence,
+                              "reset": reset})
+
+    @app.get("/api/flights/changes/stream")
+    def flight_change_stream():
+        after_sequence = flask.request.headers.get("Last-Event-ID") or flask.request.args.get("after")
+        try:
+            after_sequence = int(after_sequence) if after_sequence is not None else None
+        except ValueError:
+            raise ApiError("Last-Event-ID must be a change sequence number")
+        if after_sequence is None:
+            with pool.connection():
+                after_sequence = change_feed.get_latest_sequence(DB_FILE)
+
+        def events(after_sequence):
+            # ends when the client disconnects - the next write raises and the server closes the generator
+            last_sent = time.monotonic()
+            while True:
+                changes, reset = change_feed.wait_for_changes(DB_FILE, after_sequence, FEED_HEARTBEAT_SECONDS,
+                                                              connection_lease=pool.connection)
+                if reset:
+                    yield "event: reset\ndata: {}\n\n"
+                for change in changes:
+                    yield f"id: {change['sequence']}\nevent: {change['change']}\ndata: {json.dumps(change)}\n\n"
+                    after_sequence = change["sequence"]
+                if changes or reset:
+                    last_sent = time.monotonic()
+                elif time.monotonic() - last_sent >= FEED_HEARTBEAT_SECONDS:
+                    yield ": heartbeat\n\n"
+                    last_sent = time.monotonic()
+
+        return flask.Response(events(after_sequence), mimetype="text/event-stream",
+                              headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+    @app.delete("/api/flights/<int:flight_id>")
+    def delete_flight(flight_id):
+        if not db_get.check_valid_flight(DB_FILE, flight_id):
+            raise ApiError(f"Flight {flight_id} does not exist", 404)
+        check_write(db_set.delete_flight(DB_FILE, flight_id))
+        return flask.jsonify({"deleted": flight_id})
+
+    # routes
+
+    @app.get("/api/routes")
+    @conditional("Route", "City", "Airport", "CityAirport")
+    def list_routes():
+        return flask.jsonify({"routes": rows_to_dicts(db_get.get_routes(DB_FILE), ROUTE_COLUMNS)})
+
+    @app.post("/api/routes")
+    def add_route():
+        body = request_body()
+        origin_airport_id = get_id(body, "origin_airport_id")
+        destination_airport_id = get_id(body, "destination_airport_id")
+        route_distance = get_id(body, "route_distance", required=False)
+        for airport_id in (origin_airport_id, destination_airport_id):
+            if not db_get.check_valid_airport(DB_FILE, airport_id):
+                raise ApiError(f"Airport {airport_id} does not exist", 404)
+        if db_get.check_existing_route(DB_FILE, origin_airport_id, destination_airport_id):
+            raise ApiError("The route already exists", 409)
+        if route_distance is None:
+            # left out, the same great-circle suggestion the CLI offers
+            route_distance = great_circle.suggest_route_distance(DB_FILE, origin_airport_id, destination_airport_id)
+            if route_distance is None:
+                raise ApiError("route_distance is required, the airports don't have coordinates to work it out")
+        if route_distance <= 0:
+            raise ApiError("route_distance must be positive")
+        origin_cityairport_id = db_get.get_cityairport_for_airport(DB_FILE, origin_airport_id)[0]
+        destination_cityairport_id = db_get.get_cityairport_for_airport(DB_FILE, destination_airport_id)[0]
+        check_write(db_set.add_route(DB_FILE, origin_cityairport_id, destination_cityairport_id, route_distance))
+        return flask.jsonify({"route_distance": route_distance}), 201
+
+    @app.delete("/api/routes/<int:route_id>")
+    def delete_route(route_id):
+        if not db_get.check_valid_route(DB_FILE, route_id):
+            raise ApiError(f"Route {route_id} does not exist", 404)
+        if db_get.check_attribute_in_flight(DB_FILE, "route_id", route_id):
+            raise ApiError(f"Route {route_id} is used by a flight - cannot delete", 409)
+        check_write(db_set.delete_route(DB_FILE, route_id))
+        return flask.jsonify({"deleted": route_id})
+
+    @app.get("/api/routes/<int:route_id>/aircraft")
+    @conditional("Route", "AircraftModel", "Aircraft")
+    def route_aircraft(route_id):
+        if not db_get.check_valid_route(DB_FILE, route_id):
+            raise ApiError(f"Route {route_id} does not exist", 404)
+        return flask.jsonify({"aircraftmodel_ids": route_feasibility.models_for_route(DB_FILE, route_id),
+                              "aircraft_ids": route_feasibility.aircraft_for_route(DB_FILE, route_id)})
+
+    @app.get("/api/itineraries")
+    @conditional("Route", "City", "Airport", "CityAirport")
+    def itineraries():
+        origin_city_id = query_id("origin_city_id")
+        destination_city_id = query_id("destination_city_id")
+        if origin_city_id is None or destination_city_id is None:
+            raise ApiError("origin_city_id and destination_city_id are required")
+        k = max(1, min(query_id("k") or 1, 10))
+        try:
+            found_itineraries = route_graph.find_city_itineraries(DB_FILE, origin_city_id, destination_city_id, k,
+                                                                  flask.request.args.get("by", "distance"))
+        except ValueError as exc:
+            raise ApiError(str(exc))
+        return flask.jsonify({"itineraries": found_itineraries})
+
+    # pilots
+
+    @app.get("/api/pilots")
+    @conditional("Pilot", "Flight")
+    def list_pilots():
+        pilot_rows = db_get.get_pilots(DB_FILE)
+        if pilot_rows is False:
+            raise ApiError("Database error, please check the log", 500)
+        return flask.jsonify({"pilots": [{"pilot_id": pilot["row"][0], "pilot_name": pilot["name"], "flight_ids": pilot["flight_ids"]}
+                                         for pilot in group_flight_ids(pilot_rows, 0, 1, 2)]})
+
+    @app.post("/api/pilots")
+    def add_pilot():
+        check_write(db_set.add_pilot(DB_FILE, get_text(request_body(), "pilot_name", 50)))
+        return flask.jsonify({"added": 1}), 201
+
+    @app.delete("/api/pilots/<int:pilot_id>")
+    def delete_pilot(pilot_id):
+        if not db_get.check_valid_pilot_id(DB_FILE, pilot_id):
+            raise ApiError(f"Pilot {pilot_id} does not exist", 404)
+        if db_get.check_attribute_in_flight(DB_FILE, "pilot_id", pilot_id):
+            raise ApiError(f"Pilot {pilot_id} is assigned to a flight - cannot delete an assigned pilot", 409)
+        check_write(db_set.delete_pilot(DB_FILE, pilot_id))
+        return flask.jsonify({"deleted": pilot_id})
+
+    # aircraft
+
+    @app.get("/api/aircraft")
+    @conditional("Aircraft", "AircraftModel", "Flight")
+    def list_aircraft():
+        aircraft_rows = db_get.get_aircraft(DB_FILE)
+        if aircraft_rows is False:
+            raise ApiError("Database error, please check the log", 500)
+        return flask.jsonify({"aircraft": [{"aircraft_id": aircraft["row"][0], "aircraft_name": aircraft["name"],
+                                            "aircraftmodel_id": aircraft["row"][2], "aircraftmodel_name": aircraft["row"][3],
+                                            "aircraftmodel_range": aircraft["row"][5], "flight_ids": aircraft["flight_ids"]}
+                                           for aircraft in group_flight_ids(aircraft_rows, 0, 1, 4)]})
+
+    @app.post("/api/aircraft")
+    def add_aircraft():
+        body = request_body()
+        aircraft_name = get_text(body, "aircraft_name", 50)
+        aircraftmodel_id = get_id(body, "aircraftmodel_id")
+        if not db_get.check_valid_aircraftmodel(DB_FILE, aircraftmodel_id):
+            raise ApiError(f"Aircraft model {aircraftmodel_id} does not exist", 404)
+        check_write(db_set.add_aircraft(DB_FILE, aircraft_name, aircraftmodel_id))
+        return flask.jsonify({"added": 1}), 201
+
+    @app.delete("/api/aircraft/<int:aircraft_id>")
+    def delete_aircraft(aircraft_id):
+        if not db_get.check_valid_aircraft(DB_FILE, aircraft_id):
+            raise ApiError(f"Aircraft {aircraft_id} does not exist", 404)
+        if db_get.check_attribute_in_flight(DB_FILE, "aircraft_id", aircraft_id):
+            raise ApiError(f"Aircraft {aircraft_id} is assigned to a flight - cannot delete", 409)
+        check_write(db_set.delete_aircraft(DB_FILE, aircraft_id))
+        return flask.jsonify({"deleted": aircraft_id})
+
+    @app.get("/api/aircraftmodels")
+    @conditional("AircraftModel")
+    def list_aircraftmodels():
+        return flask.jsonify({"aircraftmodels": rows_to_dicts(db_get.get_aircraftmodels(DB_FILE), AIRCRAFTMODEL_COLUMNS)})
+
+    # reference data
+
+    @app.get("/api/cityairports")
+    @conditional("City", "Airport", "CityAirport")
+    def list_cityairports():
+        return flask.jsonify({"cityairports": rows_to_dicts(db_get.get_cities_airports(DB_FILE), CITYAIRPORT_COLUMNS)})
+
+    @app.get("/api/schedules")
+    @conditional("Schedule")
+    def list_schedules():
+        return flask.jsonify({"schedules": rows_to_dicts(db_get.get_schedules(DB_FILE), SCHEDULE_COLUMNS)})
+
+    return app
+
+
+def run(DB_FILE, host=WEB_HOST, port=WEB_PORT):
+    logger.info(f"Starting web mode on {host}:{port} with {WEB_POOL_SIZE} pooled connections to {DB_FILE}")
+    print(f"BAMBI web mode running on http://{host}:{port}/api/flights - press Ctrl+C to stop")
+    create_app(DB_FILE).run(host=host, port=port, threaded=True)
+
+
+if __name__ == "__main__":
+    DB_FILE = sys.argv[1] if len(sys.argv) > 1 else "bambi.db"
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else WEB_PORT
+    # the same startup as bambi.py - create/seed the database if needed and bring its schema up to date
+    db_initialisation.init(DB_FILE)
+    db_migrations.migrate(DB_FILE)
+    run(DB_FILE, port=port)